@@ -1,69 +1,285 @@
+import asyncio
+import json
 import logging
-import random
 import time
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Path, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
 
-from domain.client_json import DescriptionRequest, PlayRequest
-from service.description_service import DescriptionService
+from domain.client_json import DescriptionRequest, PlayRequest, GameDescriptionRequest
+from domain.entities import StockfishResult
+from domain.opening_book import OpeningBook
+from domain.repository import Repository
+from engine.engine_pool import EnginePool, AsyncEnginePool
+from engine.engine_profile import EngineProfiles
+from engine.evaluation_cache import EvaluationCache
+from engine.opening_evaluations import OpeningEvaluations, EVALUATIONS_PATH
+from service.description_service import DescriptionService, get_game_fen_stack
+from service.puzzle_sampler import PuzzleSampler, PuzzleIndexError
 from service.puzzle_service import PuzzleService
 from service.stockfish_service import StockfishService
-from util import utils
+from util import utils, metrics, profiler
+from util.shared_store import SharedStore
 
 app = FastAPI()
 utils.configure_app(app)
-puzzle_service = PuzzleService()
-description_service = DescriptionService()
-stockfish_service = StockfishService()
+workers = utils.get_workers('SERVER')
+# None sizes the pools from the worker's share of the cores, see EngineProfiles.get_pool_sizes
+pool_size = utils.read_config('ENGINE', 'pool_size', fallback=None)
+pool_size = int(pool_size) if pool_size is not None else None
+parallel_description = utils.read_config('DESCRIPTION', 'parallel', fallback='false').lower() == 'true'
+description_deadline = float(utils.read_config('DESCRIPTION', 'deadline', fallback=0)) or None
+health_check_interval = float(utils.read_config('ENGINE', 'health_check_interval', fallback=60))
+
+# built by each worker once it starts rather than on import, so the process uvicorn spawns the workers from doesn't
+# start engines and database pools of its own
+engine_pool: EnginePool = None
+evaluation_cache: EvaluationCache = None
+puzzle_service: PuzzleService = None
+stockfish_service: StockfishService = None
+description_service: DescriptionService = None
+health_check: asyncio.Future = None
 
 FORMAT = '%(asctime)-15s %(message)s'
 logging.basicConfig(format=FORMAT)
 logger = logging.getLogger('chapi')
 
 
+def create_shared_store():
+    """
+    The store the workers share puzzle indexes, statistics and openings through, only needed with several workers
+    unless [SERVER] shared_store names one.
+    """
+    path = utils.read_config('SERVER', 'shared_store', fallback='shared.db' if workers > 1 else None)
+    return SharedStore(path) if path else None
+
+
+def read_wait_ranges():
+    """
+    The /play response time range of each difficulty, "low,high" in seconds from [PLAY] wait_<difficulty> or else
+    [PLAY] wait.
+    """
+    wait_ranges = {}
+    default = utils.read_config('PLAY', 'wait', fallback=None)
+    for difficulty in range(1, StockfishService.DEFAULT_DIFFICULTY + 1):
+        wait_range = utils.read_config('PLAY', 'wait_{}'.format(difficulty), fallback=default)
+        if wait_range is not None:
+            wait_ranges[difficulty] = tuple(float(bound) for bound in wait_range.split(','))
+    return wait_ranges
+
+
+@app.on_event("startup")
+async def create_services():
+    global engine_pool, evaluation_cache, puzzle_service, stockfish_service, description_service, health_check
+    shared_store = create_shared_store()
+    profiles = EngineProfiles.from_config(utils.CONFIG_FILE)
+    async_pool_size = utils.read_config('ENGINE', 'async_pool_size', fallback=None)
+    sync_pool_size, async_pool_size = profiles.get_pool_sizes(
+        utils.get_cpus_per_worker(workers), pool_size, int(async_pool_size) if async_pool_size is not None else None)
+    engine_pool = EnginePool(sync_pool_size)
+    evaluation_cache = EvaluationCache(
+        int(utils.read_config('CACHE', 'size', fallback=EvaluationCache.DEFAULT_SIZE)),
+        utils.read_config('CACHE', 'path', fallback='evaluations.db' if workers > 1 else None)
+    )
+    puzzle_service = PuzzleService(shared_store)
+    stockfish_service = StockfishService(engine_pool, evaluation_cache=evaluation_cache,
+                                         wait_ranges=read_wait_ranges(),
+                                         profiles=profiles,
+                                         shed_load=utils.read_config('ENGINE', 'shed_load',
+                                                                     fallback='false').lower() == 'true',
+                                         opening_evaluations=OpeningEvaluations.from_tsv(
+                                             utils.read_config('CACHE', 'opening_evaluations',
+                                                               fallback=EVALUATIONS_PATH)))
+    description_service = DescriptionService(stockfish_service,
+                                             OpeningBook.from_repository(Repository(), shared_store))
+
+    stockfish_service.async_engine_pool = await AsyncEnginePool.open(async_pool_size)
+    register_metrics()
+    health_check = asyncio.ensure_future(check_engines_periodically())
+
+
+async def check_engines_periodically():
+    """
+    Replace idle engines which died between requests, rather than leaving it to the next checkout to find out.
+    """
+    while True:
+        await asyncio.sleep(health_check_interval)
+        try:
+            await profiler.run_in_threadpool(engine_pool.health_check)
+        except Exception as e:
+            logger.warning("Couldn't check the Stockfish engines... " + str(e))
+
+
+def register_metrics():
+    engines_busy = metrics.REGISTRY.gauge('chapi_engines_busy', "Stockfish engines checked out of each pool", ['pool'])
+    engines_busy.set_function(engine_pool.get_busy, 'sync')
+    engines_busy.set_function(stockfish_service.async_engine_pool.get_busy, 'async')
+    metrics.REGISTRY.gauge('chapi_engines_waiting', "Searches queueing for an engine of the sync pool").set_function(
+        lambda: engine_pool.waiting)
+    engines = metrics.REGISTRY.gauge('chapi_engines', "Stockfish engines in each pool", ['pool'])
+    engines.set_function(lambda: engine_pool.size, 'sync')
+    engines.set_function(lambda: stockfish_service.async_engine_pool.size, 'async')
+    metrics.register_cache('chapi_evaluation_cache', evaluation_cache)
+
+
+@app.on_event("shutdown")
+async def close_engines():
+    health_check.cancel()
+    puzzle_service.stop()
+    engine_pool.close()
+    await stockfish_service.async_engine_pool.close()
+    evaluation_cache.close()
+
+
+@app.exception_handler(PuzzleIndexError)
+async def handle_puzzle_index_error(request: Request, e: PuzzleIndexError):
+    return JSONResponse(status_code=503, content={'detail': str(e)})
+
+
 @app.get("/single_move/{type_name}")
 async def get_random_single_move_puzzle(type_name):
     try:
-        return puzzle_service.get_single_move_puzzle(type_name)
+        return (await puzzle_service.get_single_move_puzzles_async(type_name))[0]
+    except RuntimeError as e:
+        logger.warning(e)
+
+
+@app.get("/single_move/{type_name}/{k}")
+async def get_random_single_move_puzzles(type_name, k: int = Path(ge=1, le=PuzzleSampler.MAX_K)):
+    try:
+        return await puzzle_service.get_single_move_puzzles_async(type_name, k)
     except RuntimeError as e:
         logger.warning(e)
 
 
 @app.get("/mate_in/{n}")
-async def get_mate_in_n_puzzle(n):
+async def get_mate_in_n_puzzle(n: int):
     try:
-        return puzzle_service.get_mate_in_n_puzzle(int(n))
+        return (await puzzle_service.get_mate_in_n_puzzles_async(n))[0]
+    except RuntimeError as e:
+        logger.warning(e)
+
+
+@app.get("/mate_in/{n}/{k}")
+async def get_mate_in_n_puzzles(n: int, k: int = Path(ge=1, le=PuzzleSampler.MAX_K)):
+    try:
+        return await puzzle_service.get_mate_in_n_puzzles_async(n, k)
     except RuntimeError as e:
         logger.warning(e)
 
 
 @app.get("/statistics")
-async def get_statistics():
+async def get_statistics(request: Request, response: Response):
     try:
-        return puzzle_service.get_type_statistics()
+        statistics, etag = puzzle_service.get_type_statistics_snapshot()
+        if statistics is None:
+            return JSONResponse(status_code=503, content={'detail': "The statistics haven't been computed yet"})
+        if request.headers.get('if-none-match') == etag:
+            return Response(status_code=304, headers={'ETag': etag})
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache'
+        return statistics
     except RuntimeError as e:
         logger.warning(e)
 
 
+@app.get("/cache/statistics")
+async def get_cache_statistics():
+    return evaluation_cache.statistics()
+
+
 @app.post("/description")
 async def get_move_description(request: DescriptionRequest):
     try:
-        return description_service.get_description(request)
+        if parallel_description:
+            return await description_service.get_description_async(request, description_deadline)
+        return await profiler.run_in_threadpool(description_service.get_description, request,
+                                                deadline=description_deadline)
     except RuntimeError as e:
         logger.warning(e)
 
 
+@app.post("/description/game")
+async def get_game_descriptions(request: GameDescriptionRequest):
+    """
+    Describe every ply of a game, streamed as one JSON line per ply as soon as it is ready. The game is checked
+    before the stream starts, so an illegal move or a mismatched fenStack is a 422 rather than an empty 200.
+    """
+    try:
+        fen_stack = get_game_fen_stack(request)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    lines = (json.dumps(response) + '\n' for response in description_service.get_game_descriptions(request,
+                                                                                                     fen_stack))
+    return StreamingResponse(lines, media_type='application/x-ndjson')
+
+
 @app.post("/play")
 async def play_stockfish(request: PlayRequest):
     try:
-        result = stockfish_service.get_stockfish_play_result(request)
+        started = time.monotonic()
+        result = await stockfish_service.get_stockfish_play_result_async(request)
         if request.wait is not None and request.wait:
-            time.sleep(random.randrange(0, 15) // 10)
+            # the engine's own search counts towards the wait, only the rest of it is slept without blocking the loop
+            elapsed = time.monotonic() - started
+            await asyncio.sleep(max(0.0, stockfish_service.get_wait_time(request.difficulty) - elapsed))
         return result
     except RuntimeError as e:
         logger.warning(e)
 
 
+@app.websocket("/play/stream")
+async def stream_play_stockfish(websocket: WebSocket):
+    """
+    Receive a PlayRequest as JSON, then send the engine's progress while it searches and the play result last. Any
+    message from the client stops the search early with the best move found so far. A first message which isn't a
+    PlayRequest gets the reason back before the socket is closed with 1008.
+    """
+
+    await websocket.accept()
+    try:
+        request = PlayRequest(**await websocket.receive_json())
+    except ValidationError as e:
+        await reject_play_request(websocket, jsonable_encoder(e.errors(), custom_encoder={Exception: str}))
+        return
+    except (ValueError, TypeError) as e:
+        # not JSON, or JSON which isn't an object
+        await reject_play_request(websocket, str(e))
+        return
+    stop = asyncio.Event()
+    receiver = asyncio.ensure_future(receive_stop(websocket, stop))
+    messages = stockfish_service.stream_stockfish_play_result_async(request, stop)
+    try:
+        async for message in messages:
+            if not stop.is_set() or isinstance(message, StockfishResult):
+                await websocket.send_json(jsonable_encoder(message))
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # closing the generator stops a search the client went away from and returns its engine to the pool
+        receiver.cancel()
+        await messages.aclose()
+
+
+async def reject_play_request(websocket: WebSocket, detail):
+    """
+    Tell the client why its first message isn't a PlayRequest and close the socket as a policy violation.
+    """
+    await websocket.send_json({'detail': detail})
+    await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+
+
+async def receive_stop(websocket: WebSocket, stop: asyncio.Event):
+    try:
+        await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    stop.set()
+
+
 if __name__ == "__main__":
-    uvicorn.run("chapi:app", host="127.0.0.1", port=5000, log_level="info", workers=1)
+    uvicorn.run("chapi:app", host="127.0.0.1", port=5000, log_level="info", workers=workers)
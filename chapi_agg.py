@@ -4,25 +4,85 @@ import uvicorn
 from fastapi import FastAPI
 
 from domain.client_json import AggregationRequest
-from service.gpt2_service import GPT2Service
-from util import utils
+from service.aggregation_batcher import AggregationBatcher
+from service.paraphrase_cache import ParaphraseCache
+from service.paraphrase_model import ParaphraseModel
+from util import utils, metrics
 
 app = FastAPI()
 utils.configure_app(app)
-gpt2_service = GPT2Service('checkpoint')
+workers = utils.get_workers('AGGREGATION')
+
+
+def create_paraphrase_model() -> ParaphraseModel:
+    """
+    The GPT-2 backend named by [AGGREGATION] backend, each imported only when selected so the ONNX backend never
+    loads TensorFlow. With several workers each model's threads are limited to the worker's share of the cores.
+    """
+    max_new_tokens = utils.read_config('AGGREGATION', 'max_new_tokens', fallback=None)
+    max_new_tokens = int(max_new_tokens) if max_new_tokens else None
+    threads = int(utils.read_config('AGGREGATION', 'threads',
+                                    fallback=utils.get_cpus_per_worker(workers) if workers > 1 else 0))
+    if utils.read_config('AGGREGATION', 'backend', fallback='tf') == 'onnx':
+        from service.gpt2_onnx_service import GPT2OnnxService
+        return GPT2OnnxService(utils.read_config('AGGREGATION', 'onnx_model', fallback=GPT2OnnxService.DEFAULT_MODEL),
+                               max_new_tokens, threads)
+    from service.gpt2_service import GPT2Service
+    return GPT2Service('checkpoint', max_new_tokens, threads)
+
+
+# loaded by each worker once it starts rather than on import, so the process uvicorn spawns the workers from doesn't
+# load a model of its own
+gpt2_service: ParaphraseModel = None
+aggregation_batcher: AggregationBatcher = None
+paraphrase_cache: ParaphraseCache = None
 
 FORMAT = '%(asctime)-15s %(message)s'
 logging.basicConfig(format=FORMAT)
 logger = logging.getLogger('chapi_agg')
 
 
+@app.on_event("startup")
+async def start_batcher():
+    global gpt2_service, aggregation_batcher, paraphrase_cache
+    gpt2_service = create_paraphrase_model()
+    aggregation_batcher = AggregationBatcher(
+        gpt2_service,
+        int(utils.read_config('AGGREGATION', 'max_batch_size', fallback=AggregationBatcher.DEFAULT_MAX_BATCH_SIZE)),
+        float(utils.read_config('AGGREGATION', 'max_wait', fallback=AggregationBatcher.DEFAULT_MAX_WAIT))
+    )
+    paraphrase_cache = ParaphraseCache(
+        aggregation_batcher.submit,
+        int(utils.read_config('AGGREGATION', 'cache_size', fallback=ParaphraseCache.DEFAULT_SIZE)),
+        int(utils.read_config('AGGREGATION', 'pool_size', fallback=ParaphraseCache.DEFAULT_POOL_SIZE)),
+        utils.read_config('AGGREGATION', 'cache_path', fallback=None)
+    )
+    aggregation_batcher.start()
+    metrics.register_cache('chapi_paraphrase_cache', paraphrase_cache)
+    metrics.REGISTRY.gauge('chapi_paraphrase_in_flight', "Paraphrases being generated").set_function(
+        lambda: len(paraphrase_cache.in_flight))
+    metrics.REGISTRY.gauge('chapi_aggregation_queue', "Requests waiting for a GPT-2 batch").set_function(
+        lambda: aggregation_batcher.queue.qsize())
+
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    await aggregation_batcher.stop()
+    paraphrase_cache.save()
+
+
+@app.get("/cache/statistics")
+async def get_cache_statistics():
+    return paraphrase_cache.statistics()
+
+
 @app.post("/aggregation")
 async def get_move_aggregation(request: AggregationRequest):
     try:
-        return gpt2_service.aggregate_sentence(request)
+        return await paraphrase_cache.aggregate(request)
     except RuntimeError as e:
         logger.warning(e)
 
 
 if __name__ == "__main__":
-    uvicorn.run("chapi_agg:app", host="127.0.0.1", port=5005, log_level="info", workers=1)
+    uvicorn.run("chapi_agg:app", host="127.0.0.1", port=5005, log_level="info", workers=workers)
@@ -0,0 +1,341 @@
+"""
+ Replay game traces built from the opening book against chapi and chapi_agg in process, with a SQLite stand in for
+ MySQL and optionally a stub paraphrase model, and report latency percentiles, throughput and the time spent in each
+ stage as JSON. Run from the repository root, e.g. PYTHONPATH=. python data/benchmark_chapi.py
+"""
+
+import argparse
+import asyncio
+import datetime
+import functools
+import inspect
+import json
+import os
+import random
+import re
+import subprocess
+import tempfile
+import time
+
+import chess
+import httpx
+import sqlalchemy as db
+from sqlalchemy.orm import Session
+
+from domain.entities import Base, SingleMove, MateInN, Opening
+from domain.opening_book import OpeningBook
+from service.paraphrase_model import ParaphraseModel
+
+PUZZLE_TYPES = ['blunder', 'gain', 'fork', 'pin']
+MATE_COUNTS = range(1, 6)
+CONFIG = """[DB_CREDENTIALS]
+url=sqlite:///{database}
+
+[ENGINE]
+pool_size={engines}
+async_pool_size={engines}
+
+[AGGREGATION]
+max_batch_size={batch_size}
+"""
+
+
+class WordEncoder:
+    """
+    Lossless word level stand in for the GPT-2 BPE encoder, ids are handed out as new words are seen.
+    """
+
+    def __init__(self):
+        self.encoder = {ParaphraseModel.EOS_TAG: 0}
+        self.decoder = [ParaphraseModel.EOS_TAG]
+
+    def encode(self, text: str) -> list:
+        tokens = []
+        for word in re.findall(r'\S+|\s+', text):
+            if word not in self.encoder:
+                self.encoder[word] = len(self.decoder)
+                self.decoder.append(word)
+            tokens.append(self.encoder[word])
+        return tokens
+
+    def decode(self, tokens) -> str:
+        return ''.join(self.decoder[token] for token in tokens)
+
+
+class StubParaphraseModel(ParaphraseModel):
+    """
+    Echoes the original back as its paraphrase, taking token_latency seconds per generated token to stand in for
+    GPT-2's decode loop.
+    """
+
+    def __init__(self, token_latency):
+        encoder = WordEncoder()
+        super().__init__(encoder, encoder.encoder[self.EOS_TAG])
+        self.token_latency = token_latency
+
+    def sample(self, prompts: list, length: int) -> list:
+        rows = []
+        for prompt in prompts:
+            original = self.encoder.decode(prompt)[len('ORIGINAL: '):].rstrip('\n')
+            rows.append(prompt + self.encoder.encode('PARAPHRASED: ' + original + '\n')[:length])
+        time.sleep(self.token_latency * max(len(row) - len(prompt) for row, prompt in zip(rows, prompts)))
+        return rows
+
+
+class Timings:
+    """
+    Latencies in seconds grouped by name, for the endpoints and for the stages timed inside them.
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, name, latency, error=False):
+        self.latencies.setdefault(name, []).append(latency)
+        if error:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summarise(self, wall_time) -> dict:
+        return {name: {'count': len(latencies),
+                       'errors': self.errors.get(name, 0),
+                       'rps': len(latencies) / wall_time,
+                       'mean_ms': sum(latencies) / len(latencies) * 1000,
+                       'p50_ms': percentile(latencies, 50) * 1000,
+                       'p95_ms': percentile(latencies, 95) * 1000,
+                       'p99_ms': percentile(latencies, 99) * 1000,
+                       'total_s': sum(latencies)}
+                for name, latencies in sorted(self.latencies.items())}
+
+
+def percentile(values: list, q) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+
+def timed(stages: Timings, name, function):
+    """
+    Wrap a function or coroutine function so every call's duration is recorded as the named stage.
+    """
+
+    if inspect.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                stages.add(name, time.perf_counter() - start)
+    else:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stages.add(name, time.perf_counter() - start)
+    return wrapper
+
+
+def instrument(stages: Timings):
+    from domain.repository import Repository
+    from engine.stockfish import Engine, AsyncEngine
+    from service.description_service import DescriptionService
+
+    for owner, method, name in [(Engine, 'analyse', 'stockfish.analyse'),
+                                (Engine, 'play', 'stockfish.play'),
+                                (Engine, 'play_lines', 'stockfish.play'),
+                                (AsyncEngine, 'analyse', 'stockfish.analyse'),
+                                (AsyncEngine, 'play', 'stockfish.play'),
+                                (AsyncEngine, 'play_lines', 'stockfish.play'),
+                                (Repository, 'query_single_moves_by_ids', 'db.single_move'),
+                                (Repository, 'query_mate_in_n_by_ids', 'db.mate_in_n'),
+                                (Repository, 'get_type_statistics', 'db.statistics'),
+                                (DescriptionService, 'get_description', 'description'),
+                                (StubParaphraseModel, 'generate_batch', 'paraphrase.generate_batch')]:
+        setattr(owner, method, timed(stages, name, getattr(owner, method)))
+
+
+def seed_database(path, opening_book: OpeningBook, puzzles: int):
+    """
+    Create the chess_db tables in a SQLite file, with the opening book and puzzles built from its positions.
+    """
+
+    engine = db.create_engine('sqlite:///' + path)
+    Base.metadata.create_all(engine, tables=[SingleMove.__table__, MateInN.__table__])
+    # several openings share an ECO code, so the table is created without the entity's primary key
+    opening_table = db.Table(Opening.__tablename__, db.MetaData(),
+                             *[db.Column(column.name, column.type) for column in Opening.__table__.columns])
+    opening_table.create(engine)
+
+    openings = opening_book.query_opening_by_move_stack_subset('', plies=100)
+    with Session(bind=engine) as session:
+        session.execute(db.insert(opening_table), openings)
+        for i in range(puzzles):
+            board = get_board(random.choice(openings)['move_stack'].split())
+            starting_fen = board.fen()
+            to_move = 'white' if board.turn else 'black'
+            move = random.choice(list(board.legal_moves))
+            board.push(move)
+            session.add(SingleMove(id=i + 1, gain=random.random(), starting_fen=starting_fen, ending_fen=board.fen(),
+                                   type=PUZZLE_TYPES[i % len(PUZZLE_TYPES)], move=move.uci(), to_move=to_move,
+                                   follow_move=None))
+            session.add(MateInN(id=i + 1, starting_fen=starting_fen, to_move=to_move,
+                                moves_to_mate=MATE_COUNTS[i % len(MATE_COUNTS)], game_id=None))
+        session.commit()
+
+
+def get_board(move_stack: list) -> chess.Board:
+    board = chess.Board()
+    for uci in move_stack:
+        board.push_uci(uci)
+    return board
+
+
+def get_traces(opening_book: OpeningBook, games: int, plies: int) -> list:
+    """
+    The move stacks of the longest opening lines, cycled to make up the number of games.
+    """
+    lines = sorted({opening['move_stack'] for opening in opening_book.query_opening_by_move_stack_subset('', 100)},
+                   key=lambda line: -len(line.split()))
+    return [lines[i % len(lines)].split()[:plies] for i in range(games)]
+
+
+async def request(client: httpx.AsyncClient, timings: Timings, name, method, url, **kwargs):
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+        timings.add(name, time.perf_counter() - start, response.status_code >= 400)
+        return response.json() if response.status_code < 400 else None
+    except Exception:
+        timings.add(name, time.perf_counter() - start, True)
+        return None
+
+
+async def play_game(client, aggregation_client, timings: Timings, moves: list, args):
+    """
+    Replay a game the way chex-web drives it: the user's moves are described, Stockfish's are played and then
+    described, descriptions are paraphrased, and puzzles are fetched now and again between moves.
+    """
+
+    fen_stack = [chess.Board().fen()]
+    for ply, uci in enumerate(moves):
+        board = chess.Board(fen_stack[-1])
+        if ply % 2 == 1:
+            await request(client, timings, '/play', 'POST', '/play',
+                          json={'id': str(ply), 'fen': board.fen(), 'difficulty': random.randint(1, 10),
+                                'time_limit': args.time_limit, 'wait': False})
+        board.push_uci(uci)
+        fen_stack.append(board.fen())
+        description = await request(client, timings, '/description', 'POST', '/description',
+                                    json={'user': 'white' if ply % 2 == 0 else 'black', 'moveStack': moves[:ply + 1],
+                                          'uci': uci, 'fen': board.fen(), 'fenStack': fen_stack})
+        if aggregation_client is not None and description is not None:
+            for index, original in enumerate(description['descriptions']):
+                await request(aggregation_client, timings, '/aggregation', 'POST', '/aggregation',
+                              json={'index': index, 'original': original})
+        if random.random() < args.puzzle_rate:
+            type_name, n = random.choice(PUZZLE_TYPES), random.choice(MATE_COUNTS)
+            name, url = random.choice([('/single_move/{type}', '/single_move/{}'.format(type_name)),
+                                       ('/single_move/{type}/{k}', '/single_move/{}/5'.format(type_name)),
+                                       ('/mate_in/{n}', '/mate_in/{}'.format(n)),
+                                       ('/statistics', '/statistics')])
+            await request(client, timings, name, 'GET', url)
+
+
+async def run_handlers(handlers: list):
+    # the ASGI transport doesn't send lifespan events, so the apps' startup and shutdown handlers are run directly
+    for handler in handlers:
+        await handler()
+
+
+async def run(args, traces: list) -> dict:
+    import chapi
+    import chapi_agg
+
+    stages = Timings()
+    instrument(stages)
+    await run_handlers(chapi.app.router.on_startup)
+    aggregation_client = None
+    if args.aggregation:
+        chapi_agg.create_paraphrase_model = lambda: StubParaphraseModel(args.token_latency)
+        await run_handlers(chapi_agg.app.router.on_startup)
+        aggregation_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=chapi_agg.app),
+                                               base_url='http://chapi_agg', timeout=None)
+
+    timings = Timings()
+    games = asyncio.Queue()
+    for trace in traces:
+        games.put_nowait(trace)
+
+    async def client_loop():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=chapi.app), base_url='http://chapi',
+                                     timeout=None) as client:
+            while not games.empty():
+                await play_game(client, aggregation_client, timings, games.get_nowait(), args)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client_loop() for _ in range(args.clients)])
+    wall_time = time.perf_counter() - start
+
+    if aggregation_client is not None:
+        await aggregation_client.aclose()
+        await run_handlers(chapi_agg.app.router.on_shutdown)
+    await run_handlers(chapi.app.router.on_shutdown)
+
+    count = sum(len(latencies) for latencies in timings.latencies.values())
+    return {'wall_time_s': wall_time, 'requests': count, 'rps': count / wall_time,
+            'endpoints': timings.summarise(wall_time), 'stages': stages.summarise(wall_time)}
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=16)
+    parser.add_argument('--plies', type=int, default=16)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--engines', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--time-limit', type=float, default=0.1)
+    parser.add_argument('--puzzles', type=int, default=2000)
+    parser.add_argument('--puzzle-rate', type=float, default=0.25)
+    parser.add_argument('--aggregation', action='store_true', help="also paraphrase descriptions on a stub model")
+    parser.add_argument('--token-latency', type=float, default=0.002)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    commit = get_commit()
+    output = os.path.abspath(args.output or 'benchmark-{}.json'.format(commit or 'local'))
+    opening_book = OpeningBook.from_tsv()
+    traces = get_traces(opening_book, args.games, args.plies)
+
+    # chapi reads config.ini and writes its caches relative to the working directory
+    directory = tempfile.mkdtemp(prefix='chapi-benchmark-')
+    database = os.path.join(directory, 'chess_db.sqlite')
+    seed_database(database, opening_book, args.puzzles)
+    with open(os.path.join(directory, 'config.ini'), 'w') as file:
+        file.write(CONFIG.format(database=database, engines=args.engines, batch_size=args.batch_size))
+    os.chdir(directory)
+
+    results = asyncio.run(run(args, traces))
+    results.update({'commit': commit, 'created': datetime.datetime.now().isoformat(), 'arguments': vars(args)})
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    print("{:.1f} requests/s over {:.1f}s, results in {}".format(results['rps'], results['wall_time_s'], output))
+    for section in ['endpoints', 'stages']:
+        for name, summary in results[section].items():
+            print("{:<28} {:>6} {:>9.1f} {:>9.1f} {:>9.1f}".format(name, summary['count'], summary['p50_ms'],
+                                                                  summary['p95_ms'], summary['p99_ms']))
+
+
+if __name__ == '__main__':
+    main()
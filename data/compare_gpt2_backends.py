@@ -0,0 +1,98 @@
+"""
+ Compare the TensorFlow and ONNX paraphrase backends: cold start time, peak RSS and per request latency, each
+ measured in a fresh process, plus how closely the ONNX model's next token distribution matches the checkpoint's.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+
+from domain.opening_book import OpeningBook
+from prewarm_paraphrases import enumerate_originals
+
+
+def create_backend(backend: str, args):
+    if backend == 'onnx':
+        from service.gpt2_onnx_service import GPT2OnnxService
+        return GPT2OnnxService(args.onnx_model)
+    from service.gpt2_service import GPT2Service
+    return GPT2Service(args.checkpoint)
+
+
+def measure(backend: str, args, originals: list, results):
+    start = time.perf_counter()
+    service = create_backend(backend, args)
+    cold_start = time.perf_counter() - start
+
+    latencies = []
+    for original in originals:
+        start = time.perf_counter()
+        service.generate_batch([original])
+        latencies.append(time.perf_counter() - start)
+
+    results.put({'backend': backend,
+                 'cold_start_s': cold_start,
+                 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                 'p50_ms': np.percentile(latencies, 50) * 1000,
+                 'p95_ms': np.percentile(latencies, 95) * 1000,
+                 'examples': [[original, service.generate_batch([original])[0]] for original in originals[:3]]})
+
+
+def compare_logits(args, originals: list):
+    """
+    Feed the same prompts through both models and compare the next token distributions.
+    """
+
+    import tensorflow as tf
+    from gpt_2_simple.src import model
+    from service.gpt2_onnx_service import GPT2OnnxService
+    from service.gpt2_service import GPT2Service
+
+    tf_service = GPT2Service(args.checkpoint)
+    tokens = tf.compat.v1.placeholder(tf.int32, [None, None])
+    logits = model.model(hparams=tf_service.hparams, X=tokens, reuse=tf.compat.v1.AUTO_REUSE)['logits'][:, -1, :]
+    onnx_service = GPT2OnnxService(args.onnx_model)
+
+    agreements, differences = [], []
+    for original in originals:
+        prompt = [tf_service.encoder.encode(tf_service.INPUT.format(original))]
+        tf_logits = tf_service.sess.run(logits, feed_dict={tokens: prompt})[0]
+        onnx_logits = onnx_service.step(np.array(prompt, dtype=np.int32),
+                                        np.zeros(onnx_service.get_past_shape(1), dtype=np.float32))[0][0]
+        agreements.append(np.argmax(tf_logits) == np.argmax(onnx_logits))
+        differences.append(np.max(np.abs(tf_logits - onnx_logits)))
+    return {'top1_agreement': float(np.mean(agreements)), 'max_abs_logit_difference': float(np.max(differences))}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', default='../checkpoint')
+    parser.add_argument('--onnx-model', default='../checkpoint/run1/model.int8.onnx')
+    parser.add_argument('--samples', type=int, default=50)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    originals = list(itertools.islice(enumerate_originals(OpeningBook.from_tsv()), 0, None, 97))[:args.samples]
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    report = {}
+    for backend in ['tf', 'onnx']:
+        process = context.Process(target=measure, args=(backend, args, originals, results))
+        process.start()
+        report[backend] = results.get()
+        process.join()
+    report['equivalence'] = compare_logits(args, originals)
+
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+ Evaluate every position of the opening book, the end of each line and every ply leading to it, at a fixed depth
+ and write the scores and best moves to the table StockfishService checks before searching.
+"""
+
+import argparse
+import csv
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import chess
+
+from engine.engine_pool import EnginePool
+from engine.engine_profile import EngineProfile
+from engine.evaluation_cache import from_info
+from engine.opening_evaluations import read_entries, write_entries
+
+SAVE_INTERVAL = 200
+PV_LENGTH = 2
+
+
+def get_positions(src_path: str) -> dict:
+    """
+    Map the EPD of every position the opening lines pass through to a fen for it.
+    """
+
+    positions = {}
+    for file_name in sorted(os.listdir(src_path)):
+        with open(os.path.join(src_path, file_name), 'r') as file:
+            tsv_read = csv.reader(file, delimiter='\t')
+            next(tsv_read)
+            for row in tsv_read:
+                board = chess.Board()
+                positions.setdefault(board.epd(), board.fen())
+                for move in row[3].split():
+                    board.push_uci(move)
+                    positions.setdefault(board.epd(), board.fen())
+    return positions
+
+
+def evaluate(engine_pool: EnginePool, options: dict, fen, depth) -> dict:
+    with engine_pool.engine() as engine:
+        engine.configure(options)
+        info = engine.analyse(chess.Board(fen), time=None, depth=depth)
+    entry = from_info(info)
+    # the table only needs the best move and the expected reply
+    entry['pv'] = ' '.join(entry['pv'].split()[:PV_LENGTH])
+    return entry
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--openings', default='./openings')
+    parser.add_argument('--output', default='./evaluations/openings.tsv')
+    parser.add_argument('--depth', type=int, default=20)
+    parser.add_argument('--engines', type=int, default=os.cpu_count())
+    parser.add_argument('--hash', type=int, default=EngineProfile.DEFAULT_HASH)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    positions = get_positions(args.openings)
+    entries = read_entries(args.output) if os.path.exists(args.output) else {}
+    # positions already evaluated at least as deep are kept, so an interrupted run picks up where it stopped,
+    # Stockfish reports depth 0 for positions which are over
+    pending = [epd for epd in positions if epd not in entries or (entries[epd]['depth'] < args.depth
+                                                                 and not chess.Board(positions[epd]).is_game_over())]
+    logging.info("Evaluating {} of {} positions at depth {}".format(len(pending), len(positions), args.depth))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    options = EngineProfile('openings', hash_size=args.hash).get_options()
+    engine_pool = EnginePool(args.engines)
+    try:
+        with ThreadPoolExecutor(args.engines) as executor:
+            results = executor.map(lambda epd: (epd, evaluate(engine_pool, options, positions[epd], args.depth)),
+                                   pending)
+            for i, (epd, entry) in enumerate(results, 1):
+                entries[epd] = entry
+                if i % SAVE_INTERVAL == 0:
+                    write_entries(args.output, entries)
+                    logging.info("Evaluated {} of {} positions".format(i, len(pending)))
+    finally:
+        write_entries(args.output, entries)
+        engine_pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+ Export the fine tuned gpt_2_simple checkpoint as a single step ONNX graph (tokens and key/value cache in, last
+ position logits and the extended cache out) for GPT2OnnxService, along with a dynamically quantised int8 copy.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+
+import tensorflow as tf
+import tf2onnx
+from gpt_2_simple.src import model
+from onnxruntime.quantization import quantize_dynamic, QuantType
+
+OPSET = 13
+ENCODER_FILES = ['encoder.json', 'vocab.bpe', 'hparams.json']
+
+
+def build_step_graph(hparams):
+    tokens = tf.compat.v1.placeholder(tf.int32, [None, None], name='tokens')
+    past = tf.compat.v1.placeholder(tf.float32, model.past_shape(hparams=hparams, batch_size=None), name='past')
+    lm_output = model.model(hparams=hparams, X=tokens, past=past, reuse=tf.compat.v1.AUTO_REUSE)
+    tf.identity(lm_output['logits'][:, -1, :hparams.n_vocab], name='logits')
+    tf.identity(tf.concat([past, lm_output['present']], axis=-2), name='presents')
+
+
+def freeze_checkpoint(checkpoint_path: str):
+    hparams = model.default_hparams()
+    with open(os.path.join(checkpoint_path, 'hparams.json')) as file:
+        hparams.override_from_dict(json.load(file))
+
+    tf.compat.v1.disable_eager_execution()
+    graph = tf.Graph()
+    with graph.as_default(), tf.compat.v1.Session(graph=graph) as sess:
+        build_step_graph(hparams)
+        tf.compat.v1.train.Saver().restore(sess, tf.train.latest_checkpoint(checkpoint_path))
+        return tf.compat.v1.graph_util.convert_variables_to_constants(sess, graph.as_graph_def(),
+                                                                      ['logits', 'presents'])
+
+
+def export(checkpoint_path: str, output_dir: str):
+    fp32_path = os.path.join(output_dir, 'model.onnx')
+    int8_path = os.path.join(output_dir, 'model.int8.onnx')
+
+    logging.info("Freezing {}".format(checkpoint_path))
+    graph_def = freeze_checkpoint(checkpoint_path)
+    logging.info("Converting to ONNX opset {}".format(OPSET))
+    tf2onnx.convert.from_graph_def(graph_def, input_names=['tokens:0', 'past:0'],
+                                   output_names=['logits:0', 'presents:0'], opset=OPSET, output_path=fp32_path)
+    logging.info("Quantising weights to int8")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+
+    # the service reads the tokenizer and model shape from beside the model
+    for file_name in ENCODER_FILES:
+        if not os.path.exists(os.path.join(output_dir, file_name)):
+            shutil.copy(os.path.join(checkpoint_path, file_name), output_dir)
+    return fp32_path, int8_path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', default='../checkpoint/run1')
+    parser.add_argument('--output', default=None, help="defaults to the checkpoint directory")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    for path in export(args.checkpoint, args.output if args.output is not None else args.checkpoint):
+        logging.info("Wrote {} ({:.1f} MB)".format(path, os.path.getsize(path) / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+ Pre-generate paraphrases for the sentences the description grammars produce and store them in the
+ chapi_agg paraphrase cache file, so a freshly started aggregation server already has full pools.
+"""
+
+import argparse
+import itertools
+import logging
+
+import chess
+
+from domain.opening_book import OpeningBook
+from service import grammar_service
+from service.paraphrase_cache import ParaphraseCache
+from service.paraphrase_model import ParaphraseModel
+from util.utils import WHITE, BLACK
+
+MOVE_COUNTS = range(1, 60)
+MATE_COUNTS = range(1, 5)
+
+
+def enumerate_originals(opening_book: OpeningBook):
+    """
+    Yield the sentences of every grammar whose slots come from a small, known set of values: pieces, squares,
+    move counts and the opening book's first moves.
+    """
+
+    for opening in opening_book.query_opening_by_move_stack_subset(''):
+        yield from grammar_service.get_user_first_opening('the ' + opening['name']).enumerate()
+
+    for user, piece, square in itertools.product([WHITE, BLACK], chess.PIECE_NAMES[1:], chess.SQUARE_NAMES):
+        for flags in [(True,), (None, 1), (None, -1), (None, None, 1), (None, None, -1)]:
+            yield from grammar_service.get_positional_description(user, piece, square, *flags).enumerate()
+
+    for move_count in MATE_COUNTS:
+        yield from grammar_service.get_user_checkmating(move_count).enumerate()
+        yield from grammar_service.get_stockfish_checkmating(move_count).enumerate()
+    yield from grammar_service.get_user_checkmated().enumerate()
+    yield from grammar_service.get_stockfish_checkmated().enumerate()
+
+    for move_count in MOVE_COUNTS:
+        yield from grammar_service.get_user_win_condition(move_count).enumerate()
+        yield from grammar_service.get_stockfish_win_condition(move_count).enumerate()
+        yield from grammar_service.get_stalemate_ending(move_count).enumerate()
+
+
+def prewarm(gpt2_service: ParaphraseModel, cache: ParaphraseCache, originals: list, batch_size: int):
+    pending = [original for original in dict.fromkeys(originals) for _ in range(cache.pool_size)
+               if not cache.is_full(original)]
+    for i in range(0, len(pending), batch_size):
+        batch = pending[i:i + batch_size]
+        for original, paraphrase in zip(batch, gpt2_service.generate_batch(batch)):
+            cache.add(original, paraphrase)
+        logging.info("Generated {} of {} paraphrases".format(i + len(batch), len(pending)))
+        cache.save()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', default='../checkpoint')
+    parser.add_argument('--output', default='../paraphrases.json')
+    parser.add_argument('--pool-size', type=int, default=ParaphraseCache.DEFAULT_POOL_SIZE)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args()
+
+    # imported here so enumerate_originals can be used without loading TensorFlow
+    from service.gpt2_service import GPT2Service
+
+    logging.basicConfig(level=logging.INFO)
+    originals = list(itertools.islice(enumerate_originals(OpeningBook.from_tsv()), args.limit))
+    cache = ParaphraseCache(None, size=max(len(originals), ParaphraseCache.DEFAULT_SIZE), pool_size=args.pool_size,
+                            path=args.output)
+    prewarm(GPT2Service(args.checkpoint), cache, originals, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel
 
@@ -11,6 +11,11 @@ class DescriptionRequest(BaseModel):
     fenStack: List[str]
 
 
+class GameDescriptionRequest(BaseModel):
+    moveStack: List[str]
+    fenStack: Optional[List[str]] = None
+
+
 class PlayRequest(BaseModel):
     id: str
     fen: str
@@ -0,0 +1,107 @@
+import csv
+import logging
+import os
+
+OPENINGS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'openings')
+
+logger = logging.getLogger('chapi')
+
+
+class OpeningNode:
+    __slots__ = ['children', 'openings']
+
+    def __init__(self):
+        self.children = {}
+        self.openings = []
+
+
+class OpeningBook:
+    """
+    In memory move trie of the opening book, with an EPD index for transpositions. Answers the same lookups as the
+    Opening table without a database round trip, results are dicts in the shape of Opening.as_dict().
+    """
+    STORE_MAX_AGE = 3600
+
+    def __init__(self, openings: list):
+        self.root = OpeningNode()
+        self.openings_by_epd = {}
+        for opening in openings:
+            self.add(opening)
+
+    @classmethod
+    def from_tsv(cls, directory=OPENINGS_DIRECTORY):
+        openings = []
+        for file_name in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, file_name), 'r') as file:
+                tsv_read = csv.reader(file, delimiter='\t')
+                next(tsv_read)
+                for row in tsv_read:
+                    openings.append({'eco_classification': row[0], 'name': row[1], 'move_stack': row[3],
+                                     'explorer_link': None, 'wiki_link': None, 'epd': row[4]})
+        return cls(openings)
+
+    @classmethod
+    def from_repository(cls, repository, store=None):
+        """
+        Load the book from the Opening table, which has Wikipedia links attached, falling back to the TSV files
+        when the table can't be read or is empty. Given a SharedStore, the rows are read once for every worker and
+        read again from the database once they're older than STORE_MAX_AGE.
+        """
+
+        try:
+            if store is not None:
+                openings = store.get_or_compute('openings', lambda: query_openings(repository), cls.STORE_MAX_AGE)
+            else:
+                openings = query_openings(repository)
+            return cls(openings)
+        except Exception as e:
+            logger.warning("Couldn't load openings from the database, using the TSV files... " + str(e))
+        return cls.from_tsv()
+
+    def add(self, opening: dict):
+        node = self.root
+        for move in opening['move_stack'].split():
+            node = node.children.setdefault(move, OpeningNode())
+        node.openings.append(opening)
+        if opening['epd'] is not None:
+            self.openings_by_epd.setdefault(opening['epd'], []).append(opening)
+
+    def find(self, move_stack: list):
+        node = self.root
+        for move in move_stack:
+            node = node.children.get(move)
+            if node is None:
+                return None
+        return node
+
+    def query_opening_by_move_stack(self, move_stack: list):
+        node = self.find(move_stack)
+        return list(node.openings) if node is not None else []
+
+    def query_opening_by_move_stack_subset(self, move_stack: str, plies=1):
+        """
+        Return the openings which continue the move stack by between one and the given number of plies.
+        """
+
+        node = self.find(move_stack.split())
+        if node is None:
+            return []
+
+        openings = []
+        frontier = [node]
+        for _ in range(plies):
+            frontier = [child for parent in frontier for child in parent.children.values()]
+            for child in frontier:
+                openings.extend(child.openings)
+        return openings
+
+    def query_opening_by_epd(self, epd: str):
+        return list(self.openings_by_epd.get(epd, []))
+
+
+def query_openings(repository) -> list:
+    # raising rather than returning an empty table keeps it out of the shared store, so workers retry the database
+    openings = repository.query_openings()
+    if len(openings) == 0:
+        raise ValueError("the Opening table is empty")
+    return openings
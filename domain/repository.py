@@ -1,46 +1,190 @@
 import configparser
+from contextlib import contextmanager, asynccontextmanager
+from functools import lru_cache
 
 import sqlalchemy as db
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import sessionmaker
 
 from domain.entities import SingleMove, Opening, MateInN
+from util import metrics
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_OVERFLOW = 20
+DEFAULT_POOL_RECYCLE = 1800
+DEFAULT_POOL_TIMEOUT = 30
+
+
+def read_db_config():
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    return config
+
+
+def get_pool_options(config) -> dict:
+    """
+    Pooling for the process wide engine: connections are checked before use and recycled before MySQL's
+    wait_timeout can drop them, so a stale connection never reaches a request.
+    """
+    pool = config['DB_POOL'] if config.has_section('DB_POOL') else {}
+    return {'pool_size': int(pool.get('pool_size', DEFAULT_POOL_SIZE)),
+            'max_overflow': int(pool.get('max_overflow', DEFAULT_MAX_OVERFLOW)),
+            'pool_recycle': int(pool.get('pool_recycle', DEFAULT_POOL_RECYCLE)),
+            'pool_timeout': int(pool.get('pool_timeout', DEFAULT_POOL_TIMEOUT)),
+            'pool_pre_ping': True}
+
+
+def get_connection_string(config, connection_string: str, option='url') -> str:
+    """
+    The MySQL connection string filled in from [DB_CREDENTIALS], unless the section gives a whole url instead, such
+    as the SQLite stand in the benchmarks run against.
+    """
+    credentials = config['DB_CREDENTIALS']
+    if option in credentials:
+        return credentials[option]
+    return connection_string.format(user=credentials['user'], password=credentials['password'],
+                                    host=credentials['host'])
+
+
+def get_engine_options(config, connection_string: str) -> dict:
+    # SQLite has no connection pool to size
+    return get_pool_options(config) if not connection_string.startswith('sqlite') else {}
+
+
+@lru_cache(maxsize=None)
+def get_session_factory():
+    config = read_db_config()
+    connection_string = get_connection_string(config, Repository.connection_string)
+    engine = db.create_engine(connection_string, **get_engine_options(config, connection_string))
+    return sessionmaker(bind=engine)
+
+
+@lru_cache(maxsize=None)
+def get_async_session_factory():
+    # imported here so the asyncio extension and its driver are only needed when the async path is enabled
+    from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+    config = read_db_config()
+    connection_string = get_connection_string(config, AsyncRepository.connection_string, 'async_url')
+    engine = create_async_engine(connection_string, **get_engine_options(config, connection_string))
+    return sessionmaker(bind=engine, class_=AsyncSession)
+
+
+def is_async_enabled():
+    config = read_db_config()
+    return config.has_section('DB_POOL') and config['DB_POOL'].getboolean('async', fallback=False)
 
 
 class Repository(object):
     connection_string = "mysql://{user}:{password}@{host}/chess_db"
+    ID_BATCH_SIZE = 10000
     get_statistics_query = "select type, count(*) as count from Single_Move group by type order by count asc;"
-    get_openings_by_move_stack_subset_query = "select * from Opening where move_stack like '{move_stack}%' " \
-                                              "and LENGTH(move_stack) between LENGTH('{move_stack}') + 1 " \
-                                              "and LENGTH('{move_stack}') + 6;"
 
     def __init__(self):
-        config = configparser.ConfigParser()
-        config.read('config.ini')
-        credentials = config['DB_CREDENTIALS']
-        engine = db.create_engine(
-            self.connection_string.format(user=credentials['user'],
-                                          password=credentials['password'],
-                                          host=credentials['host'])
-        )
-        self.session = Session(bind=engine)
+        self.session_factory = get_session_factory()
 
+    @contextmanager
+    def session_scope(self):
+        """
+        A session from the shared pool for a single unit of work, returned to the pool once it's done.
+        """
+
+        session = self.session_factory()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    @metrics.timed('db.query_single_move_by_type')
     def query_single_move_by_type(self, type_name: str):
-        single_move_puzzles = self.session.query(SingleMove).filter(SingleMove.type == type_name)
-        return [ob.as_dict() for ob in single_move_puzzles]
+        with self.session_scope() as session:
+            single_move_puzzles = session.query(SingleMove).filter(SingleMove.type == type_name)
+            return [ob.as_dict() for ob in single_move_puzzles]
+
+    def query_single_move_ids(self):
+        with self.session_scope() as session:
+            yield from session.query(SingleMove.id, SingleMove.type).yield_per(self.ID_BATCH_SIZE)
+
+    @metrics.timed('db.query_single_moves_by_ids')
+    def query_single_moves_by_ids(self, ids: list):
+        with self.session_scope() as session:
+            single_move_puzzles = session.query(SingleMove).filter(SingleMove.id.in_(ids))
+            return [ob.as_dict() for ob in single_move_puzzles]
 
+    @metrics.timed('db.query_opening_by_move_stack')
     def query_opening_by_move_stack(self, move_stack: list):
-        openings = self.session.query(Opening).filter(Opening.move_stack == ' '.join(move_stack))
-        return [opening.as_dict() for opening in openings]
+        with self.session_scope() as session:
+            openings = session.query(Opening).filter(Opening.move_stack == ' '.join(move_stack))
+            return [opening.as_dict() for opening in openings]
 
+    @metrics.timed('db.query_opening_by_move_stack_subset')
     def query_opening_by_move_stack_subset(self, move_stack):
-        openings = self.session.execute(
-            self.get_openings_by_move_stack_subset_query.format(move_stack=move_stack))
-        return [dict(opening) for opening in openings]
+        with self.session_scope() as session:
+            openings = session.execute(db.select(Opening.__table__).where(
+                Opening.move_stack.startswith(move_stack, autoescape=True),
+                db.func.length(Opening.move_stack).between(len(move_stack) + 1, len(move_stack) + 6)))
+            return [dict(opening) for opening in openings]
 
+    @metrics.timed('db.query_openings')
+    def query_openings(self):
+        with self.session_scope() as session:
+            openings = session.execute(db.select(Opening.__table__))
+            return [dict(opening) for opening in openings]
+
+    @metrics.timed('db.get_type_statistics')
     def get_type_statistics(self):
-        statistics = self.session.execute(self.get_statistics_query)
-        return [statistic for statistic in statistics]
+        with self.session_scope() as session:
+            statistics = session.execute(db.text(self.get_statistics_query))
+            return [statistic for statistic in statistics]
 
+    @metrics.timed('db.query_mate_in_n_by_n')
     def query_mate_in_n_by_n(self, n: int):
-        mate_puzzles = self.session.query(MateInN).filter(MateInN.moves_to_mate == n)
-        return [ob.as_dict() for ob in mate_puzzles]
+        with self.session_scope() as session:
+            mate_puzzles = session.query(MateInN).filter(MateInN.moves_to_mate == n)
+            return [ob.as_dict() for ob in mate_puzzles]
+
+    def query_mate_in_n_ids(self):
+        with self.session_scope() as session:
+            yield from session.query(MateInN.id, MateInN.moves_to_mate).yield_per(self.ID_BATCH_SIZE)
+
+    @metrics.timed('db.query_mate_in_n_by_ids')
+    def query_mate_in_n_by_ids(self, ids: list):
+        with self.session_scope() as session:
+            mate_puzzles = session.query(MateInN).filter(MateInN.id.in_(ids))
+            return [ob.as_dict() for ob in mate_puzzles]
+
+
+class AsyncRepository(object):
+    """
+    The request path queries of Repository over SQLAlchemy's asyncio extension and aiomysql, so waiting on MySQL
+    doesn't hold up the event loop.
+    """
+    connection_string = "mysql+aiomysql://{user}:{password}@{host}/chess_db"
+
+    def __init__(self):
+        self.session_factory = get_async_session_factory()
+
+    @asynccontextmanager
+    async def session_scope(self):
+        session = self.session_factory()
+        try:
+            yield session
+        finally:
+            await session.close()
+
+    @metrics.timed('db.query_single_moves_by_ids')
+    async def query_single_moves_by_ids(self, ids: list):
+        async with self.session_scope() as session:
+            single_move_puzzles = await session.execute(db.select(SingleMove).where(SingleMove.id.in_(ids)))
+            return [ob.as_dict() for ob in single_move_puzzles.scalars()]
+
+    @metrics.timed('db.query_mate_in_n_by_ids')
+    async def query_mate_in_n_by_ids(self, ids: list):
+        async with self.session_scope() as session:
+            mate_puzzles = await session.execute(db.select(MateInN).where(MateInN.id.in_(ids)))
+            return [ob.as_dict() for ob in mate_puzzles.scalars()]
+
+    @metrics.timed('db.get_type_statistics')
+    async def get_type_statistics(self):
+        async with self.session_scope() as session:
+            statistics = await session.execute(db.text(Repository.get_statistics_query))
+            return [dict(statistic._mapping) for statistic in statistics]
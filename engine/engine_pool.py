@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import queue
+import threading
+from contextlib import contextmanager, asynccontextmanager
+
+import chess.engine
+
+from engine.stockfish import Engine, AsyncEngine
+
+logger = logging.getLogger('chapi')
+
+
+class EnginePool:
+    """
+    A fixed number of Stockfish processes shared between requests. Each search checks an engine out for its own
+    exclusive use and checks it back in afterwards, engines which have crashed are restarted.
+    """
+    DEFAULT_LEVEL = 10
+
+    def __init__(self, size: int, level=DEFAULT_LEVEL):
+        self.size = size
+        self.level = level
+        # last in, first out so consecutive searches tend to land on an engine with a warm hash table
+        self.idle = queue.LifoQueue(maxsize=size)
+        for _ in range(size):
+            self.idle.put(Engine(level))
+        self.waiting = 0
+        self.lock = threading.Lock()
+
+    def checkout(self, timeout=None) -> Engine:
+        with self.lock:
+            self.waiting += 1
+        try:
+            engine = self.idle.get(timeout=timeout)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+        if not engine.is_alive():
+            try:
+                engine = self.restart(engine)
+            except Exception:
+                # the dead handle goes back so the pool keeps its size and the next checkout retries the restart
+                self.checkin(engine)
+                raise
+        return engine
+
+    def checkin(self, engine: Engine):
+        self.idle.put(engine)
+
+    def get_busy(self):
+        return self.size - self.idle.qsize()
+
+    def get_load(self):
+        """
+        Engines in use or waited for as a share of the pool, above 1 searches are queueing for an engine.
+        """
+        return (self.get_busy() + self.waiting) / self.size
+
+    @contextmanager
+    def engine(self, timeout=None):
+        """
+        Check out an engine for the body of the with block, restarting it if it dies mid search.
+        """
+
+        engine = self.checkout(timeout)
+        try:
+            yield engine
+        except (chess.engine.EngineTerminatedError, TimeoutError):
+            engine = self.restart(engine)
+            raise
+        finally:
+            self.checkin(engine)
+
+    def restart(self, engine: Engine) -> Engine:
+        logger.warning("Restarting unresponsive Stockfish engine")
+        engine.close()
+        return Engine(self.level)
+
+    def health_check(self):
+        """
+        Ping every idle engine and replace any that no longer respond. An engine which can't be restarted is put back
+        as it is, so a failed restart never shrinks the pool.
+        """
+
+        engines = []
+        while True:
+            try:
+                engines.append(self.idle.get_nowait())
+            except queue.Empty:
+                break
+        for engine in engines:
+            if not engine.is_alive():
+                try:
+                    engine = self.restart(engine)
+                except Exception as e:
+                    logger.warning("Couldn't restart Stockfish engine, retrying on its next checkout... " + str(e))
+            self.checkin(engine)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class AsyncEnginePool:
+    """
+    The asyncio counterpart of EnginePool, waiting for a free engine suspends the coroutine instead of a thread.
+    """
+    DEFAULT_LEVEL = 10
+
+    def __init__(self, engines: list, level=DEFAULT_LEVEL):
+        self.size = len(engines)
+        self.level = level
+        self.idle = asyncio.LifoQueue(maxsize=self.size)
+        for engine in engines:
+            self.idle.put_nowait(engine)
+
+    @classmethod
+    async def open(cls, size: int, level=DEFAULT_LEVEL):
+        engines = await asyncio.gather(*[AsyncEngine.open(level) for _ in range(size)])
+        return cls(list(engines), level)
+
+    async def checkout(self) -> AsyncEngine:
+        engine = await self.idle.get()
+        if not await engine.is_alive():
+            try:
+                engine = await self.restart(engine)
+            except Exception:
+                self.checkin(engine)
+                raise
+        return engine
+
+    def checkin(self, engine: AsyncEngine):
+        self.idle.put_nowait(engine)
+
+    def get_busy(self):
+        return self.size - self.idle.qsize()
+
+    @asynccontextmanager
+    async def engine(self):
+        """
+        Check out an engine for the body of the async with block, restarting it if it dies mid search.
+        """
+
+        engine = await self.checkout()
+        try:
+            yield engine
+        except (chess.engine.EngineTerminatedError, asyncio.TimeoutError):
+            engine = await self.restart(engine)
+            raise
+        finally:
+            self.checkin(engine)
+
+    async def restart(self, engine: AsyncEngine) -> AsyncEngine:
+        logger.warning("Restarting unresponsive Stockfish engine")
+        await engine.close()
+        return await AsyncEngine.open(self.level)
+
+    async def close(self):
+        while not self.idle.empty():
+            await self.idle.get_nowait().close()
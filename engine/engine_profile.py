@@ -0,0 +1,84 @@
+import configparser
+
+SECTION_PREFIX = 'PROFILE '
+ANALYSIS = 'analysis'
+MAX_SKILL_LEVEL = 20
+
+
+class EngineProfile:
+    """
+    The Stockfish options a search runs with. Play profiles cover a band of difficulties and may cap the move time,
+    the analysis profile is used for every evaluation.
+    """
+    DEFAULT_THREADS = 1
+    DEFAULT_HASH = 16
+
+    def __init__(self, name, difficulties=(), threads=DEFAULT_THREADS, hash_size=DEFAULT_HASH, use_nnue=None,
+                 time_limit=None):
+        self.name = name
+        self.difficulties = set(difficulties)
+        self.threads = threads
+        self.hash_size = hash_size
+        self.use_nnue = use_nnue
+        self.time_limit = time_limit
+
+    @classmethod
+    def from_section(cls, name, section):
+        low, _, high = section.get('difficulties', '').partition('-')
+        difficulties = range(int(low), int(high or low) + 1) if low else ()
+        use_nnue = section.getboolean('use_nnue') if 'use_nnue' in section else None
+        time_limit = float(section['time_limit']) if 'time_limit' in section else None
+        return cls(name, difficulties, int(section.get('threads', cls.DEFAULT_THREADS)),
+                   int(section.get('hash', cls.DEFAULT_HASH)), use_nnue, time_limit)
+
+    def get_options(self, skill_level=MAX_SKILL_LEVEL) -> dict:
+        options = {'Skill Level': skill_level, 'Threads': self.threads, 'Hash': self.hash_size}
+        if self.use_nnue is not None:
+            # only Stockfish 12 onwards has the option, engines without it skip it when configured
+            options['Use NNUE'] = self.use_nnue
+        return options
+
+    def get_time_limit(self, time_limit):
+        return min(time_limit, self.time_limit) if self.time_limit is not None else time_limit
+
+
+class EngineProfiles:
+    """
+    The play profile of each difficulty and the analysis profile, read from the config's [PROFILE <name>] sections.
+    Difficulties without a profile, and analysis without one, use a single thread and Stockfish's default hash.
+    """
+
+    def __init__(self, profiles: list = ()):
+        self.default = EngineProfile('default')
+        self.analysis = self.default
+        self.by_difficulty = {}
+        for profile in profiles:
+            if profile.name == ANALYSIS:
+                self.analysis = profile
+            for difficulty in profile.difficulties:
+                self.by_difficulty[difficulty] = profile
+
+    @classmethod
+    def from_config(cls, config_file):
+        config = configparser.ConfigParser()
+        config.read(config_file)
+        return cls([EngineProfile.from_section(section[len(SECTION_PREFIX):], config[section])
+                    for section in config.sections() if section.startswith(SECTION_PREFIX)])
+
+    def get_play_profile(self, difficulty) -> EngineProfile:
+        return self.by_difficulty.get(difficulty, self.default)
+
+    def get_pool_sizes(self, cpus, pool_size=None, async_pool_size=None) -> tuple:
+        """
+        The number of engines in the analysis pool and in the play pool, whichever isn't given is sized so the
+        Threads of both pools' engines together fit the cpus: the analysis pool takes half of them and the play
+        pool the rest, counting each of its engines at the most threads a play profile uses. Each pool has at least
+        one engine.
+        """
+        analysis_threads = self.analysis.threads
+        play_threads = max([self.default.threads] + [profile.threads for profile in self.by_difficulty.values()])
+        if pool_size is None:
+            pool_size = max(1, cpus // 2 // analysis_threads)
+        if async_pool_size is None:
+            async_pool_size = max(1, (cpus - pool_size * analysis_threads) // play_threads)
+        return pool_size, async_pool_size
@@ -0,0 +1,187 @@
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import chess
+import chess.engine
+
+from engine.engine_profile import MAX_SKILL_LEVEL
+
+
+# the options which change an analysis's result, and their values at full strength
+FULL_STRENGTH = {'Skill Level': MAX_SKILL_LEVEL, 'MultiPV': 1}
+
+logger = logging.getLogger('chapi')
+
+
+class EvaluationCache:
+    """
+    Bounded LRU cache of Stockfish analyses keyed by the position's EPD, so move clocks don't split otherwise
+    identical positions, and by the options weakening the search so weaker analyses never reach full strength
+    callers. Only the deepest analysis of a position is kept, along with the longest time it was searched for, and
+    it satisfies any request for a shallower or shorter search. Entries can optionally be persisted to a SQLite file
+    so restarts start warm, and workers pointed at the same file share their analyses. The file is read and written
+    outside the lock of the in memory entries, and a failed read or write only costs a cache miss.
+    """
+    DEFAULT_SIZE = 100000
+    # how long a read or write waits for another worker's write before it's given up on
+    TIMEOUT = 1.0
+    CREATE_TABLE = "create table if not exists evaluation (epd text primary key, score text, pv text, " \
+                   "depth integer, time_limit real)"
+    SELECT_EVALUATION = "select score, pv, depth, time_limit from evaluation where epd = ?"
+    # other workers may share the file, so the merge happens in the upsert: a shallower analysis never replaces a
+    # deeper one written by another process, and the longest time limit is kept either way
+    UPSERT_EVALUATION = "insert into evaluation (epd, score, pv, depth, time_limit) values (?, ?, ?, ?, ?) " \
+                        "on conflict (epd) do update set " \
+                        "score = case when excluded.depth >= evaluation.depth then excluded.score " \
+                        "else evaluation.score end, " \
+                        "pv = case when excluded.depth >= evaluation.depth then excluded.pv else evaluation.pv end, " \
+                        "depth = max(excluded.depth, evaluation.depth), " \
+                        "time_limit = max(coalesce(excluded.time_limit, evaluation.time_limit), " \
+                        "coalesce(evaluation.time_limit, excluded.time_limit))"
+
+    def __init__(self, size=DEFAULT_SIZE, path=None):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.connection = None
+        self.connection_lock = threading.Lock()
+        if path:
+            self.connection = sqlite3.connect(path, timeout=self.TIMEOUT, check_same_thread=False)
+            self.connection.execute("pragma journal_mode=wal")
+            # with WAL a commit no longer waits for the disk, a power loss may drop the latest analyses but never
+            # corrupts the file
+            self.connection.execute("pragma synchronous=normal")
+            self.connection.execute(self.CREATE_TABLE)
+            self.connection.commit()
+
+    def get(self, fen, time_limit=None, depth=None, options: dict = None):
+        """
+        Return the cached info dict for the fen if it was searched at least as long or as deep as requested, with
+        engine options of the same strength.
+        """
+
+        epd = get_key(fen, options)
+        with self.lock:
+            entry = self.entries.get(epd)
+        if entry is None and self.connection is not None:
+            entry = self.load(epd)
+        with self.lock:
+            if entry is not None and satisfies(entry, time_limit, depth):
+                self.entries[epd] = merge(self.entries.get(epd), entry)
+                self.entries.move_to_end(epd)
+                self.evict()
+                self.hits += 1
+                return to_info(fen, entry)
+            self.misses += 1
+            return None
+
+    def put(self, fen, info: dict, time_limit=None, options: dict = None):
+        epd = get_key(fen, options)
+        with self.lock:
+            entry = merge(self.entries.get(epd), from_info(info, time_limit))
+            self.entries[epd] = entry
+            self.entries.move_to_end(epd)
+            self.evict()
+        if self.connection is not None:
+            self.save(epd, entry)
+
+    def load(self, epd):
+        try:
+            with self.connection_lock:
+                row = self.connection.execute(self.SELECT_EVALUATION, (epd,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Couldn't read the evaluation cache file... " + str(e))
+            return None
+        if row is None:
+            return None
+        return {'score': row[0], 'pv': row[1], 'depth': row[2], 'time_limit': row[3]}
+
+    def save(self, epd, entry: dict):
+        with self.connection_lock:
+            try:
+                self.connection.execute(self.UPSERT_EVALUATION, (epd, entry['score'], entry['pv'], entry['depth'],
+                                                                 entry['time_limit']))
+                self.connection.commit()
+            except sqlite3.Error as e:
+                # an open transaction would hold back the other workers' writes
+                self.connection.rollback()
+                logger.warning("Couldn't write to the evaluation cache file... " + str(e))
+
+    def evict(self):
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def statistics(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries),
+                'hit_rate': self.hits / lookups if lookups > 0 else None}
+
+    def close(self):
+        if self.connection is not None:
+            with self.connection_lock:
+                self.connection.close()
+
+
+def get_epd(fen):
+    return chess.Board(fen).epd()
+
+
+def get_key(fen, options: dict = None):
+    """
+    The fen's EPD, followed by the options which make the search weaker than full strength when there are any.
+    """
+    weakening = ['{}={}'.format(name, value) for name, value in get_weakening_options(options)]
+    return ' '.join([get_epd(fen)] + weakening)
+
+
+def is_full_strength(options: dict = None):
+    return len(get_weakening_options(options)) == 0
+
+
+def get_weakening_options(options: dict = None) -> list:
+    return [(name, value) for name, value in sorted((options or {}).items())
+            if name in FULL_STRENGTH and value != FULL_STRENGTH[name]]
+
+
+def merge(existing: dict, entry: dict) -> dict:
+    """
+    Keep the deeper of the two analyses and the longer of their time limits.
+    """
+    if existing is None:
+        return entry
+    merged = dict(existing if existing['depth'] > entry['depth'] else entry)
+    time_limits = [time_limit for time_limit in (existing['time_limit'], entry['time_limit']) if time_limit is not None]
+    merged['time_limit'] = max(time_limits) if len(time_limits) != 0 else None
+    return merged
+
+
+def satisfies(entry: dict, time_limit=None, depth=None):
+    if depth is not None:
+        return entry['depth'] >= depth
+    return entry['time_limit'] is not None and time_limit is not None and entry['time_limit'] >= time_limit
+
+
+def from_info(info: dict, time_limit=None) -> dict:
+    return {'score': str(info['score'].relative),
+            'pv': ' '.join(move.uci() for move in info.get('pv', [])),
+            'depth': info.get('depth', 0),
+            'time_limit': time_limit}
+
+
+def to_info(fen, entry: dict) -> dict:
+    board = chess.Board(fen)
+    return {'score': chess.engine.PovScore(parse_score(entry['score']), board.turn),
+            'pv': [chess.Move.from_uci(move) for move in entry['pv'].split()],
+            'depth': entry['depth']}
+
+
+def parse_score(score: str) -> chess.engine.Score:
+    if score == '#+0':
+        return chess.engine.MateGiven
+    if score.startswith('#'):
+        return chess.engine.Mate(int(score[1:]))
+    return chess.engine.Cp(int(score))
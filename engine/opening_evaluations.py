@@ -0,0 +1,78 @@
+import csv
+import logging
+import os
+
+import chess.engine
+
+from engine.evaluation_cache import get_epd, to_info
+
+EVALUATIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'evaluations',
+                                'openings.tsv')
+HEADER = ['epd', 'score', 'depth', 'pv']
+
+logger = logging.getLogger('chapi')
+
+
+class OpeningEvaluations:
+    """
+    Read only table of fixed depth analyses of every position in the opening book, written offline by
+    data/evaluate_openings.py. Entries have the evaluation cache's shape: the score, a leading '#' for mates, the
+    depth and the best move followed by the expected reply.
+    """
+
+    def __init__(self, entries: dict = None):
+        self.entries = entries if entries is not None else {}
+
+    @classmethod
+    def from_tsv(cls, path=EVALUATIONS_PATH):
+        """
+        Load the table, an empty one when it hasn't been generated so every position goes to the engine.
+        """
+
+        if not os.path.exists(path):
+            logger.info("No opening evaluations at " + path + ", analysing openings live")
+            return cls()
+        return cls(read_entries(path))
+
+    def get(self, fen):
+        entry = self.entries.get(get_epd(fen))
+        return to_info(fen, entry) if entry is not None else None
+
+    def get_best_move(self, fen) -> chess.engine.PlayResult:
+        """
+        The table's best move and expected reply for the fen with its analysis as the info, None when it's not in
+        the table or is over.
+        """
+
+        info = self.get(fen)
+        if info is None or len(info['pv']) == 0:
+            return None
+        pv = info['pv']
+        return chess.engine.PlayResult(pv[0], pv[1] if len(pv) > 1 else None, info=info)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def read_entries(path) -> dict:
+    entries = {}
+    with open(path, 'r') as file:
+        tsv_read = csv.reader(file, delimiter='\t')
+        next(tsv_read)
+        for row in tsv_read:
+            entries[row[0]] = {'score': row[1], 'depth': int(row[2]), 'pv': row[3], 'time_limit': None}
+    return entries
+
+
+def write_entries(path, entries: dict):
+    """
+    Write the entries sorted by EPD, replacing the file atomically so a running server never reads half a table.
+    """
+
+    with open(path + '.tmp', 'w', newline='') as file:
+        tsv_write = csv.writer(file, delimiter='\t', lineterminator='\n')
+        tsv_write.writerow(HEADER)
+        for epd in sorted(entries):
+            entry = entries[epd]
+            tsv_write.writerow([epd, entry['score'], entry['depth'], entry['pv']])
+    os.replace(path + '.tmp', path)
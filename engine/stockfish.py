@@ -1,8 +1,11 @@
+import asyncio
 import os
 import platform
 
 import chess.engine
 
+from util import profiler
+
 file_path = os.path.dirname(os.path.abspath(__file__))
 
 if 'Windows' in platform.system():
@@ -12,14 +15,133 @@ elif 'Linux' in platform.system():
 else:
     engine_path = 'stockfish_13_x64_mac'
 
+PING_TIMEOUT = 10
+
 
 class Engine:
     def __init__(self, level):
         self.engine = chess.engine.SimpleEngine.popen_uci(os.path.join(file_path, engine_path))
-        self.engine.configure({'Skill Level': level})
+        self.options = {}
+        self.reconfigure(level)
 
     def reconfigure(self, level):
-        self.engine.configure({'Skill Level': level})
+        self.configure({'Skill Level': level})
+
+    def configure(self, options: dict):
+        """
+        Set the options which differ from the engine's current ones, options the engine doesn't have are skipped.
+        """
+        changed = get_changed_options(self.engine.options, self.options, options)
+        if len(changed) != 0:
+            self.engine.configure(changed)
+            self.options.update(changed)
+
+    def play(self, board, time=0.1, info=chess.engine.INFO_NONE):
+        with profiler.uci_wait():
+            return self.engine.play(board, chess.engine.Limit(time), info=info)
+
+    def analyse(self, board, time=0.1, depth=None):
+        with profiler.uci_wait():
+            return self.engine.analyse(board, chess.engine.Limit(time=time, depth=depth))
+
+    def play_lines(self, board, time=0.1, multipv=1, info=chess.engine.INFO_ALL):
+        """
+        Search for a move as play does, returning the move played along with the latest info of every line among the
+        multipv best at some depth of the search, by the line's first move.
+        """
+        with profiler.uci_wait():
+            with self.engine.analysis(board, chess.engine.Limit(time=time), multipv=multipv, info=info) as analysis:
+                lines = {}
+                for line in analysis:
+                    add_line(lines, line)
+                return analysis.wait(), lines
+
+    def is_alive(self):
+        try:
+            self.engine.ping()
+            return True
+        except (chess.engine.EngineError, chess.engine.EngineTerminatedError, TimeoutError):
+            return False
+
+    def close(self):
+        try:
+            self.engine.quit()
+        except (chess.engine.EngineError, chess.engine.EngineTerminatedError, TimeoutError):
+            self.engine.close()
+
+
+class AsyncEngine:
+    """
+    Stockfish driven directly through chess.engine's asyncio UciProtocol, searches are awaited rather than blocking
+    a thread on the UCI pipe.
+    """
+
+    def __init__(self, transport, protocol: chess.engine.UciProtocol):
+        self.transport = transport
+        self.engine = protocol
+        self.options = {}
+
+    @classmethod
+    async def open(cls, level):
+        transport, protocol = await chess.engine.popen_uci(os.path.join(file_path, engine_path))
+        engine = cls(transport, protocol)
+        await engine.reconfigure(level)
+        return engine
+
+    async def reconfigure(self, level):
+        await self.configure({'Skill Level': level})
+
+    async def configure(self, options: dict):
+        changed = get_changed_options(self.engine.options, self.options, options)
+        if len(changed) != 0:
+            await self.engine.configure(changed)
+            self.options.update(changed)
+
+    async def play(self, board, time=0.1, info=chess.engine.INFO_NONE):
+        with profiler.uci_wait():
+            return await self.engine.play(board, chess.engine.Limit(time), info=info)
+
+    async def analyse(self, board, time=0.1):
+        with profiler.uci_wait():
+            return await self.engine.analyse(board, chess.engine.Limit(time=time))
+
+    async def analysis(self, board, time=0.1, multipv=None,
+                       info=chess.engine.INFO_ALL) -> chess.engine.AnalysisResult:
+        """
+        Start a search and return it as it runs, iterating it yields every info line and stop() ends it early.
+        """
+        return await self.engine.analysis(board, chess.engine.Limit(time=time), multipv=multipv, info=info)
+
+    async def play_lines(self, board, time=0.1, multipv=1, info=chess.engine.INFO_ALL):
+        with profiler.uci_wait():
+            with await self.engine.analysis(board, chess.engine.Limit(time=time), multipv=multipv,
+                                            info=info) as analysis:
+                lines = {}
+                async for line in analysis:
+                    add_line(lines, line)
+                return await analysis.wait(), lines
+
+    async def is_alive(self):
+        try:
+            await asyncio.wait_for(self.engine.ping(), PING_TIMEOUT)
+            return True
+        except (chess.engine.EngineError, chess.engine.EngineTerminatedError, asyncio.TimeoutError):
+            return False
+
+    async def close(self):
+        try:
+            await asyncio.wait_for(self.engine.quit(), PING_TIMEOUT)
+        except (chess.engine.EngineError, chess.engine.EngineTerminatedError, asyncio.TimeoutError):
+            self.transport.close()
+
+
+def add_line(lines: dict, info: dict):
+    """
+    Keep the info as the latest of the line starting with its principal variation's first move.
+    """
+    if len(info.get('pv', [])) > 0:
+        lines[info['pv'][0]] = info
+
 
-    def play(self, board, time=0.1):
-        return self.engine.play(board, chess.engine.Limit(time))
+def get_changed_options(supported, current: dict, options: dict) -> dict:
+    return {name: value for name, value in options.items() if name in supported and current.get(name) != value}
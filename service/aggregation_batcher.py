@@ -0,0 +1,68 @@
+import asyncio
+import logging
+
+from starlette.concurrency import run_in_threadpool
+
+from domain.client_json import AggregationRequest
+
+logger = logging.getLogger('chapi_agg')
+
+
+class AggregationBatcher:
+    """
+    Collects concurrent aggregation requests for up to max_wait seconds, or until max_batch_size have arrived, then
+    paraphrases them with a single batched GPT-2 generation and hands each result back to its own request.
+    """
+    DEFAULT_MAX_BATCH_SIZE = 8
+    DEFAULT_MAX_WAIT = 0.02
+
+    def __init__(self, gpt2_service, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT):
+        self.gpt2_service = gpt2_service
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = None
+        self.worker = None
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.create_task(self.run())
+
+    async def stop(self):
+        self.worker.cancel()
+        try:
+            await self.worker
+        except asyncio.CancelledError:
+            pass
+
+    async def submit(self, request: AggregationRequest) -> dict:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future))
+        return await future
+
+    async def next_batch(self) -> list:
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        while True:
+            batch = await self.next_batch()
+            try:
+                results = await run_in_threadpool(self.gpt2_service.aggregate_sentences,
+                                                  [request for request, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                logger.warning("Batched aggregation failed... " + str(e))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
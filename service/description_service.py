@@ -1,11 +1,15 @@
+import asyncio
 import random
+import time
 
 import chess
 
-from domain.client_json import DescriptionRequest
+from domain.client_json import DescriptionRequest, GameDescriptionRequest
+from domain.opening_book import OpeningBook
 from domain.repository import Repository
 from service import grammar_service
-from service.stockfish_service import StockfishService, Outcome
+from service.stockfish_service import StockfishService, Outcome, AnalysisContext
+from util import metrics, profiler
 from util.utils import get_move, get_random_generation, get_link, format_name, get_piece_name, get_to_square, WHITE, \
     BLACK
 
@@ -13,40 +17,94 @@ from util.utils import get_move, get_random_generation, get_link, format_name, g
 class DescriptionService:
     CRITICAL_BLUNDER_THRESHOLD = -0.6
 
-    def __init__(self):
+    def __init__(self, stockfish_service: StockfishService = None, opening_book: OpeningBook = None):
         self.repository = Repository()
-        self.stockfish_service = StockfishService()
+        self.stockfish_service = stockfish_service if stockfish_service is not None else StockfishService()
+        self.opening_book = opening_book if opening_book is not None else OpeningBook.from_repository(self.repository)
 
-    def get_description(self, request: DescriptionRequest) -> []:
+    @metrics.timed('description')
+    def get_description(self, request: DescriptionRequest, context: AnalysisContext = None, deadline=None) -> []:
         """
         For a given DescriptionRequest : (user, moveStack, move, fen), generate an array of English descriptions
         providing insight on: the opening scenario, winning conditions, mate conditions...
+        With a deadline the Stockfish searches are shortened to fit within that many seconds.
         """
 
+        context = context if context is not None else AnalysisContext(self.stockfish_service,
+                                                                       deadline=get_deadline(deadline))
         response = {'descriptions': [], 'link': None,
-                    'score': self.stockfish_service.get_relative_score(request.fen, request.user)}
+                    'score': self.stockfish_service.get_relative_score(request.fen, request.user, context)}
 
-        opening_data = self.get_opening_description(request)
+        opening_data = self.get_opening_description(request, context)
         response['descriptions'].extend(opening_data[0])
         response['link'] = opening_data[1]
         response['opening'] = opening_data[2]
         response['descriptions'].extend(self.get_positional_description(request))
         response['descriptions'].extend(self.get_move_suggestions(request))
-        response['descriptions'].extend(self.get_mate_description(request))
+        response['descriptions'].extend(self.get_mate_description(request, context))
         response['descriptions'].extend(self.get_end_description(request))
-        response['descriptions'].extend(self.get_blunder_description(request))
-        response['descriptions'].extend(self.get_gain_description(request))
+        response['descriptions'].extend(self.get_blunder_description(request, context))
+        response['descriptions'].extend(self.get_gain_description(request, context))
         response['descriptions'] = [' '.join(response['descriptions'])]
         return response
 
-    def get_opening_description(self, request: DescriptionRequest):
+    async def get_description_async(self, request: DescriptionRequest, deadline=None) -> []:
         """
-        Queries the database to determine if the board is in a particular opening scenario. Returns a relevant
+        As get_description, with every component run at once on the threadpool so their Stockfish searches use
+        several engines of the pool in parallel. Components not done within deadline seconds are left out, except the
+        score and the opening which the response can't go without.
+        """
+
+        context = AnalysisContext(self.stockfish_service, deadline=get_deadline(deadline))
+        score = run_component(self.stockfish_service.get_relative_score, request.fen, request.user, context)
+        opening = run_component(self.get_opening_description, request, context)
+        components = [run_component(self.get_positional_description, request),
+                      run_component(self.get_move_suggestions, request),
+                      run_component(self.get_mate_description, request, context),
+                      run_component(self.get_end_description, request),
+                      run_component(self.get_blunder_description, request, context),
+                      run_component(self.get_gain_description, request, context)]
+        await asyncio.wait([score, opening] + components, timeout=deadline)
+
+        opening_data = await opening
+        response = {'descriptions': list(opening_data[0]), 'link': opening_data[1], 'opening': opening_data[2],
+                    'score': await score}
+        for component in components:
+            if component.done():
+                response['descriptions'].extend(component.result())
+            else:
+                # the thread can't be interrupted, it finishes in the background and its result is dropped
+                component.cancel()
+        response['descriptions'] = [' '.join(response['descriptions'])]
+        return response
+
+    def get_game_descriptions(self, request: GameDescriptionRequest, fen_stack: list = None):
+        """
+        Yield the description of every ply of a game in order, the user playing White. The plies share one
+        AnalysisContext, so a position is searched once however many plies look back at it.
+        """
+
+        fen_stack = fen_stack if fen_stack is not None else get_game_fen_stack(request)
+        context = AnalysisContext(self.stockfish_service)
+        for ply, uci in enumerate(request.moveStack):
+            ply_request = DescriptionRequest(user=WHITE if ply % 2 == 0 else BLACK,
+                                             moveStack=request.moveStack[:ply + 1],
+                                             uci=uci,
+                                             fen=fen_stack[ply + 1],
+                                             fenStack=fen_stack[:ply + 2])
+            response = self.get_description(ply_request, context)
+            response['ply'] = ply
+            yield response
+
+    @metrics.timed('description.opening')
+    def get_opening_description(self, request: DescriptionRequest, context: AnalysisContext = None):
+        """
+        Queries the opening book to determine if the board is in a particular opening scenario. Returns a relevant
         CFG generated description with Wikipedia link if it exists.
         """
 
         grammar = grammar_service.get_default_opening(request.user, request.uci)
-        opening = self.repository.query_opening_by_move_stack(request.moveStack)
+        opening = self.opening_book.query_opening_by_move_stack(request.moveStack)
         capture = self.stockfish_service.get_capture_result(request)
         is_check = self.stockfish_service.get_is_check(request)
         move = get_move(request.uci, opening)
@@ -57,18 +115,19 @@ class DescriptionService:
                 grammar = grammar_service.get_user_first_opening(move)
             else:
                 previous_move = get_move(request.moveStack[len(request.moveStack) - 2],
-                                         self.repository.query_opening_by_move_stack(request.moveStack[:-1]))
+                                         self.opening_book.query_opening_by_move_stack(request.moveStack[:-1]))
                 grammar = grammar_service.get_user_move(move, previous_move, capture, is_check)
 
         elif request.user == BLACK:
-            is_following_blunder = self.stockfish_service.is_following_blunder(request)
+            is_following_blunder = self.stockfish_service.is_following_blunder(request, context)
             previous_move = get_move(request.moveStack[len(request.moveStack) - 2],
-                                     self.repository.query_opening_by_move_stack(request.moveStack[:-1]))
+                                     self.opening_book.query_opening_by_move_stack(request.moveStack[:-1]))
             grammar = grammar_service.get_stockfish_move(move, previous_move, capture, is_check, is_following_blunder)
 
         # return the description, link and move name for rendering on front end
         return get_random_generation(grammar), get_link(opening), move
 
+    @metrics.timed('description.end')
     def get_end_description(self, request: DescriptionRequest):
         """
         Uses Stockfish to analyse the board for end conditions: won, lost, stalemate.
@@ -89,13 +148,14 @@ class DescriptionService:
             grammar = grammar_service.get_stalemate_ending(move_count)
         return get_random_generation(grammar)
 
-    def get_mate_description(self, request: DescriptionRequest):
+    @metrics.timed('description.mate')
+    def get_mate_description(self, request: DescriptionRequest, context: AnalysisContext = None):
         """
         Use Stockfish to analyse whether a Checkmate is available or if the user is being checkmated.
         Generates a natural language description if the conditions are met.
         """
 
-        checkmate_result = self.stockfish_service.get_mate_result(request)
+        checkmate_result = self.stockfish_service.get_mate_result(request, context)
         if checkmate_result is None:
             return []
 
@@ -114,11 +174,13 @@ class DescriptionService:
 
         return get_random_generation(grammar)
 
-    def get_blunder_description(self, request: DescriptionRequest):
+    @metrics.timed('description.blunder')
+    def get_blunder_description(self, request: DescriptionRequest, context: AnalysisContext = None):
         """
         Use Stockfish to detect whether a move made was a fair or critical blunder and return a description if it is.
         """
-        advantage_change = self.stockfish_service.get_advantage_change(request.fenStack, request.fen, request.user)
+        advantage_change = self.stockfish_service.get_advantage_change(request.fenStack, request.fen, request.user,
+                                                                       context)
         if request.user == BLACK or advantage_change is None or advantage_change > self.stockfish_service.BLUNDER_THRESHOLD:
             return []
 
@@ -126,6 +188,7 @@ class DescriptionService:
                                                    advantage_change < self.CRITICAL_BLUNDER_THRESHOLD)
         return get_random_generation(grammar)
 
+    @metrics.timed('description.suggestions')
     def get_move_suggestions(self, request):
         """
         On Stockfish's move, return suggestion moves to the player based on common openings in the database.
@@ -135,8 +198,8 @@ class DescriptionService:
             return []
 
         move_stack_string = ' '.join(request.moveStack)
-        openings = self.repository.query_opening_by_move_stack_subset(move_stack_string)
-        original_opening = self.repository.query_opening_by_move_stack(request.moveStack)
+        openings = self.opening_book.query_opening_by_move_stack_subset(move_stack_string)
+        original_opening = self.opening_book.query_opening_by_move_stack(request.moveStack)
         if len(openings) > 3:
             openings = random.sample(openings, 3)
         moves = [opening['move_stack'].replace(move_stack_string, '').replace(' ', '') for opening in openings]
@@ -148,6 +211,7 @@ class DescriptionService:
         grammar = grammar_service.get_move_suggestion(moves, names)
         return get_random_generation(grammar)
 
+    @metrics.timed('description.positional')
     def get_positional_description(self, request):
         """
         Describes the move's relative positional information. Moving forward/backwards, moving from an original
@@ -186,13 +250,16 @@ class DescriptionService:
 
         return get_random_generation(grammar)
 
-    def get_gain_description(self, request: DescriptionRequest):
+    @metrics.timed('description.gain')
+    def get_gain_description(self, request: DescriptionRequest, context: AnalysisContext = None):
         """
         Use Stockfish to detect whether the move made was a good, great or fantastic move. Return an explanation back
         to the user depending on the outcome.
         """
 
-        advantage_change = self.stockfish_service.get_advantage_change(request.fenStack, request.fen, request.user)
+        context = context if context is not None else AnalysisContext(self.stockfish_service)
+        advantage_change = self.stockfish_service.get_advantage_change(request.fenStack, request.fen, request.user,
+                                                                       context)
         if request.user == BLACK or advantage_change is None \
                 or advantage_change < self.stockfish_service.GOOD_MOVE_LOWER_BOUND:
             return []
@@ -200,9 +267,54 @@ class DescriptionService:
         rounded_advantage_change = abs(round(advantage_change * 100))
         grammar = grammar_service.get_good_move(request.uci, rounded_advantage_change)
         if advantage_change > self.stockfish_service.GOOD_MOVE_UPPER_BOUND:
-            play_result = self.stockfish_service.get_best_move(request.fen)
+            play_result = context.get_best_move(request.fen)
             grammar = grammar_service.get_fantastic_move(request.uci, rounded_advantage_change)
-            if request.uci == play_result.move.uci() or request.uci == play_result.ponder.uci():
+            if request.uci in [move.uci() for move in [play_result.move, play_result.ponder] if move is not None]:
                 grammar = grammar_service.get_fantastic_move(request.uci, rounded_advantage_change)
 
         return get_random_generation(grammar)
+
+
+def get_fen_stack(move_stack: list) -> list:
+    """
+    The fen of the starting position followed by the fen after each move.
+    """
+
+    board = chess.Board()
+    fen_stack = [board.fen()]
+    for uci in move_stack:
+        board.push_uci(uci)
+        fen_stack.append(board.fen())
+    return fen_stack
+
+
+def get_game_fen_stack(request: GameDescriptionRequest) -> list:
+    """
+    The fen stack of a game, checked against its moves. Raises ValueError if a move is illegal or if the given
+    fenStack isn't the starting position followed by the position after each move.
+    """
+
+    fen_stack = get_fen_stack(request.moveStack)
+    if request.fenStack is None:
+        return fen_stack
+    if len(request.fenStack) != len(fen_stack):
+        raise ValueError('fenStack has {} fens for {} moves, expected {}'.format(len(request.fenStack),
+                                                                                 len(request.moveStack),
+                                                                                 len(fen_stack)))
+    for ply, (fen, expected) in enumerate(zip(request.fenStack, fen_stack)):
+        # the move clocks aren't compared, only the position
+        try:
+            matches = chess.Board(fen).epd() == chess.Board(expected).epd()
+        except ValueError:
+            matches = False
+        if not matches:
+            raise ValueError('fenStack[{}] is not the position after moveStack[:{}]'.format(ply, ply))
+    return request.fenStack
+
+
+def run_component(function, *args) -> asyncio.Future:
+    return asyncio.ensure_future(profiler.run_in_threadpool(function, *args))
+
+
+def get_deadline(seconds=None):
+    return time.monotonic() + seconds if seconds is not None else None
@@ -0,0 +1,84 @@
+import json
+import os
+
+import numpy as np
+import onnxruntime
+from tokenizers import ByteLevelBPETokenizer
+
+from service.paraphrase_model import ParaphraseModel
+
+
+class BPEEncoder:
+    """
+    GPT-2's byte level BPE from the checkpoint's encoder.json and vocab.bpe, with the encode/decode interface of
+    gpt_2_simple's encoder but without importing TensorFlow.
+    """
+
+    def __init__(self, directory):
+        self.tokenizer = ByteLevelBPETokenizer(os.path.join(directory, 'encoder.json'),
+                                               os.path.join(directory, 'vocab.bpe'))
+
+    def encode(self, text: str) -> list:
+        return self.tokenizer.encode(text).ids
+
+    def decode(self, tokens) -> str:
+        return self.tokenizer.decode([int(token) for token in tokens], skip_special_tokens=False)
+
+    def token_to_id(self, token: str) -> int:
+        return self.tokenizer.token_to_id(token)
+
+
+class GPT2OnnxService(ParaphraseModel):
+    """
+    The paraphrase model on ONNX Runtime, from the single step graph written by data/export_gpt2_onnx.py. Decoding
+    runs in numpy with the key/value cache fed back into each step.
+    """
+    DEFAULT_MODEL = os.path.join('checkpoint', 'run1', 'model.int8.onnx')
+    TOKENS = 'tokens:0'
+    PAST = 'past:0'
+    LOGITS = 'logits:0'
+    PRESENTS = 'presents:0'
+
+    def __init__(self, model_path=DEFAULT_MODEL, max_new_tokens=None, threads=0):
+        directory = os.path.dirname(model_path)
+        bpe_encoder = BPEEncoder(directory)
+        super().__init__(bpe_encoder, bpe_encoder.token_to_id(self.EOS_TAG), max_new_tokens)
+        with open(os.path.join(directory, 'hparams.json')) as file:
+            self.hparams = json.load(file)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.stop_tokens = np.array(self.get_stop_tokens())
+
+    def sample(self, prompts: list, length: int) -> list:
+        output = np.array(prompts, dtype=np.int32)
+        past = np.zeros(self.get_past_shape(len(prompts)), dtype=np.float32)
+        done = np.zeros(len(prompts), dtype=bool)
+
+        logits, past = self.step(output, past)
+        for _ in range(length):
+            samples = sample_logits(logits, self.TEMPERATURE)
+            samples[done] = self.stop_tokens[0]
+            done |= np.isin(samples, self.stop_tokens)
+            output = np.concatenate([output, samples[:, np.newaxis]], axis=1)
+            if done.all():
+                break
+            logits, past = self.step(samples[:, np.newaxis], past)
+        return output
+
+    def step(self, tokens, past):
+        return self.session.run([self.LOGITS, self.PRESENTS], {self.TOKENS: tokens, self.PAST: past})
+
+    def get_past_shape(self, batch_size: int):
+        return [batch_size, self.hparams['n_layer'], 2, self.hparams['n_head'], 0,
+                self.hparams['n_embd'] // self.hparams['n_head']]
+
+
+def sample_logits(logits, temperature):
+    """
+    Draw one token per row from softmax(logits / temperature) using the Gumbel-max trick.
+    """
+    gumbel = -np.log(-np.log(np.random.uniform(size=logits.shape)))
+    return np.argmax(logits / temperature + gumbel, axis=-1).astype(np.int32)
@@ -1,36 +1,90 @@
+import json
+import os
+
 import gpt_2_simple as gpt2
 import tensorflow as tf
+from gpt_2_simple.src import encoder, model
 
-from domain.client_json import AggregationRequest
+from service.paraphrase_model import ParaphraseModel
 
 
-class GPT2Service:
-    SAMPLES = 1
-    TEMPERATURE = 0.8
-    INPUT = "ORIGINAL: {}\n"
-    EOS_TAG = '<|endoftext|>'
+class GPT2Service(ParaphraseModel):
+    RUN_NAME = 'run1'
 
-    def __init__(self, directory):
+    def __init__(self, directory, max_new_tokens=None, threads=0):
         tf.compat.v1.reset_default_graph()
-        self.sess = gpt2.start_tf_sess()
-        gpt2.load_gpt2(self.sess, run_name='run1', checkpoint_dir=directory)
-
-    def aggregate_sentence(self, request: AggregationRequest):
-        return {'index': request.index,
-                'aggregation': self.generate_paraphrases(original_text=request.original, n_samples=self.SAMPLES)[0]}
-
-    def generate_paraphrases(self, original_text: str, n_samples: int):
-        samples = gpt2.generate(
-            self.sess,
-            length=len(original_text),
-            temperature=self.TEMPERATURE,
-            prefix=self.INPUT.format(original_text),
-            truncate=self.EOS_TAG,
-            nsamples=n_samples,
-            batch_size=n_samples,
-            return_as_list=True
+        # gpt_2_simple leaves TensorFlow's thread pools at their defaults unless threads is positive
+        self.sess = gpt2.start_tf_sess(threads=threads if threads > 0 else -1)
+        gpt2.load_gpt2(self.sess, run_name=self.RUN_NAME, checkpoint_dir=directory)
+
+        checkpoint_path = os.path.join(directory, self.RUN_NAME)
+        gpt2_encoder = encoder.get_encoder(checkpoint_path)
+        super().__init__(gpt2_encoder, gpt2_encoder.encoder[self.EOS_TAG], max_new_tokens)
+        self.hparams = model.default_hparams()
+        with open(os.path.join(checkpoint_path, 'hparams.json')) as file:
+            self.hparams.override_from_dict(json.load(file))
+
+        # the sampling graph is built once with a variable batch and length, gpt2.generate rebuilds it every call
+        self.context = tf.compat.v1.placeholder(tf.int32, [None, None])
+        self.length = tf.compat.v1.placeholder(tf.int32, [])
+        self.output = sample_until(hparams=self.hparams, length=self.length, context=self.context,
+                                   stop_tokens=self.get_stop_tokens(), temperature=self.TEMPERATURE)
+
+    def sample(self, prompts: list, length: int) -> list:
+        return self.sess.run(self.output, feed_dict={self.context: prompts, self.length: length})
+
+
+def sample_until(*, hparams, length, context, stop_tokens, temperature=1):
+    """
+    gpt_2_simple's sample_sequence, except that the loop ends as soon as every row has emitted one of the stop
+    tokens instead of always running for length tokens. Finished rows are padded with the first stop token.
+    """
+
+    def step(tokens, past=None):
+        lm_output = model.model(hparams=hparams, X=tokens, past=past, reuse=tf.compat.v1.AUTO_REUSE)
+        presents = lm_output['present']
+        presents.set_shape(model.past_shape(hparams=hparams, batch_size=None))
+        return {'logits': lm_output['logits'][:, :, :hparams.n_vocab], 'presents': presents}
+
+    with tf.compat.v1.name_scope('sample_until'):
+        stop_tokens = tf.constant(stop_tokens, dtype=tf.int32)
+        context_output = step(context[:, :-1])
+
+        def body(past, prev, output, done):
+            next_outputs = step(prev[:, tf.newaxis], past=past)
+            logits = next_outputs['logits'][:, -1, :] / tf.cast(temperature, tf.float32)
+            samples = tf.random.categorical(logits, num_samples=1, dtype=tf.int32)[:, 0]
+            samples = tf.where(done, tf.fill(tf.shape(samples), stop_tokens[0]), samples)
+            done = tf.logical_or(done, tf.reduce_any(tf.equal(samples[:, tf.newaxis], stop_tokens[tf.newaxis, :]),
+                                                     axis=1))
+            return [
+                tf.concat([past, next_outputs['presents']], axis=-2),
+                samples,
+                tf.concat([output, samples[:, tf.newaxis]], axis=1),
+                done,
+            ]
+
+        def cond(past, prev, output, done):
+            return tf.logical_not(tf.reduce_all(done))
+
+        _, _, tokens, _ = tf.compat.v1.while_loop(
+            cond=cond, body=body,
+            maximum_iterations=length,
+            loop_vars=[
+                context_output['presents'],
+                context[:, -1],
+                context,
+                tf.zeros(tf.shape(context)[:1], dtype=tf.bool),
+            ],
+            shape_invariants=[
+                tf.TensorShape(model.past_shape(hparams=hparams, batch_size=None)),
+                tf.TensorShape([None]),
+                tf.TensorShape([None, None]),
+                tf.TensorShape([None]),
+            ],
+            back_prop=False,
         )
-        return [sample.split('\n')[1].replace('PARAPHRASED: ', '') for sample in samples]
+        return tokens
 
 
 if __name__ == '__main__':
@@ -1,6 +1,5 @@
-from nltk import CFG
-
 # --------------- DEFAULT ---------------
+from util.grammar import template
 from util.utils import WHITE
 
 YOU_E = "    P -> 'You'"
@@ -16,7 +15,7 @@ DEFAULT_OPENING = """
 
 
 def get_default_opening(user, move):
-    return CFG.fromstring(DEFAULT_OPENING.format(user=user, move=move))
+    return template(DEFAULT_OPENING, user=user, move=move)
 
 
 STALEMATE_ENDING = """
@@ -26,7 +25,7 @@ STALEMATE_ENDING = """
 
 
 def get_stalemate_ending(move_count):
-    return CFG.fromstring(STALEMATE_ENDING.format(move_count=move_count))
+    return template(STALEMATE_ENDING, move_count=move_count)
 
 
 POSITIONAL_DESC = """
@@ -51,19 +50,19 @@ def get_positional_description(user, piece, to_square, is_bring_out=None, column
     grammar += (U_U if user == WHITE else S_U)
     if is_bring_out is not None and is_bring_out:
         grammar += (U_PIECE_BROUGHT_OUT if user == WHITE else S_PIECE_BROUGHT_OUT)
-        return CFG.fromstring(grammar.format(piece=piece, to_square=to_square))
+        return template(grammar, piece=piece, to_square=to_square)
     if column_move is not None:
         if column_move > 0:
             grammar += (U_PIECE_FORWARD if user == WHITE else S_PIECE_FORWARD)
         else:
             grammar += (U_PIECE_BACKWARD if user == WHITE else S_PIECE_BACKWARD)
-        return CFG.fromstring(grammar.format(piece=piece, to_square=to_square))
+        return template(grammar, piece=piece, to_square=to_square)
     if outward_move is not None:
         if outward_move > 0:
             grammar += (U_PIECE_ADVANCE if user == WHITE else S_PIECE_ADVANCE)
         else:
             grammar += (U_PIECE_RETREAT if user == WHITE else S_PIECE_RETREAT)
-        return CFG.fromstring(grammar.format(piece=piece, to_square=to_square))
+        return template(grammar, piece=piece, to_square=to_square)
     return None
 
 
@@ -78,7 +77,7 @@ USER_FIRST_OPENING = """
 
 
 def get_user_first_opening(move):
-    return CFG.fromstring((USER_FIRST_OPENING + YOU_E).format(move=move))
+    return template(USER_FIRST_OPENING + YOU_E, move=move)
 
 
 S_CAP = """
@@ -113,7 +112,7 @@ CHECK_M = """
 def get_user_move(move, previous_move, capture, is_check):
     grammar = ""
     if capture is not None:
-        grammar += S_CAP + USER_MOVE + YOU_E + CAPTURE_AM.format(piece=capture)
+        grammar += S_CAP + USER_MOVE + YOU_E + CAPTURE_AM
     else:
         grammar += S_NO_CAP + USER_MOVE + YOU_E + NO_CAPTURE_AM
 
@@ -122,7 +121,7 @@ def get_user_move(move, previous_move, capture, is_check):
     else:
         grammar += NO_CHECK_M
 
-    return CFG.fromstring(grammar.format(move=move, previous_move=previous_move))
+    return template(grammar, move=move, previous_move=previous_move, piece=capture)
 
 
 USER_WIN_CONDITION = """
@@ -132,7 +131,7 @@ USER_WIN_CONDITION = """
 
 
 def get_user_win_condition(move_count):
-    return CFG.fromstring((USER_WIN_CONDITION + YOU_E).format(move_count=move_count))
+    return template(USER_WIN_CONDITION + YOU_E, move_count=move_count)
 
 
 USER_CHECKMATING = """
@@ -143,7 +142,7 @@ USER_CHECKMATING = """
 
 
 def get_user_checkmating(move_count):
-    return CFG.fromstring(USER_CHECKMATING.format(move_count=move_count))
+    return template(USER_CHECKMATING, move_count=move_count)
 
 
 USER_CHECKMATED = """
@@ -153,7 +152,7 @@ USER_CHECKMATED = """
 
 
 def get_user_checkmated():
-    return CFG.fromstring(USER_CHECKMATED)
+    return template(USER_CHECKMATED)
 
 
 USER_BLUNDER = """
@@ -177,8 +176,8 @@ CRITICAL_CS = """    C -> 'is' V
 
 def get_user_blunder(move, loss, critical: bool):
     if critical:
-        return CFG.fromstring((USER_BLUNDER + CRITICAL_CS).format(move=move, loss=str(loss)))
-    return CFG.fromstring((USER_BLUNDER + NORMAL_CS).format(move=move, loss=str(loss)))
+        return template(USER_BLUNDER + CRITICAL_CS, move=move, loss=str(loss))
+    return template(USER_BLUNDER + NORMAL_CS, move=move, loss=str(loss))
 
 
 MOVE_SUGGESTION = """
@@ -206,16 +205,13 @@ M_MOVE_3 = """
 
 def get_move_suggestion(moves: list, names: list):
     if len(moves) == 1:
-        return CFG.fromstring((MOVE_SUGGESTION + M_MOVE_1).format(move1=moves[0], opening_name_1=names[0]))
+        return template(MOVE_SUGGESTION + M_MOVE_1, move1=moves[0], opening_name_1=names[0])
     elif len(moves) == 2:
-        return CFG.fromstring(
-            (MOVE_SUGGESTION + M_MOVE_2).format(move1=moves[0], opening_name_1=names[0], move2=moves[1],
-                                                opening_name_2=names[1]))
+        return template(MOVE_SUGGESTION + M_MOVE_2, move1=moves[0], opening_name_1=names[0], move2=moves[1],
+                        opening_name_2=names[1])
     else:
-        return CFG.fromstring(
-            (MOVE_SUGGESTION + M_MOVE_3).format(move1=moves[0], opening_name_1=names[0], move2=moves[1],
-                                                opening_name_2=names[1], move3=moves[2],
-                                                opening_name_3=names[2]))
+        return template(MOVE_SUGGESTION + M_MOVE_3, move1=moves[0], opening_name_1=names[0], move2=moves[1],
+                        opening_name_2=names[1], move3=moves[2], opening_name_3=names[2])
 
 
 MOVE_PRAISE = """
@@ -242,16 +238,15 @@ FANTASTIC_MOVE = """
 
 
 def get_good_move(move, advantage):
-    return CFG.fromstring(
-        (MOVE_PRAISE + GOOD_AND_GREAT + GOOD_MOVE_ADJ).format(move=move, advantage=advantage))
+    return template(MOVE_PRAISE + GOOD_AND_GREAT + GOOD_MOVE_ADJ, move=move, advantage=advantage)
 
 
 def get_great_move(move, advantage):
-    return CFG.fromstring((MOVE_PRAISE + GOOD_AND_GREAT + GREAT_MOVE_ADJ).format(move=move, advantage=advantage))
+    return template(MOVE_PRAISE + GOOD_AND_GREAT + GREAT_MOVE_ADJ, move=move, advantage=advantage)
 
 
 def get_fantastic_move(move, advantage):
-    return CFG.fromstring((MOVE_PRAISE + FANTASTIC_MOVE).format(move=move, advantage=advantage))
+    return template(MOVE_PRAISE + FANTASTIC_MOVE, move=move, advantage=advantage)
 
 
 # -------------- STOCKFISH --------------
@@ -289,7 +284,7 @@ BLUND_CAP = """
 def get_stockfish_move(move, previous_move, capture, is_check, is_following_blunder):
     grammar = ""
     if capture is not None:
-        grammar += S_S_CAP + STOCKFISH_MOVE + STOCK_E + CAPTURE_S_AM.format(piece=capture)
+        grammar += S_S_CAP + STOCKFISH_MOVE + STOCK_E + CAPTURE_S_AM
     else:
         grammar += S_S_NO_CAP + STOCKFISH_MOVE + STOCK_E + NO_CAPTURE_S_AM
 
@@ -301,7 +296,7 @@ def get_stockfish_move(move, previous_move, capture, is_check, is_following_blun
     if is_following_blunder:
         grammar += BLUND_CAP
 
-    return CFG.fromstring(grammar.format(move=move, previous_move=previous_move))
+    return template(grammar, move=move, previous_move=previous_move, piece=capture)
 
 
 STOCKFISH_WIN_CONDITION = """
@@ -311,7 +306,7 @@ STOCKFISH_WIN_CONDITION = """
 
 
 def get_stockfish_win_condition(move_count):
-    return CFG.fromstring((STOCKFISH_WIN_CONDITION + STOCK_E).format(move_count=move_count))
+    return template(STOCKFISH_WIN_CONDITION + STOCK_E, move_count=move_count)
 
 
 STOCKFISH_CHECKMATING = """
@@ -325,7 +320,7 @@ STOCKFISH_CHECKMATING = """
 
 
 def get_stockfish_checkmating(move_count):
-    return CFG.fromstring((STOCKFISH_CHECKMATING + STOCK_E).format(move_count=move_count))
+    return template(STOCKFISH_CHECKMATING + STOCK_E, move_count=move_count)
 
 
 STOCKFISH_CHECKMATED = """
@@ -334,4 +329,4 @@ STOCKFISH_CHECKMATED = """
 
 
 def get_stockfish_checkmated():
-    return CFG.fromstring(STOCKFISH_CHECKMATED + STOCK_E)
+    return template(STOCKFISH_CHECKMATED + STOCK_E)
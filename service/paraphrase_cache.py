@@ -0,0 +1,90 @@
+import asyncio
+import json
+import logging
+import os
+import random
+from collections import OrderedDict
+
+from domain.client_json import AggregationRequest
+
+logger = logging.getLogger('chapi_agg')
+
+
+class ParaphraseCache:
+    """
+    Bounded LRU cache in front of GPT-2. Every original text keeps a small pool of generated paraphrases which are
+    handed out at random once the pool is full, so repeated sentences stay varied without running the model again.
+    Concurrent requests for a text that is already being generated wait on that one generation.
+    """
+    DEFAULT_SIZE = 10000
+    DEFAULT_POOL_SIZE = 4
+
+    def __init__(self, generate, size=DEFAULT_SIZE, pool_size=DEFAULT_POOL_SIZE, path=None):
+        self.generate = generate
+        self.size = size
+        self.pool_size = pool_size
+        self.path = path
+        self.paraphrases = OrderedDict()
+        self.in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    async def aggregate(self, request: AggregationRequest) -> dict:
+        """
+        Answer the request from the pool when it's full, or from a pooled paraphrase while another generation for
+        the same text is running, and generate a new paraphrase otherwise.
+        """
+
+        original = request.original
+        pool = self.paraphrases.get(original, [])
+        if len(pool) >= self.pool_size or (len(pool) > 0 and original in self.in_flight):
+            self.hits += 1
+            self.paraphrases.move_to_end(original)
+            return {'index': request.index, 'aggregation': random.choice(pool)}
+
+        self.misses += 1
+        future = self.in_flight.get(original)
+        if future is None:
+            future = asyncio.ensure_future(self.generate_paraphrase(original))
+            self.in_flight[original] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(original, None))
+        return {'index': request.index, 'aggregation': await asyncio.shield(future)}
+
+    async def generate_paraphrase(self, original: str) -> str:
+        result = await self.generate(AggregationRequest(index=0, original=original))
+        self.add(original, result['aggregation'])
+        return result['aggregation']
+
+    def add(self, original: str, paraphrase: str):
+        pool = self.paraphrases.setdefault(original, [])
+        if len(pool) < self.pool_size:
+            pool.append(paraphrase)
+        self.paraphrases.move_to_end(original)
+        while len(self.paraphrases) > self.size:
+            self.paraphrases.popitem(last=False)
+
+    def is_full(self, original: str):
+        return len(self.paraphrases.get(original, [])) >= self.pool_size
+
+    def statistics(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.paraphrases),
+                'in_flight': len(self.in_flight), 'hit_rate': self.hits / lookups if lookups > 0 else None}
+
+    def load(self):
+        with open(self.path, 'r') as file:
+            for original, pool in json.load(file).items():
+                for paraphrase in pool:
+                    self.add(original, paraphrase)
+
+    def save(self):
+        if not self.path:
+            return
+        # every worker saves its own pools on shutdown, a temporary file per process keeps the writes apart
+        temporary_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temporary_path, 'w') as file:
+            json.dump(self.paraphrases, file)
+        os.replace(temporary_path, self.path)
+        logger.info("Saved {} paraphrase pools to {}".format(len(self.paraphrases), self.path))
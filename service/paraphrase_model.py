@@ -0,0 +1,79 @@
+from domain.client_json import AggregationRequest
+from util import metrics
+
+
+class ParaphraseModel:
+    """
+    The prompt handling shared by the GPT-2 backends: building and tokenising prompts, batching them by length,
+    budgeting new tokens and pulling the paraphrase out of the sample. Backends provide the encoder and sample().
+    """
+    SAMPLES = 1
+    TEMPERATURE = 0.8
+    INPUT = "ORIGINAL: {}\n"
+    EOS_TAG = '<|endoftext|>'
+    MAX_CONTEXT = 1023
+    # a paraphrase rarely runs to more than twice the original's tokens, plus the "PARAPHRASED: " tag and the stop
+    LENGTH_RATIO = 2
+    LENGTH_MARGIN = 8
+
+    def __init__(self, encoder, eos_token: int, max_new_tokens=None):
+        self.encoder = encoder
+        self.eos_token = eos_token
+        self.max_new_tokens = max_new_tokens
+
+    def sample(self, prompts: list, length: int) -> list:
+        """
+        Sample up to length new tokens for each of the equal length prompts, returning prompt and sample tokens.
+        """
+        raise NotImplementedError
+
+    def aggregate_sentence(self, request: AggregationRequest):
+        return {'index': request.index,
+                'aggregation': self.generate_paraphrases(original_text=request.original, n_samples=self.SAMPLES)[0]}
+
+    def aggregate_sentences(self, requests: list):
+        """
+        Paraphrase a batch of requests in as few generate calls as possible, results are in the requests' order.
+        """
+        paraphrases = self.generate_batch([request.original for request in requests])
+        return [{'index': request.index, 'aggregation': paraphrase}
+                for request, paraphrase in zip(requests, paraphrases)]
+
+    @metrics.timed('paraphrase.generate_paraphrases')
+    def generate_paraphrases(self, original_text: str, n_samples: int):
+        return self.generate_batch([original_text] * n_samples)
+
+    @metrics.timed('paraphrase.generate_batch')
+    def generate_batch(self, original_texts: list):
+        """
+        Generate one paraphrase per original text. Prompts are grouped by their token length and each group is sampled
+        as a single batch: neither backend's graph takes an attention mask or position offsets, so a padded prompt
+        would change what the model generates. Batches of sentences with different lengths gain little.
+        """
+
+        prompts = [self.encoder.encode(self.INPUT.format(original_text)) for original_text in original_texts]
+        groups = {}
+        for i, prompt in enumerate(prompts):
+            groups.setdefault(len(prompt), []).append(i)
+
+        paraphrases = [None] * len(original_texts)
+        for prompt_length, indexes in groups.items():
+            length = min(max(self.get_token_budget(prompts[i]) for i in indexes), self.MAX_CONTEXT - prompt_length)
+            tokens = self.sample([prompts[i] for i in indexes], length)
+            for i, row in zip(indexes, tokens):
+                paraphrases[i] = self.extract_paraphrase(self.encoder.decode(row))
+        return paraphrases
+
+    def get_token_budget(self, prompt: list):
+        """
+        The number of new tokens to allow for a prompt, sized from its tokens rather than its characters so longer
+        sentences get a longer budget. max_new_tokens caps it only when it's set.
+        """
+        budget = len(prompt) * self.LENGTH_RATIO + self.LENGTH_MARGIN
+        return min(budget, self.max_new_tokens) if self.max_new_tokens is not None else budget
+
+    def get_stop_tokens(self):
+        return [self.eos_token] + self.encoder.encode('\n')
+
+    def extract_paraphrase(self, sample_text: str):
+        return sample_text.split(self.EOS_TAG)[0].split('\n')[1].replace('PARAPHRASED: ', '')
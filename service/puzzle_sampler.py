@@ -0,0 +1,138 @@
+import logging
+import random
+import threading
+import time
+from array import array
+
+from domain.repository import Repository, AsyncRepository
+from util.shared_store import SharedStore, save_index, load_index
+
+logger = logging.getLogger('chapi')
+
+
+class PuzzleIndexError(Exception):
+    """
+    Raised for puzzle requests while the indexes haven't been built, e.g. because the database is unreachable.
+    """
+
+
+class PuzzleSampler:
+    """
+    Keeps the ids of the single move puzzles by type and the mate in n puzzles by n in memory, refreshed on a
+    background thread. Picking a random puzzle is then a random id and a primary key lookup instead of loading every
+    matching row. With a shared store the indexes are built by one worker and memory mapped by all of them. If the
+    first build fails the sampler starts anyway and the background thread retries every RETRY_INTERVAL seconds.
+    """
+    DEFAULT_REFRESH_INTERVAL = 300
+    RETRY_INTERVAL = 10
+    # the most puzzles one request may ask for, each is a row of the same IN (...) query
+    MAX_K = 100
+    SINGLE_MOVE_INDEX = 'single_move_ids.bin'
+    MATE_IN_N_INDEX = 'mate_in_n_ids.bin'
+
+    def __init__(self, repository: Repository = None, refresh_interval=DEFAULT_REFRESH_INTERVAL,
+                 async_repository: AsyncRepository = None, store: SharedStore = None):
+        self.repository = repository if repository is not None else Repository()
+        self.async_repository = async_repository
+        self.refresh_interval = refresh_interval
+        self.store = store
+        self.version = None
+        self.single_move_ids = {}
+        self.mate_in_n_ids = {}
+        self.listeners = []
+        self.stopped = threading.Event()
+        self.loaded = False
+        try:
+            self.refresh()
+        except Exception as e:
+            # /play and /description don't need puzzles, so the server starts without them
+            logger.warning("Couldn't build the puzzle indexes, retrying in the background... " + str(e))
+        threading.Thread(target=self.refresh_periodically, name='puzzle-sampler', daemon=True).start()
+
+    def refresh(self):
+        """
+        Rebuild the id indexes and swap them in whole, so readers never see a partially built index. Listeners are
+        notified when the puzzle store has changed since the last refresh.
+        """
+
+        if self.store is not None:
+            version = self.store.get_or_compute('puzzle_indexes', self.save_indexes, self.refresh_interval)
+            if version == self.version:
+                return
+            single_move_ids = load_index(self.store.get_path(self.SINGLE_MOVE_INDEX))
+            mate_in_n_ids = load_index(self.store.get_path(self.MATE_IN_N_INDEX))
+            self.version = version
+        else:
+            single_move_ids, mate_in_n_ids = self.build_indexes()
+        changed = get_signature(single_move_ids) != get_signature(self.single_move_ids) \
+            or get_signature(mate_in_n_ids) != get_signature(self.mate_in_n_ids)
+        self.single_move_ids = single_move_ids
+        self.mate_in_n_ids = mate_in_n_ids
+        self.loaded = True
+        if changed:
+            for listener in self.listeners:
+                listener()
+
+    def build_indexes(self):
+        single_move_ids = {}
+        for puzzle_id, type_name in self.repository.query_single_move_ids():
+            single_move_ids.setdefault(type_name, array('q')).append(puzzle_id)
+        mate_in_n_ids = {}
+        for puzzle_id, moves_to_mate in self.repository.query_mate_in_n_ids():
+            mate_in_n_ids.setdefault(moves_to_mate, array('q')).append(puzzle_id)
+        return single_move_ids, mate_in_n_ids
+
+    def save_indexes(self):
+        """
+        Build the indexes into the shared store's directory and return a version for the other workers to compare.
+        """
+
+        single_move_ids, mate_in_n_ids = self.build_indexes()
+        save_index(self.store.get_path(self.SINGLE_MOVE_INDEX), single_move_ids)
+        save_index(self.store.get_path(self.MATE_IN_N_INDEX), mate_in_n_ids)
+        return time.time()
+
+    def refresh_periodically(self):
+        while not self.stopped.wait(self.refresh_interval if self.loaded else self.RETRY_INTERVAL):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning("Couldn't refresh the puzzle indexes... " + str(e))
+
+    def get_single_move_puzzles(self, type_name: str, k=1):
+        puzzle_ids = sample_ids(self.get_index(self.single_move_ids), type_name, k)
+        return shuffled(self.repository.query_single_moves_by_ids(puzzle_ids))
+
+    async def get_single_move_puzzles_async(self, type_name: str, k=1):
+        puzzle_ids = sample_ids(self.get_index(self.single_move_ids), type_name, k)
+        return shuffled(await self.async_repository.query_single_moves_by_ids(puzzle_ids))
+
+    def get_mate_in_n_puzzles(self, n: int, k=1):
+        puzzle_ids = sample_ids(self.get_index(self.mate_in_n_ids), n, k)
+        return shuffled(self.repository.query_mate_in_n_by_ids(puzzle_ids))
+
+    async def get_mate_in_n_puzzles_async(self, n: int, k=1):
+        puzzle_ids = sample_ids(self.get_index(self.mate_in_n_ids), n, k)
+        return shuffled(await self.async_repository.query_mate_in_n_by_ids(puzzle_ids))
+
+    def get_index(self, index: dict) -> dict:
+        if not self.loaded:
+            raise PuzzleIndexError("The puzzle indexes haven't been built yet")
+        return index
+
+    def stop(self):
+        self.stopped.set()
+
+
+def sample_ids(index: dict, key, k):
+    puzzle_ids = index.get(key, [])
+    return random.sample(puzzle_ids, max(0, min(k, PuzzleSampler.MAX_K, len(puzzle_ids))))
+
+
+def get_signature(index: dict):
+    return {key: (len(ids), ids[-1]) for key, ids in index.items()}
+
+
+def shuffled(puzzles: list):
+    random.shuffle(puzzles)
+    return puzzles
@@ -1,23 +1,68 @@
-import random
-
-from domain.repository import Repository
+from domain.repository import Repository, AsyncRepository, is_async_enabled
+from service.puzzle_sampler import PuzzleSampler
+from service.statistics_snapshot import StatisticsSnapshot
+from util import profiler
+from util.shared_store import SharedStore
 
 
 class PuzzleService:
 
-    def __init__(self):
+    def __init__(self, store: SharedStore = None):
         self.repository = Repository()
+        self.async_repository = AsyncRepository() if is_async_enabled() else None
+        self.sampler = PuzzleSampler(async_repository=self.async_repository, store=store)
+        self.statistics = StatisticsSnapshot(self.compute_type_statistics, store=store, key='type_statistics')
+        self.sampler.listeners.append(self.statistics.invalidate)
 
     def get_single_move_puzzle(self, type_name: str):
-        single_move_puzzles = self.repository.query_single_move_by_type(type_name)
-        return random.choice(single_move_puzzles)
+        return self.sampler.get_single_move_puzzles(type_name)[0]
+
+    def get_single_move_puzzles(self, type_name: str, k: int):
+        """
+        Return k distinct random single move puzzles of the type, fetched in one query.
+        """
+        return self.sampler.get_single_move_puzzles(type_name, k)
+
+    async def get_single_move_puzzles_async(self, type_name: str, k=1):
+        """
+        As get_single_move_puzzles, over the async driver when it's enabled and the threadpool otherwise.
+        """
+        if self.async_repository is None:
+            return await profiler.run_in_threadpool(self.sampler.get_single_move_puzzles, type_name, k)
+        return await self.sampler.get_single_move_puzzles_async(type_name, k)
 
     def get_type_statistics(self):
+        return self.statistics.get()[0]
+
+    def get_type_statistics_snapshot(self):
+        """
+        Return the last computed type statistics along with their ETag, both None until they've been computed.
+        """
+        return self.statistics.get()
+
+    def compute_type_statistics(self):
         type_statistics = self.repository.get_type_statistics()
         statistics = {'types': [row['type'] for row in type_statistics],
                       'counts': [row['count'] for row in type_statistics]}
         return statistics
 
     def get_mate_in_n_puzzle(self, n: int):
-        mate_puzzles = self.repository.query_mate_in_n_by_n(n)
-        return random.choice(mate_puzzles)
+        return self.sampler.get_mate_in_n_puzzles(n)[0]
+
+    def get_mate_in_n_puzzles(self, n: int, k: int):
+        """
+        Return k distinct random mate in n puzzles, fetched in one query.
+        """
+        return self.sampler.get_mate_in_n_puzzles(n, k)
+
+    async def get_mate_in_n_puzzles_async(self, n: int, k=1):
+        if self.async_repository is None:
+            return await profiler.run_in_threadpool(self.sampler.get_mate_in_n_puzzles, n, k)
+        return await self.sampler.get_mate_in_n_puzzles_async(n, k)
+
+    def stop(self):
+        """
+        Stop the background refreshes of the puzzle indexes and the statistics.
+        """
+        self.sampler.stop()
+        self.statistics.stop()
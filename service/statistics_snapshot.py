@@ -0,0 +1,63 @@
+import hashlib
+import json
+import logging
+import threading
+
+from util.shared_store import SharedStore
+
+logger = logging.getLogger('chapi')
+
+
+class StatisticsSnapshot:
+    """
+    Materialised result of a slow aggregate. It is recomputed on a background thread once it is older than the ttl
+    or as soon as it's invalidated, requests only ever read the last snapshot along with its ETag. With a shared store
+    one worker computes it for all of them, and the ETag is the same whichever worker answers. Until the first
+    computation succeeds there is no snapshot, and it's retried every RETRY_INTERVAL seconds.
+    """
+    DEFAULT_TTL = 60
+    RETRY_INTERVAL = 10
+
+    def __init__(self, compute, ttl=DEFAULT_TTL, store: SharedStore = None, key='statistics'):
+        self.compute = compute
+        self.ttl = ttl
+        self.store = store
+        self.key = key
+        self.statistics = None
+        self.etag = None
+        self.invalidated = threading.Event()
+        self.stopped = threading.Event()
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning("Couldn't compute the statistics snapshot, retrying in the background... " + str(e))
+        threading.Thread(target=self.refresh_periodically, name='statistics-snapshot', daemon=True).start()
+
+    def refresh(self, max_age=None):
+        if self.store is not None:
+            statistics = self.store.get_or_compute(self.key, self.compute, self.ttl if max_age is None else max_age)
+        else:
+            statistics = self.compute()
+        etag = '"{}"'.format(hashlib.md5(json.dumps(statistics, sort_keys=True).encode()).hexdigest())
+        self.statistics, self.etag = statistics, etag
+
+    def refresh_periodically(self):
+        while not self.stopped.is_set():
+            invalidated = self.invalidated.wait(self.ttl if self.statistics is not None else self.RETRY_INTERVAL)
+            self.invalidated.clear()
+            if self.stopped.is_set():
+                return
+            try:
+                self.refresh(0 if invalidated else None)
+            except Exception as e:
+                logger.warning("Couldn't refresh the statistics snapshot... " + str(e))
+
+    def get(self):
+        return self.statistics, self.etag
+
+    def invalidate(self):
+        self.invalidated.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.invalidated.set()
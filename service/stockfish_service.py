@@ -1,4 +1,9 @@
+import asyncio
 import math
+import random
+import threading
+import time
+from concurrent.futures import Future
 from enum import Enum
 
 import chess
@@ -6,79 +11,252 @@ import chess.engine
 
 from domain.client_json import PlayRequest, DescriptionRequest
 from domain.entities import StockfishResult
-from engine.stockfish import Engine
+from engine.engine_pool import EnginePool, AsyncEnginePool
+from engine.engine_profile import EngineProfiles, MAX_SKILL_LEVEL
+from engine.evaluation_cache import EvaluationCache, is_full_strength
+from engine.opening_evaluations import OpeningEvaluations
+from engine.stockfish import add_line
+from util import metrics
 from util.utils import get_other_user, WHITE, BLACK
 
 
+# the play searches report the score and principal variation along with the move
+PLAY_INFO = chess.engine.INFO_SCORE | chess.engine.INFO_PV
+# lines the play searches score at every depth, a reduced skill level picks its move among Stockfish's best four
+PLAY_LINES = 4
+
+
 class StockfishService:
     DEFAULT_DIFFICULTY = 10
     DEFAULT_TIME_LIMIT = 0.1
+    MIN_TIME_LIMIT = 0.01
+    # the strongest skill level the difficulties play at, weaker ones keep searching so they still make mistakes
+    OPENING_PLAY_SKILL_LEVEL = 18
     MATE_LOWER_BOUND = 1
     MATE_UPPER_BOUND = 5
     BLUNDER_THRESHOLD = -0.3
     GOOD_MOVE_LOWER_BOUND = 0.1
     GOOD_MOVE_UPPER_BOUND = 0.2
+    DEFAULT_WAIT_RANGE = (0.0, 1.0)
+
+    def __init__(self, engine_pool: EnginePool = None, async_engine_pool: AsyncEnginePool = None,
+                 evaluation_cache: EvaluationCache = None, wait_ranges: dict = None, profiles: EngineProfiles = None,
+                 shed_load=False, opening_evaluations: OpeningEvaluations = None):
+        self.engine_pool = engine_pool if engine_pool is not None else EnginePool(1)
+        self.async_engine_pool = async_engine_pool
+        self.evaluation_cache = evaluation_cache
+        self.wait_ranges = wait_ranges if wait_ranges is not None else {}
+        self.profiles = profiles if profiles is not None else EngineProfiles()
+        self.shed_load = shed_load
+        self.opening_evaluations = opening_evaluations if opening_evaluations is not None else OpeningEvaluations()
+
+    def get_wait_time(self, difficulty):
+        """
+        A random response time in seconds for a move at the difficulty, so Stockfish appears to think before playing
+        when the client asks it to wait.
+        """
+        low, high = self.wait_ranges.get(difficulty, self.DEFAULT_WAIT_RANGE)
+        return random.uniform(low, high)
 
-    def __init__(self):
-        self.engine = Engine(10)
-        self.board = chess.Board()
+    def get_time_limit(self, time_limit, deadline=None):
+        """
+        The time an analysis gets. When shedding load it's divided by the pool's load once searches queue for an
+        engine, and it never runs past the deadline, a time.monotonic() value. Never below MIN_TIME_LIMIT.
+        """
+        if self.shed_load:
+            time_limit /= max(1.0, self.engine_pool.get_load())
+        if deadline is not None:
+            time_limit = min(time_limit, deadline - time.monotonic())
+        return max(time_limit, self.MIN_TIME_LIMIT)
+
+    @metrics.timed('stockfish.analyse')
+    def analyse(self, fen, time_limit, options: dict = None, deadline=None) -> dict:
+        """
+        Run a single Stockfish search on the fen, returning the full info dict: score, pv, depth...
+        Opening book positions are served from the precomputed table at full strength and positions already searched
+        at least as long from the evaluation cache. The search is cut short to fit before the deadline, Stockfish then
+        reports the deepest iteration it reached.
+        """
+        options = options if options is not None else self.profiles.analysis.get_options()
+        # the table holds full strength analyses, weakened ones are searched like any other position
+        info = self.opening_evaluations.get(fen) if is_full_strength(options) else None
+        if info is not None:
+            return info
+        if self.evaluation_cache is not None:
+            info = self.evaluation_cache.get(fen, time_limit=self.get_time_limit(time_limit, deadline), options=options)
+            if info is not None:
+                return info
+
+        board = chess.Board(fen)
+        with self.engine_pool.engine() as engine:
+            engine.configure(options)
+            # measured once the engine is checked out, so time spent queueing for it comes out of the budget
+            time_limit = self.get_time_limit(time_limit, deadline)
+            info = engine.analyse(board, time=time_limit)
+        if self.evaluation_cache is not None:
+            self.evaluation_cache.put(fen, info, time_limit=time_limit, options=options)
+        return info
+
+    @metrics.timed('stockfish.analyse')
+    async def analyse_async(self, fen, time_limit, options: dict = None) -> dict:
+        options = options if options is not None else self.profiles.analysis.get_options()
+        info = self.opening_evaluations.get(fen) if is_full_strength(options) else None
+        if info is not None:
+            return info
+        if self.evaluation_cache is not None:
+            info = self.evaluation_cache.get(fen, time_limit=time_limit, options=options)
+            if info is not None:
+                return info
+
+        board = chess.Board(fen)
+        async with self.async_engine_pool.engine() as engine:
+            await engine.configure(options)
+            info = await engine.analyse(board, time=time_limit)
+        if self.evaluation_cache is not None:
+            self.evaluation_cache.put(fen, info, time_limit=time_limit, options=options)
+        return info
+
+    @metrics.timed('stockfish.analyse_board')
+    def analyse_board(self, fen, user, time_limit, context=None, options: dict = None):
+        info = context.analyse(fen) if context is not None else self.analyse(fen, time_limit, options)
+        pov_score = chess.engine.PovScore(info['score'], user == WHITE).pov(user == WHITE)
+        return pov_score
 
-    def analyse_board(self, fen, user, time_limit):
-        self.board.set_fen(fen)
-        info = self.engine.engine.analyse(self.board, chess.engine.Limit(time=time_limit))
+    @metrics.timed('stockfish.analyse_board')
+    async def analyse_board_async(self, fen, user, time_limit, options: dict = None):
+        info = await self.analyse_async(fen, time_limit, options)
         pov_score = chess.engine.PovScore(info['score'], user == WHITE).pov(user == WHITE)
         return pov_score
 
+    def get_play_options(self, difficulty):
+        """
+        The engine options of the difficulty's play profile. Scoring the position after a move with the same options
+        saves the engine switching profiles, and its hash size, twice per move.
+        """
+        return self.profiles.get_play_profile(difficulty).get_options(normalise(difficulty))
+
+    def get_opening_move(self, fen, difficulty):
+        """
+        The precomputed best move for an opening book position, only at the strongest skill level since the table
+        has no weaker alternatives. None when the engine has to search.
+        """
+        if normalise(difficulty) < self.OPENING_PLAY_SKILL_LEVEL:
+            return None
+        return self.opening_evaluations.get_best_move(fen)
+
+    @metrics.timed('stockfish.play')
     def get_best_move(self, fen, difficulty=DEFAULT_DIFFICULTY, time_limit=DEFAULT_TIME_LIMIT):
-        self.engine.reconfigure(normalise(difficulty))
-        self.board.set_fen(fen)
-        return self.engine.play(self.board, time=time_limit)
+        """
+        Stockfish's move at the difficulty, with the latest info of the searched line starting with that move as the
+        result's info, empty when the move was never among the PLAY_LINES best lines.
+        """
+        result = self.get_opening_move(fen, difficulty)
+        if result is not None:
+            return result
+        board = chess.Board(fen)
+        with self.engine_pool.engine() as engine:
+            engine.configure(self.get_play_options(difficulty))
+            best_move, lines = engine.play_lines(
+                board, time=self.profiles.get_play_profile(difficulty).get_time_limit(time_limit),
+                multipv=get_play_lines(difficulty), info=PLAY_INFO)
+        return get_line_result(best_move, lines)
+
+    @metrics.timed('stockfish.play')
+    async def get_best_move_async(self, fen, difficulty=DEFAULT_DIFFICULTY, time_limit=DEFAULT_TIME_LIMIT):
+        result = self.get_opening_move(fen, difficulty)
+        if result is not None:
+            return result
+        board = chess.Board(fen)
+        async with self.async_engine_pool.engine() as engine:
+            await engine.configure(self.get_play_options(difficulty))
+            best_move, lines = await engine.play_lines(
+                board, time=self.profiles.get_play_profile(difficulty).get_time_limit(time_limit),
+                multipv=get_play_lines(difficulty), info=PLAY_INFO)
+        return get_line_result(best_move, lines)
 
     def get_stockfish_play_result(self, request: PlayRequest):
         """
         Reconfigure Stockfish's difficulty, find and return its best move for the current fen,
-        assign winner if there is one.
+        assign winner if there is one. The score is taken from the same search whenever it covers the move played.
         """
         result = self.get_best_move(request.fen, request.difficulty, request.time_limit)
 
-        move = None
+        board = chess.Board(request.fen)
         if result.move is not None:
-            self.board.push(result.move)
-            move = result.move.uci()
+            board.push(result.move)
+        score = get_search_score(result.move, result.info)
+        if score is None:
+            score = self.get_relative_score(board.fen(), BLACK if board.turn else WHITE,
+                                            options=self.get_play_options(request.difficulty))
+        return get_play_result(request, board, result.move, score)
+
+    async def get_stockfish_play_result_async(self, request: PlayRequest):
+        """
+        As get_stockfish_play_result, awaiting the engine rather than blocking on it.
+        """
+        result = await self.get_best_move_async(request.fen, request.difficulty, request.time_limit)
 
-        return StockfishResult(
-            request.id,
-            self.board.fen(),
-            move,
-            self.is_over(self.board.fen()),
-            self.get_relative_score(self.board.fen(), BLACK if self.board.turn else WHITE)
-        )
+        board = chess.Board(request.fen)
+        if result.move is not None:
+            board.push(result.move)
+        score = get_search_score(result.move, result.info)
+        if score is None:
+            score = await self.get_relative_score_async(board.fen(), BLACK if board.turn else WHITE,
+                                                        self.get_play_options(request.difficulty))
+        return get_play_result(request, board, result.move, score)
+
+    async def stream_stockfish_play_result_async(self, request: PlayRequest, stop: asyncio.Event):
+        """
+        Search for Stockfish's move as get_stockfish_play_result_async does, yielding the engine's depth, score and
+        principal variation as the search deepens and the StockfishResult last. Setting stop ends the search early
+        with the best move found so far. The final score comes from this search whenever it covers the move played.
+        """
+
+        board = chess.Board(request.fen)
+        async with self.async_engine_pool.engine() as engine:
+            await engine.configure(self.get_play_options(request.difficulty))
+            time_limit = self.profiles.get_play_profile(request.difficulty).get_time_limit(request.time_limit)
+            with await engine.analysis(board, time=time_limit,
+                                       multipv=get_play_lines(request.difficulty)) as analysis:
+                stopper = asyncio.ensure_future(stop.wait())
+                stopper.add_done_callback(lambda done: analysis.stop() if not done.cancelled() else None)
+                lines = {}
+                try:
+                    async for info in analysis:
+                        add_line(lines, info)
+                        # only the principal variation is reported, the other lines are there to score the move
+                        if 'score' in info and 'pv' in info and info.get('multipv', 1) == 1:
+                            yield {'depth': info.get('depth'), 'score': get_score_after_move(info['score']),
+                                   'pv': [move.uci() for move in info['pv']]}
+                    best_move = await analysis.wait()
+                finally:
+                    stopper.cancel()
+
+        if best_move.move is not None:
+            board.push(best_move.move)
+        score = get_search_score(best_move.move, get_line_result(best_move, lines).info)
+        if score is None:
+            score = await self.get_relative_score_async(board.fen(), BLACK if board.turn else WHITE,
+                                                        self.get_play_options(request.difficulty))
+        yield get_play_result(request, board, best_move.move, score)
 
     def is_over(self, fen: str):
         """
         Determine the end state of the board.
         """
 
-        self.board.set_fen(fen)
-        if self.board.is_game_over():
-            if self.board.is_stalemate():
-                return Outcome.STALE
-            elif self.board.outcome().winner:
-                return Outcome.WHITE
-            elif not self.board.outcome().winner:
-                return Outcome.BLACK
-        return None
+        return get_outcome(chess.Board(fen))
 
-    def get_mate_result(self, request: DescriptionRequest) -> dict:
+    def get_mate_result(self, request: DescriptionRequest, context=None) -> dict:
         """
         Analyse the board to determine mate results: who has checkmated, who is trying to checkmate and how many moves
         until they do.
         """
 
         result = None
-        pov_score = self.analyse_board(request.fen, request.user, self.DEFAULT_TIME_LIMIT)
+        pov_score = self.analyse_board(request.fen, request.user, self.DEFAULT_TIME_LIMIT, context)
 
-        if self.board.is_checkmate():
+        if chess.Board(request.fen).is_checkmate():
             result = {}
             result['moves'] = 0
             if pov_score.turn:
@@ -96,7 +274,7 @@ class StockfishService:
                 result = {'user': Outcome.WHITE, 'moves': abs(relative_mate)}
         return result
 
-    def get_advantage_change(self, fen_stack, fen, user):
+    def get_advantage_change(self, fen_stack, fen, user, context=None):
         """
         Detect, using the fenStack, return the user's relative change in score.
         """
@@ -104,8 +282,8 @@ class StockfishService:
         if len(fen_stack) < 5:
             return None
 
-        current_score = self.analyse_board(fen, user, self.DEFAULT_TIME_LIMIT)
-        previous_score = self.analyse_board(fen_stack[len(fen_stack) - 2], user, self.DEFAULT_TIME_LIMIT)
+        current_score = self.analyse_board(fen, user, self.DEFAULT_TIME_LIMIT, context)
+        previous_score = self.analyse_board(fen_stack[len(fen_stack) - 2], user, self.DEFAULT_TIME_LIMIT, context)
         cp_current = get_cp_score(current_score)
         cp_previous = get_cp_score(previous_score)
 
@@ -114,13 +292,13 @@ class StockfishService:
 
         return cp_current - cp_previous
 
-    def is_following_blunder(self, request: DescriptionRequest):
+    def is_following_blunder(self, request: DescriptionRequest, context=None):
         """
         Return whether the move follows a blunder from the other player.
         """
         fen_stack = request.fenStack[:len(request.fenStack) - 1]
         fen = request.fenStack[len(request.fenStack) - 1]
-        advantage_change = self.get_advantage_change(fen_stack, fen, get_other_user(request.user))
+        advantage_change = self.get_advantage_change(fen_stack, fen, get_other_user(request.user), context)
         return advantage_change is not None and advantage_change < self.BLUNDER_THRESHOLD
 
     def get_capture_result(self, request: DescriptionRequest):
@@ -135,30 +313,67 @@ class StockfishService:
         previous_fen = request.fenStack[-2]
         move = chess.Move.from_uci(request.uci)
 
-        self.board.set_fen(previous_fen)
-        if self.board.is_capture(move):
+        board = chess.Board(previous_fen)
+        if board.is_capture(move):
             # dealing with unreliable results from is_capture
-            if self.board.piece_type_at(move.to_square) is None:
-                self.board.set_fen(request.fenStack[-1])
-            if self.board.piece_type_at(move.to_square) is not None:
-                result = chess.PIECE_NAMES[self.board.piece_type_at(move.to_square)]
+            if board.piece_type_at(move.to_square) is None:
+                board.set_fen(request.fenStack[-1])
+            if board.piece_type_at(move.to_square) is not None:
+                result = chess.PIECE_NAMES[board.piece_type_at(move.to_square)]
         return result
 
     def get_is_check(self, request: DescriptionRequest):
         """
         Return True or False depending on whether the player has put the other into check.
         """
-        self.board.set_fen(request.fen)
-        return self.board.is_check()
+        return chess.Board(request.fen).is_check()
 
-    def get_relative_score(self, fen, user):
+    def get_relative_score(self, fen, user, context=None, options: dict = None):
         """
         Return a quick cp value giving an indication of the winning probability from White's perspective.
         """
-        cp_score = get_cp_score(self.analyse_board(fen, WHITE, time_limit=0.1))
-        if cp_score is not None and user == BLACK:
-            cp_score *= -1
-        return cp_score
+        return get_relative_cp_score(self.analyse_board(fen, WHITE, time_limit=0.1, context=context, options=options),
+                                     user)
+
+    async def get_relative_score_async(self, fen, user, options: dict = None):
+        return get_relative_cp_score(await self.analyse_board_async(fen, WHITE, time_limit=0.1, options=options), user)
+
+
+class AnalysisContext:
+    """
+    Per request store of Stockfish analyses. Each distinct fen is searched once, capturing score, mate, principal
+    variation and ponder move together, and every description component reads from the same result. Components
+    running on several threads at once wait on the search already in progress for a fen instead of starting another.
+    Searches share the request's deadline, a time.monotonic() value, when it has one.
+    """
+
+    def __init__(self, stockfish_service: StockfishService, time_limit=StockfishService.DEFAULT_TIME_LIMIT,
+                 deadline=None):
+        self.stockfish_service = stockfish_service
+        self.time_limit = time_limit
+        self.deadline = deadline
+        self.analyses = {}
+        self.lock = threading.Lock()
+
+    def analyse(self, fen) -> dict:
+        with self.lock:
+            analysis = self.analyses.get(fen)
+            searching = analysis is None
+            if searching:
+                analysis = self.analyses[fen] = Future()
+        if searching:
+            try:
+                analysis.set_result(self.stockfish_service.analyse(fen, self.time_limit, deadline=self.deadline))
+            except Exception as e:
+                analysis.set_exception(e)
+        return analysis.result()
+
+    def get_best_move(self, fen) -> chess.engine.PlayResult:
+        """
+        The best move and expected reply from the principal variation of the fen's analysis.
+        """
+        pv = self.analyse(fen).get('pv', [])
+        return chess.engine.PlayResult(pv[0] if len(pv) > 0 else None, pv[1] if len(pv) > 1 else None)
 
 
 def get_cp_score(pov_score):
@@ -169,6 +384,64 @@ def get_cp_score(pov_score):
     return raw_score
 
 
+def get_relative_cp_score(pov_score, user):
+    cp_score = get_cp_score(pov_score)
+    if cp_score is not None and user == BLACK:
+        cp_score *= -1
+    return cp_score
+
+
+def get_outcome(board: chess.Board):
+    if board.is_game_over():
+        if board.is_stalemate():
+            return Outcome.STALE
+        elif board.outcome().winner:
+            return Outcome.WHITE
+        elif not board.outcome().winner:
+            return Outcome.BLACK
+    return None
+
+
+def get_play_result(request: PlayRequest, board: chess.Board, move: chess.Move, score) -> StockfishResult:
+    """
+    The result of Stockfish playing the move, board being the position after it.
+    """
+    return StockfishResult(request.id, board.fen(), move.uci() if move is not None else None, get_outcome(board), score)
+
+
+def get_line_result(best_move: chess.engine.BestMove, lines: dict) -> chess.engine.PlayResult:
+    """
+    The move played with the info of the line it starts as the info, empty when none of the lines starts with it.
+    """
+    return chess.engine.PlayResult(best_move.move, best_move.ponder, info=lines.get(best_move.move, {}))
+
+
+def get_search_score(move: chess.Move, info: dict):
+    """
+    The score after the move from the search which chose it. None when there is no move, or when a reduced skill
+    level played something outside the lines searched, whose score that search doesn't report.
+    """
+    pv = info.get('pv', [])
+    if move is None or 'score' not in info or len(pv) == 0 or pv[0] != move:
+        return None
+    return get_score_after_move(info['score'])
+
+
+def get_score_after_move(pov_score: chess.engine.PovScore):
+    """
+    The score get_relative_score gives the position after the searching side's move, from that side's own search.
+    """
+    user = WHITE if pov_score.turn else BLACK
+    return get_relative_cp_score(chess.engine.PovScore(-pov_score.relative, not pov_score.turn), user)
+
+
+def get_play_lines(difficulty: int):
+    """
+    Full strength plays its principal variation, the extra lines would only take search time from it.
+    """
+    return PLAY_LINES if normalise(difficulty) < MAX_SKILL_LEVEL else 1
+
+
 def normalise(difficulty: int):
     if difficulty not in range(1, 10):
         return 10
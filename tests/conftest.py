@@ -0,0 +1,166 @@
+import asyncio
+import os
+import sys
+
+import chess
+import httpx
+import pytest
+import sqlalchemy as db
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+# the modules import each other from the repository root, as they do when chapi.py is run from it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from domain import repository  # noqa: E402
+from domain.client_json import DescriptionRequest  # noqa: E402
+from domain.entities import Base, SingleMove, MateInN  # noqa: E402
+from engine.engine_pool import EnginePool  # noqa: E402
+from service.description_service import get_fen_stack  # noqa: E402
+from service.paraphrase_model import ParaphraseModel  # noqa: E402
+
+PUZZLE_TYPES = ['fork', 'pin']
+PUZZLES = 40
+
+RUY_LOPEZ = ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1b5', 'a7a6', 'b5c6', 'd7c6', 'e1g1']
+
+
+class CharacterEncoder:
+    """
+    One token per character, with token 0 standing for the end of text tag.
+    """
+
+    def encode(self, text: str) -> list:
+        return [ord(character) for character in text]
+
+    def decode(self, tokens) -> str:
+        return ''.join(ParaphraseModel.EOS_TAG if token == 0 else chr(token) for token in tokens)
+
+
+class UpperCaseModel(ParaphraseModel):
+    """
+    Paraphrases a sentence by upper casing it, recording the batches it's asked to sample.
+    """
+
+    def __init__(self, max_new_tokens=None):
+        super().__init__(CharacterEncoder(), 0, max_new_tokens)
+        self.batches = []
+
+    def sample(self, prompts: list, length: int) -> list:
+        self.batches.append((len(prompts), len(prompts[0]), length))
+        rows = []
+        for prompt in prompts:
+            original = self.encoder.decode(prompt)[len('ORIGINAL: '):-1]
+            rows.append(prompt + self.encoder.encode('PARAPHRASED: ' + original.upper())[:length - 1] + [0])
+        return rows
+
+
+@pytest.fixture
+def sqlite_config(tmp_path, monkeypatch):
+    """
+    Run from a temporary directory whose config.ini points the repositories at an empty SQLite database.
+    """
+
+    (tmp_path / 'config.ini').write_text('[DB_CREDENTIALS]\nurl=sqlite:///{}\n'.format(tmp_path / 'chess.db'))
+    monkeypatch.chdir(tmp_path)
+    repository.get_session_factory.cache_clear()
+    yield tmp_path
+    repository.get_session_factory.cache_clear()
+
+
+@pytest.fixture
+def puzzle_database(sqlite_config):
+    """
+    The SQLite database seeded with PUZZLES single move puzzles alternating between PUZZLE_TYPES, and as many mate in
+    n puzzles alternating between mate in 1 and 2.
+    """
+
+    engine = db.create_engine('sqlite:///{}'.format(sqlite_config / 'chess.db'))
+    Base.metadata.create_all(engine, tables=[SingleMove.__table__, MateInN.__table__])
+    with Session(bind=engine) as session:
+        for i in range(PUZZLES):
+            session.add(SingleMove(id=i + 1, gain=0.5, starting_fen=chess.STARTING_FEN, ending_fen=chess.STARTING_FEN,
+                                   type=PUZZLE_TYPES[i % len(PUZZLE_TYPES)], move='e2e4', to_move='white'))
+            session.add(MateInN(id=i + 1, starting_fen=chess.STARTING_FEN, to_move='white', moves_to_mate=i % 2 + 1))
+        session.commit()
+    engine.dispose()
+    return sqlite_config
+
+
+@pytest.fixture
+def engine_pool():
+    engine_pool = EnginePool(2)
+    yield engine_pool
+    engine_pool.close()
+
+
+@pytest.fixture
+def description_request():
+    """
+    White castling in the Ruy Lopez exchange variation.
+    """
+
+    fen_stack = get_fen_stack(RUY_LOPEZ)
+    return DescriptionRequest(user='white', moveStack=RUY_LOPEZ, uci=RUY_LOPEZ[-1], fen=fen_stack[-1],
+                              fenStack=fen_stack)
+
+
+@pytest.fixture
+def paraphrase_model():
+    return UpperCaseModel()
+
+
+@pytest.fixture
+def chapi_config(sqlite_config, monkeypatch):
+    """
+    chapi, configured to start small engine pools on the SQLite database, which tests needing puzzles also seed with
+    puzzle_database. Extra config.ini lines can be appended to the returned path before its services start.
+    """
+
+    import chapi
+
+    monkeypatch.setattr(chapi, 'pool_size', 2)
+    with open(sqlite_config / 'config.ini', 'a') as file:
+        file.write('[ENGINE]\nasync_pool_size=2\n')
+    yield sqlite_config / 'config.ini'
+    if chapi.puzzle_service is not None:
+        chapi.puzzle_service.stop()
+
+
+@pytest.fixture
+def run_chapi(chapi_config):
+    """
+    A function running a coroutine function with an httpx client for chapi, once chapi has started its services, and
+    shutting them down afterwards. Extra config.ini lines can be passed along.
+    """
+
+    import chapi
+
+    def run(test, config=''):
+        with open(chapi_config, 'a') as file:
+            file.write(config)
+
+        async def run_test():
+            await chapi.create_services()
+            try:
+                async with httpx.AsyncClient(transport=httpx.ASGITransport(app=chapi.app),
+                                             base_url='http://chapi') as client:
+                    return await test(client)
+            finally:
+                await chapi.close_engines()
+
+        return asyncio.run(run_test())
+
+    return run
+
+
+@pytest.fixture
+def chapi_client(chapi_config):
+    """
+    A TestClient for chapi, its services started and shut down with the client as they are with the server.
+    """
+
+    import chapi
+
+    with TestClient(chapi.app) as client:
+        yield client
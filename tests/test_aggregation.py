@@ -0,0 +1,106 @@
+import asyncio
+
+from domain.client_json import AggregationRequest
+from service.aggregation_batcher import AggregationBatcher
+from service.paraphrase_cache import ParaphraseCache
+
+
+def run_with_batcher(paraphrase_model, test, **kwargs):
+    async def run():
+        batcher = AggregationBatcher(paraphrase_model, **kwargs)
+        batcher.start()
+        try:
+            return await test(batcher)
+        finally:
+            await batcher.stop()
+
+    return asyncio.run(run())
+
+
+def test_concurrent_requests_are_paraphrased_in_one_batch(paraphrase_model):
+    async def test(batcher):
+        requests = [AggregationRequest(index=i, original='check') for i in range(4)]
+        return await asyncio.gather(*[batcher.submit(request) for request in requests])
+
+    results = run_with_batcher(paraphrase_model, test, max_wait=0.05)
+    assert results == [{'index': i, 'aggregation': 'CHECK'} for i in range(4)]
+    assert paraphrase_model.batches == [(4, len('ORIGINAL: check\n'), paraphrase_model.get_token_budget(
+        paraphrase_model.encoder.encode('ORIGINAL: check\n')))]
+
+
+def test_batches_are_limited_to_max_batch_size(paraphrase_model):
+    async def test(batcher):
+        requests = [AggregationRequest(index=i, original='check') for i in range(5)]
+        return await asyncio.gather(*[batcher.submit(request) for request in requests])
+
+    run_with_batcher(paraphrase_model, test, max_batch_size=2, max_wait=0.05)
+    assert [size for size, _, _ in paraphrase_model.batches] == [2, 2, 1]
+
+
+def test_failed_batch_fails_each_of_its_requests(paraphrase_model, monkeypatch):
+    def fail(prompts, length):
+        raise RuntimeError('out of memory')
+
+    monkeypatch.setattr(paraphrase_model, 'sample', fail)
+
+    async def test(batcher):
+        return await asyncio.gather(batcher.submit(AggregationRequest(index=0, original='check')),
+                                    return_exceptions=True)
+
+    [result] = run_with_batcher(paraphrase_model, test)
+    assert isinstance(result, RuntimeError)
+
+
+class CountingGenerator:
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, request: AggregationRequest) -> dict:
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return {'index': request.index, 'aggregation': '{} #{}'.format(request.original, self.calls)}
+
+
+def test_cache_pools_paraphrases_before_answering_from_them():
+    generate = CountingGenerator()
+    cache = ParaphraseCache(generate, pool_size=2)
+
+    async def test():
+        return [await cache.aggregate(AggregationRequest(index=i, original='check')) for i in range(5)]
+
+    results = asyncio.run(test())
+    assert generate.calls == 2
+    assert {result['aggregation'] for result in results} == {'check #1', 'check #2'}
+    assert cache.statistics()['hits'] == 3
+
+
+def test_concurrent_requests_for_a_sentence_share_one_generation():
+    generate = CountingGenerator()
+    cache = ParaphraseCache(generate)
+
+    async def test():
+        return await asyncio.gather(*[cache.aggregate(AggregationRequest(index=i, original='check'))
+                                      for i in range(3)])
+
+    results = asyncio.run(test())
+    assert generate.calls == 1
+    assert [result['index'] for result in results] == [0, 1, 2]
+    assert {result['aggregation'] for result in results} == {'check #1'}
+    assert cache.statistics()['in_flight'] == 0
+
+
+def test_least_recently_used_sentences_are_evicted():
+    cache = ParaphraseCache(CountingGenerator(), size=2)
+    for original in ['check', 'castle', 'check', 'mate']:
+        cache.add(original, original.upper())
+    assert list(cache.paraphrases) == ['check', 'mate']
+
+
+def test_pools_persist_across_restarts(tmp_path):
+    path = str(tmp_path / 'paraphrases.json')
+    cache = ParaphraseCache(CountingGenerator(), path=path)
+    cache.add('check', 'CHECK')
+    cache.save()
+
+    assert ParaphraseCache(CountingGenerator(), path=path).paraphrases == {'check': ['CHECK']}
+    assert [entry.name for entry in tmp_path.iterdir()] == ['paraphrases.json']
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from domain.opening_book import OpeningBook
+from service.description_service import DescriptionService
+from service.stockfish_service import StockfishService, AnalysisContext
+
+
+@pytest.fixture
+def counted_service(engine_pool, monkeypatch):
+    """
+    A StockfishService counting the searches it runs by fen.
+    """
+
+    stockfish_service = StockfishService(engine_pool)
+    searches = Counter()
+    analyse = stockfish_service.analyse
+
+    def counted_analyse(fen, *args, **kwargs):
+        searches[fen] += 1
+        return analyse(fen, *args, **kwargs)
+
+    monkeypatch.setattr(stockfish_service, 'analyse', counted_analyse)
+    return stockfish_service, searches
+
+
+def test_description_searches_each_fen_once(sqlite_config, counted_service, description_request):
+    stockfish_service, searches = counted_service
+    description_service = DescriptionService(stockfish_service, OpeningBook.from_tsv())
+
+    response = description_service.get_description(description_request)
+
+    assert len(response['descriptions']) == 1
+    assert response['score'] is not None
+    assert len(searches) >= 2
+    assert set(searches.values()) == {1}
+
+
+def test_context_serves_repeated_analyses_from_the_first_search(counted_service, description_request):
+    stockfish_service, searches = counted_service
+    context = AnalysisContext(stockfish_service)
+
+    first = context.analyse(description_request.fen)
+    assert context.analyse(description_request.fen) is first
+    best_move = context.get_best_move(description_request.fen)
+
+    assert best_move.move == first['pv'][0]
+    assert searches[description_request.fen] == 1
+
+
+def test_threads_wait_on_the_search_in_progress(counted_service, description_request):
+    stockfish_service, searches = counted_service
+    context = AnalysisContext(stockfish_service)
+
+    with ThreadPoolExecutor(4) as executor:
+        analyses = list(executor.map(context.analyse, [description_request.fen] * 4))
+
+    assert all(analysis is analyses[0] for analysis in analyses)
+    assert searches[description_request.fen] == 1
+
+
+def test_parallel_description_matches_the_sequential_one(sqlite_config, engine_pool, description_request):
+    description_service = DescriptionService(StockfishService(engine_pool), OpeningBook.from_tsv())
+
+    sequential = description_service.get_description(description_request)
+    parallel = asyncio.run(description_service.get_description_async(description_request))
+
+    assert set(parallel) == set(sequential)
+    assert parallel['opening'] == sequential['opening']
+    assert len(parallel['descriptions']) == 1
+
+
+def test_deadline_leaves_out_late_components_but_not_the_score(sqlite_config, engine_pool, description_request,
+                                                               monkeypatch):
+    description_service = DescriptionService(StockfishService(engine_pool), OpeningBook.from_tsv())
+    released = threading.Event()
+
+    def get_late_suggestions(request):
+        released.wait(5)
+        return ['Too late.']
+
+    monkeypatch.setattr(description_service, 'get_move_suggestions', get_late_suggestions)
+    response = asyncio.run(description_service.get_description_async(description_request, deadline=0.3))
+    released.set()
+
+    assert 'Too late.' not in response['descriptions'][0]
+    assert response['score'] is not None
+    assert response['opening'] is not None
@@ -0,0 +1,57 @@
+import asyncio
+
+import chess
+
+from engine.engine_pool import AsyncEnginePool
+
+
+def run_with_pool(test, size=2):
+    async def run():
+        engine_pool = await AsyncEnginePool.open(size)
+        try:
+            return await test(engine_pool)
+        finally:
+            await engine_pool.close()
+
+    return asyncio.run(run())
+
+
+def test_searches_run_concurrently_on_separate_engines():
+    async def test(engine_pool):
+        async def search():
+            async with engine_pool.engine() as engine:
+                busy = engine_pool.get_busy()
+                result = await engine.play(chess.Board(), time=0.05)
+                return engine, busy, result.move
+
+        (first, _, first_move), (second, _, second_move) = await asyncio.gather(search(), search())
+        assert first is not second
+        assert first_move is not None and second_move is not None
+        assert engine_pool.get_busy() == 0
+
+    run_with_pool(test)
+
+
+def test_checkout_waits_without_blocking_the_loop():
+    async def test(engine_pool):
+        engine = await engine_pool.checkout()
+        waiter = asyncio.ensure_future(engine_pool.checkout())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        engine_pool.checkin(engine)
+        assert await waiter is engine
+        engine_pool.checkin(engine)
+
+    run_with_pool(test, size=1)
+
+
+def test_dead_engine_is_restarted_on_checkout():
+    async def test(engine_pool):
+        async with engine_pool.engine() as engine:
+            engine.transport.close()
+        async with engine_pool.engine() as restarted:
+            assert restarted is not engine
+            info = await restarted.analyse(chess.Board(), time=0.01)
+            assert info['score'] is not None
+
+    run_with_pool(test, size=1)
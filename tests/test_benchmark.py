@@ -0,0 +1,21 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_benchmark_reports_every_endpoint_and_stage(tmp_path):
+    output = tmp_path / 'benchmark.json'
+    subprocess.run([sys.executable, os.path.join(ROOT, 'data', 'benchmark_chapi.py'), '--games', '2', '--plies', '2',
+                    '--clients', '2', '--engines', '1', '--time-limit', '0.02', '--puzzles', '20', '--puzzle-rate',
+                    '1', '--aggregation', '--token-latency', '0', '--output', str(output)],
+                   cwd=ROOT, env=dict(os.environ, PYTHONPATH=ROOT), check=True, capture_output=True, timeout=120)
+
+    results = json.loads(output.read_text())
+    assert results['requests'] > 0 and results['rps'] > 0
+    assert {'/description', '/play'} <= set(results['endpoints'])
+    assert all(summary['count'] > 0 and summary['p50_ms'] <= summary['p99_ms']
+               for summary in results['endpoints'].values())
+    assert {'stockfish.play', 'paraphrase.generate_batch'} <= set(results['stages'])
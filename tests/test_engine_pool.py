@@ -0,0 +1,107 @@
+import asyncio
+import queue
+import threading
+
+import chess
+import pytest
+
+import chapi
+from engine import engine_pool as pool_module
+
+
+def test_engines_are_checked_out_exclusively(engine_pool):
+    with engine_pool.engine() as first:
+        assert engine_pool.get_busy() == 1
+        with engine_pool.engine() as second:
+            assert second is not first
+            assert engine_pool.get_busy() == 2
+            with pytest.raises(queue.Empty):
+                engine_pool.checkout(timeout=0.01)
+    assert engine_pool.get_busy() == 0
+
+
+def test_checkout_waits_for_a_checked_in_engine(engine_pool):
+    engines = [engine_pool.checkout(), engine_pool.checkout()]
+    checked_out = []
+    waiter = threading.Thread(target=lambda: checked_out.append(engine_pool.checkout(timeout=5)))
+    waiter.start()
+    engine_pool.checkin(engines[0])
+    waiter.join()
+    assert checked_out == [engines[0]]
+    engine_pool.checkin(checked_out[0])
+    engine_pool.checkin(engines[1])
+
+
+def test_dead_engine_is_restarted_on_checkout(engine_pool):
+    with engine_pool.engine() as engine:
+        engine.engine.close()
+    with engine_pool.engine() as engine:
+        assert engine.is_alive()
+        assert engine.analyse(chess.Board(), time=0.01)['score'] is not None
+
+
+def test_health_check_replaces_dead_idle_engines(engine_pool):
+    with engine_pool.engine() as engine:
+        engine.engine.close()
+    dead = engine
+    engine_pool.health_check()
+    engines = [engine_pool.checkout(), engine_pool.checkout()]
+    assert dead not in engines
+    assert all(engine.is_alive() for engine in engines)
+    for engine in engines:
+        engine_pool.checkin(engine)
+
+
+def test_chapi_checks_engines_periodically(engine_pool, monkeypatch):
+    monkeypatch.setattr(chapi, 'engine_pool', engine_pool)
+    monkeypatch.setattr(chapi, 'health_check_interval', 0.01)
+    with engine_pool.engine() as engine:
+        engine.engine.close()
+
+    async def run_briefly():
+        task = asyncio.ensure_future(chapi.check_engines_periodically())
+        await asyncio.sleep(0.5)
+        task.cancel()
+
+    asyncio.run(run_briefly())
+    assert engine not in list(engine_pool.idle.queue)
+
+
+def fail_to_start(*args):
+    raise OSError("can't start Stockfish")
+
+
+def test_failed_restarts_keep_the_pool_size(engine_pool, monkeypatch):
+    with engine_pool.engine() as first, engine_pool.engine() as second:
+        first.engine.close()
+        second.engine.close()
+    monkeypatch.setattr(pool_module, 'Engine', fail_to_start)
+
+    engine_pool.health_check()
+    assert engine_pool.idle.qsize() == 2
+    with pytest.raises(OSError):
+        engine_pool.checkout()
+    assert engine_pool.idle.qsize() == 2
+
+    monkeypatch.undo()
+    engines = [engine_pool.checkout(timeout=5), engine_pool.checkout(timeout=5)]
+    assert all(engine.is_alive() for engine in engines)
+    for engine in engines:
+        engine_pool.checkin(engine)
+
+
+def test_failed_async_restart_keeps_the_pool_size(monkeypatch):
+    async def run():
+        engine_pool = await pool_module.AsyncEnginePool.open(1)
+        try:
+            async with engine_pool.engine() as engine:
+                engine.transport.close()
+            monkeypatch.setattr(pool_module.AsyncEngine, 'open', fail_to_start)
+            with pytest.raises(OSError):
+                await engine_pool.checkout()
+            return engine_pool.idle.qsize()
+        finally:
+            monkeypatch.undo()
+            await engine_pool.close()
+
+    assert asyncio.run(run()) == 1
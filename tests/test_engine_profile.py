@@ -0,0 +1,83 @@
+import pytest
+
+from engine.engine_profile import EngineProfile, EngineProfiles
+from engine.stockfish import Engine, get_changed_options
+
+CONFIG = '''
+[PROFILE low]
+difficulties=1-3
+threads=1
+hash=8
+time_limit=0.05
+
+[PROFILE high]
+difficulties=9
+threads=4
+hash=256
+use_nnue=true
+
+[PROFILE analysis]
+threads=2
+hash=64
+'''
+
+
+def test_profiles_are_read_from_the_config_sections(tmp_path):
+    (tmp_path / 'config.ini').write_text(CONFIG)
+    profiles = EngineProfiles.from_config(str(tmp_path / 'config.ini'))
+
+    assert [profiles.get_play_profile(difficulty).name for difficulty in range(1, 11)] == \
+        ['low'] * 3 + ['default'] * 5 + ['high', 'default']
+    assert profiles.get_play_profile(2).get_options(4) == {'Skill Level': 4, 'Threads': 1, 'Hash': 8}
+    assert profiles.get_play_profile(9).get_options(18) == {'Skill Level': 18, 'Threads': 4, 'Hash': 256,
+                                                            'Use NNUE': True}
+    assert profiles.analysis.get_options() == {'Skill Level': 20, 'Threads': 2, 'Hash': 64}
+
+
+def test_missing_config_uses_the_defaults(tmp_path):
+    profiles = EngineProfiles.from_config(str(tmp_path / 'missing.ini'))
+    assert profiles.analysis is profiles.default
+    assert profiles.get_play_profile(5).get_options(10) == {'Skill Level': 10, 'Threads': EngineProfile.DEFAULT_THREADS,
+                                                            'Hash': EngineProfile.DEFAULT_HASH}
+
+
+def test_profile_time_limit_caps_the_move_time():
+    assert EngineProfile('low', time_limit=0.05).get_time_limit(1.0) == 0.05
+    assert EngineProfile('low', time_limit=0.05).get_time_limit(0.01) == 0.01
+    assert EngineProfile('default').get_time_limit(1.0) == 1.0
+
+
+def test_only_changed_and_supported_options_are_sent():
+    supported = {'Skill Level', 'Threads', 'Hash'}
+    current = {'Skill Level': 20, 'Threads': 1}
+    assert get_changed_options(supported, current, {'Skill Level': 20, 'Threads': 2, 'Use NNUE': True}) == \
+        {'Threads': 2}
+
+
+def test_engine_reconfigures_only_when_the_profile_changes(monkeypatch):
+    engine = Engine(20)
+    sent = []
+    configure = engine.engine.configure
+    monkeypatch.setattr(engine.engine, 'configure', lambda options: sent.append(options) or configure(options))
+    try:
+        engine.configure({'Skill Level': 20, 'Hash': 16})
+        engine.configure({'Skill Level': 20, 'Hash': 16})
+        engine.configure({'Skill Level': 4, 'Hash': 16})
+    finally:
+        engine.close()
+    assert sent == [{'Hash': 16}, {'Skill Level': 4}]
+
+
+@pytest.mark.parametrize('cpus, configured, sizes', [(8, (None, None), (4, 4)),
+                                                     (1, (None, None), (1, 1)),
+                                                     (8, (2, None), (2, 6)),
+                                                     (8, (None, 3), (4, 3)),
+                                                     (8, (5, 5), (5, 5))])
+def test_pools_split_the_cores_by_default(cpus, configured, sizes):
+    assert EngineProfiles().get_pool_sizes(cpus, *configured) == sizes
+
+
+def test_pool_sizes_count_the_profiles_threads():
+    profiles = EngineProfiles([EngineProfile('analysis', threads=2), EngineProfile('high', [9], threads=3)])
+    # four analysis engines on eight of the sixteen cores, and the rest shared by engines of up to three threads
+    assert profiles.get_pool_sizes(16) == (4, 2)
@@ -0,0 +1,102 @@
+import sqlite3
+
+import chess
+import chess.engine
+
+from engine.evaluation_cache import EvaluationCache
+
+START = chess.STARTING_FEN
+AFTER_E4 = 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1'
+WEAK = {'Skill Level': 10, 'Threads': 1}
+
+
+def get_info(cp, depth, move='e2e4'):
+    return {'score': chess.engine.PovScore(chess.engine.Cp(cp), chess.WHITE), 'pv': [chess.Move.from_uci(move)],
+            'depth': depth}
+
+
+def test_entries_satisfy_shorter_or_shallower_searches():
+    cache = EvaluationCache()
+    cache.put(START, get_info(30, 12), time_limit=0.1)
+
+    assert cache.get(START, time_limit=0.05)['score'].white() == chess.engine.Cp(30)
+    assert cache.get(START, depth=12)['pv'] == [chess.Move.from_uci('e2e4')]
+    assert cache.get(START, time_limit=0.2) is None
+    assert cache.get(START, depth=13) is None
+    assert cache.statistics()['hits'] == 2
+    assert cache.statistics()['misses'] == 2
+
+
+def test_move_clocks_do_not_split_positions():
+    cache = EvaluationCache()
+    cache.put(AFTER_E4, get_info(-30, 12), time_limit=0.1)
+    assert cache.get(AFTER_E4.replace(' 0 1', ' 4 9'), time_limit=0.1) is not None
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = EvaluationCache(size=1)
+    cache.put(START, get_info(30, 12), time_limit=0.1)
+    cache.put(AFTER_E4, get_info(-30, 12), time_limit=0.1)
+    assert cache.get(START, time_limit=0.1) is None
+    assert cache.statistics()['size'] == 1
+
+
+def test_deeper_entry_is_kept_with_the_longer_time_limit():
+    cache = EvaluationCache()
+    cache.put(START, get_info(30, 20), time_limit=0.1)
+    cache.put(START, get_info(50, 12, 'd2d4'), time_limit=0.5)
+
+    info = cache.get(START, time_limit=0.5)
+    assert info['depth'] == 20
+    assert info['score'].white() == chess.engine.Cp(30)
+
+
+def test_weakened_analyses_are_kept_apart():
+    cache = EvaluationCache()
+    cache.put(START, get_info(-200, 8, 'a2a3'), time_limit=0.1, options=WEAK)
+
+    assert cache.get(START, time_limit=0.1) is None
+    assert cache.get(START, time_limit=0.1, options={'Skill Level': 20, 'Threads': 4}) is None
+    assert cache.get(START, time_limit=0.1, options={'Skill Level': 10, 'Threads': 4}) is not None
+
+
+def test_workers_sharing_a_file_merge_their_entries(tmp_path):
+    path = str(tmp_path / 'evaluations.db')
+    first, second = EvaluationCache(path=path), EvaluationCache(path=path)
+    first.put(START, get_info(30, 20), time_limit=0.1)
+    second.put(START, get_info(50, 12, 'd2d4'), time_limit=0.5)
+    first.close()
+    second.close()
+
+    restarted = EvaluationCache(path=path)
+    info = restarted.get(START, time_limit=0.5)
+    restarted.close()
+    assert info['depth'] == 20
+    assert info['pv'] == [chess.Move.from_uci('e2e4')]
+
+
+def test_file_is_synced_normally(tmp_path):
+    cache = EvaluationCache(path=str(tmp_path / 'evaluations.db'))
+    assert cache.connection.execute('pragma synchronous').fetchone()[0] == 1
+    cache.close()
+
+
+def test_locked_file_only_costs_a_miss(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(EvaluationCache, 'TIMEOUT', 0.01)
+    path = str(tmp_path / 'evaluations.db')
+    cache = EvaluationCache(path=path)
+    other_worker = sqlite3.connect(path)
+    other_worker.execute('begin exclusive')
+
+    cache.put(START, get_info(30, 12), time_limit=0.1)
+    assert "Couldn't write" in caplog.text
+    assert cache.get(START, time_limit=0.1) is not None
+
+    other_worker.rollback()
+    other_worker.execute('drop table evaluation')
+    other_worker.commit()
+    assert cache.get(AFTER_E4, time_limit=0.1) is None
+    assert "Couldn't read" in caplog.text
+
+    other_worker.close()
+    cache.close()
@@ -0,0 +1,57 @@
+import json
+
+import chess
+import pytest
+
+from domain.client_json import GameDescriptionRequest
+from service.description_service import get_fen_stack, get_game_fen_stack
+
+OPENING = ['e2e4', 'e7e5', 'g1f3']
+
+
+def test_fen_stack_is_built_from_the_moves():
+    assert get_game_fen_stack(GameDescriptionRequest(moveStack=OPENING)) == get_fen_stack(OPENING)
+
+
+def test_given_fen_stack_may_differ_in_move_clocks():
+    fen_stack = [fen.replace(' 0 1', ' 0 5') for fen in get_fen_stack(OPENING)]
+    assert get_game_fen_stack(GameDescriptionRequest(moveStack=OPENING, fenStack=fen_stack)) == fen_stack
+
+
+@pytest.mark.parametrize('request_json', [{'moveStack': ['e2e4', 'e2e4']},
+                                          {'moveStack': ['e2e5']},
+                                          {'moveStack': ['e2e4', 'nonsense']},
+                                          {'moveStack': OPENING, 'fenStack': get_fen_stack(OPENING)[:-1]},
+                                          {'moveStack': OPENING, 'fenStack': get_fen_stack(OPENING) * 2},
+                                          {'moveStack': OPENING,
+                                           'fenStack': [chess.STARTING_FEN, chess.STARTING_FEN, 'not a fen',
+                                                        get_fen_stack(OPENING)[3]]},
+                                          {'moveStack': OPENING, 'fenStack': get_fen_stack(OPENING)[::-1]}])
+def test_invalid_games_are_rejected_before_streaming(request_json):
+    with pytest.raises(ValueError):
+        get_game_fen_stack(GameDescriptionRequest(**request_json))
+
+
+def test_game_descriptions_stream_one_line_per_ply(run_chapi):
+    async def test(client):
+        valid = await client.post('/description/game', json={'moveStack': OPENING})
+        illegal = await client.post('/description/game', json={'moveStack': ['e2e4', 'e2e4']})
+        short = await client.post('/description/game', json={'moveStack': OPENING,
+                                                              'fenStack': get_fen_stack(OPENING)[:-1]})
+        wrong = await client.post('/description/game', json={'moveStack': OPENING,
+                                                              'fenStack': [chess.STARTING_FEN] * 4})
+        return valid, illegal, short, wrong
+
+    valid, illegal, short, wrong = run_chapi(test)
+
+    assert valid.status_code == 200
+    assert valid.headers['content-type'] == 'application/x-ndjson'
+    lines = [json.loads(line) for line in valid.text.splitlines()]
+    assert [line['ply'] for line in lines] == [0, 1, 2]
+    assert all(len(line['descriptions']) == 1 for line in lines)
+
+    assert illegal.status_code == 422
+    assert short.status_code == 422
+    assert 'fenStack' in short.json()['detail']
+    assert wrong.status_code == 422
+    assert wrong.json()['detail'] == 'fenStack[1] is not the position after moveStack[:1]'
@@ -0,0 +1,44 @@
+import numpy as np
+
+from service.gpt2_onnx_service import GPT2OnnxService, sample_logits
+
+VOCABULARY = 16
+
+
+class ScriptedOnnxService(GPT2OnnxService):
+    """
+    The ONNX decoding loop over a stand in for the exported graph, whose logits make each row emit its script.
+    """
+
+    def __init__(self, scripts: list):
+        self.stop_tokens = np.array([0, 10])
+        self.hparams = {'n_layer': 1, 'n_head': 1, 'n_embd': 2}
+        self.scripts = scripts
+        self.steps = 0
+
+    def step(self, tokens, past):
+        logits = np.zeros((len(self.scripts), VOCABULARY), dtype=np.float32)
+        for row, script in enumerate(self.scripts):
+            logits[row, script[min(self.steps, len(script) - 1)]] = 1e4
+        self.steps += 1
+        return logits, past
+
+
+def test_sampling_follows_the_distribution():
+    np.random.seed(0)
+    logits = np.log(np.array([[0.7, 0.2, 0.1]] * 20000))
+    counts = np.bincount(sample_logits(logits, 1.0), minlength=3) / 20000
+    assert np.allclose(counts, [0.7, 0.2, 0.1], atol=0.02)
+    assert (sample_logits(np.array([[0.0, 5.0, 0.0]] * 10), 0.01) == 1).all()
+
+
+def test_decoding_stops_once_every_row_has_stopped():
+    service = ScriptedOnnxService([[5, 6, 0], [7, 10]])
+    output = service.sample([[1, 2], [3, 4]], length=20)
+    assert output.tolist() == [[1, 2, 5, 6, 0], [3, 4, 7, 10, 0]]
+    assert service.steps == 3
+
+
+def test_decoding_stops_at_the_length():
+    service = ScriptedOnnxService([[5]])
+    assert service.sample([[1]], length=4).tolist() == [[1, 5, 5, 5, 5]]
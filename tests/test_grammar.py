@@ -0,0 +1,45 @@
+import random
+from collections import Counter
+
+import pytest
+
+from service import grammar_service
+from util.grammar import GrammarTemplate, compile_grammar
+
+SKELETON = """
+S -> GREETING NAME | NAME
+GREETING -> 'hello' | 'hi' | 'hey'
+NAME -> '{name}'
+"""
+
+
+def test_grammar_is_parsed_once():
+    assert compile_grammar(SKELETON) is compile_grammar(SKELETON)
+
+
+def test_derivations_are_counted_and_enumerated():
+    grammar = compile_grammar(SKELETON)
+    assert grammar.count(grammar.grammar.start()) == 4
+    assert sorted(' '.join(words) for words in grammar.enumerate()) == ['hello {name}', 'hey {name}', 'hi {name}',
+                                                                        '{name}']
+
+
+def test_samples_are_uniform_over_derivations():
+    random.seed(0)
+    template = GrammarTemplate(compile_grammar(SKELETON), {'name': 'Magnus'})
+    samples = Counter(template.sample() for _ in range(4000))
+    assert set(samples) == set(template.enumerate()) == {'hello Magnus', 'hi Magnus', 'hey Magnus', 'Magnus'}
+    assert all(800 < count < 1200 for count in samples.values())
+
+
+def test_grammar_without_derivations_cannot_be_sampled():
+    grammar = compile_grammar("S -> A\nB -> 'x'")
+    with pytest.raises(ValueError):
+        grammar.sample()
+
+
+def test_service_grammars_fill_their_slots():
+    sentences = set(grammar_service.get_user_checkmating(3).enumerate())
+    assert len(sentences) > 1
+    assert all('{' not in sentence for sentence in sentences)
+    assert grammar_service.get_user_checkmating(3).sample() in sentences
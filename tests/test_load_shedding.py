@@ -0,0 +1,74 @@
+import threading
+import time
+
+import chess
+import pytest
+
+from domain.opening_book import OpeningBook
+from engine.engine_pool import EnginePool
+from service.description_service import DescriptionService, get_deadline
+from service.stockfish_service import StockfishService, AnalysisContext
+
+
+@pytest.fixture
+def single_engine_pool():
+    engine_pool = EnginePool(1)
+    yield engine_pool
+    engine_pool.close()
+
+
+def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError("condition never held")
+
+
+def test_load_counts_searches_queueing_for_an_engine(single_engine_pool):
+    assert single_engine_pool.get_load() == 0
+    engine = single_engine_pool.checkout()
+    assert single_engine_pool.get_load() == 1
+
+    waiter = threading.Thread(target=lambda: single_engine_pool.checkin(single_engine_pool.checkout()))
+    waiter.start()
+    wait_for(lambda: single_engine_pool.waiting == 1)
+    assert single_engine_pool.get_load() == 2
+
+    single_engine_pool.checkin(engine)
+    waiter.join()
+    assert single_engine_pool.get_load() == 0
+
+
+def test_time_limit_is_shed_under_load_and_bounded_by_the_deadline(single_engine_pool, monkeypatch):
+    stockfish_service = StockfishService(single_engine_pool, shed_load=True)
+    assert stockfish_service.get_time_limit(0.4) == 0.4
+
+    monkeypatch.setattr(single_engine_pool, 'get_load', lambda: 4)
+    assert stockfish_service.get_time_limit(0.4) == pytest.approx(0.1)
+    assert stockfish_service.get_time_limit(0.02) == StockfishService.MIN_TIME_LIMIT
+    assert StockfishService(single_engine_pool).get_time_limit(0.4) == 0.4
+
+    assert stockfish_service.get_time_limit(0.4, deadline=time.monotonic() + 0.05) <= 0.05
+    assert stockfish_service.get_time_limit(0.4, deadline=time.monotonic() - 1) == StockfishService.MIN_TIME_LIMIT
+
+
+def test_search_ends_by_the_deadline(single_engine_pool):
+    stockfish_service = StockfishService(single_engine_pool)
+    start = time.monotonic()
+    info = stockfish_service.analyse(chess.STARTING_FEN, 5, deadline=start + 0.2)
+
+    assert time.monotonic() - start < 1
+    assert info['score'] is not None
+
+
+def test_description_deadline_bounds_every_search(sqlite_config, engine_pool, description_request):
+    stockfish_service = StockfishService(engine_pool)
+    description_service = DescriptionService(stockfish_service, OpeningBook.from_tsv())
+    start = time.monotonic()
+    # searches given five seconds each still end with the request's deadline
+    context = AnalysisContext(stockfish_service, time_limit=5, deadline=get_deadline(0.3))
+    response = description_service.get_description(description_request, context)
+
+    assert time.monotonic() - start < 1.5
+    assert response['score'] is not None
@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from util import metrics, utils
+
+
+def test_registry_renders_the_prometheus_text_format():
+    registry = metrics.Registry()
+    registry.counter('requests_total', "Requests", ['route']).labels('/a"b').inc(2)
+    registry.gauge('engines', "Engines").set_function(lambda: 3)
+    histogram = registry.histogram('seconds', "Seconds", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+
+    assert registry.render().splitlines() == [
+        '# HELP requests_total Requests', '# TYPE requests_total counter', 'requests_total{route="/a\\"b"} 2.0',
+        '# HELP engines Engines', '# TYPE engines gauge', 'engines 3.0',
+        '# HELP seconds Seconds', '# TYPE seconds histogram',
+        'seconds_bucket{le="0.1"} 1', 'seconds_bucket{le="1.0"} 2', 'seconds_bucket{le="+Inf"} 3',
+        'seconds_sum 5.55', 'seconds_count 3']
+
+
+def test_registering_a_metric_again_returns_the_first():
+    registry = metrics.Registry()
+    first = registry.gauge('engines', "Engines")
+    assert registry.gauge('engines', "Engines") is first
+
+
+def get_count(histogram: metrics.Histogram, *labels) -> int:
+    return sum(histogram.labels(*labels).counts)
+
+
+def test_timed_records_functions_and_coroutine_functions():
+    @metrics.timed('test.sync')
+    def sync():
+        time.sleep(0.01)
+        raise ValueError
+
+    @metrics.timed('test.async')
+    async def coroutine():
+        await asyncio.sleep(0.01)
+        return 1
+
+    try:
+        sync()
+    except ValueError:
+        pass
+    assert asyncio.run(coroutine()) == 1
+    assert get_count(metrics.STAGE_SECONDS, 'test.sync') == get_count(metrics.STAGE_SECONDS, 'test.async') == 1
+    assert metrics.STAGE_SECONDS.labels('test.sync').sum >= 0.01
+
+
+def test_requests_are_timed_by_route_template():
+    app = FastAPI()
+    utils.configure_app(app)
+
+    @app.get('/test_items/{item_id}')
+    async def get_item(item_id: int):
+        return item_id
+
+    unmatched = get_count(metrics.REQUEST_SECONDS, 'GET', 'unmatched', '404')
+    client = TestClient(app)
+    for path in ('/test_items/1', '/test_items/2', '/test_items/x'):
+        client.get(path)
+    client.get('/test_missing')
+    response = client.get('/metrics')
+
+    assert response.headers['content-type'] == metrics.CONTENT_TYPE
+    counts = [line for line in response.text.splitlines() if line.startswith('chapi_request_seconds_count')]
+    assert 'chapi_request_seconds_count{method="GET",route="/test_items/{item_id}",status="200"} 2' in counts
+    assert 'chapi_request_seconds_count{method="GET",route="/test_items/{item_id}",status="422"} 1' in counts
+    assert get_count(metrics.REQUEST_SECONDS, 'GET', 'unmatched', '404') == unmatched + 1
@@ -0,0 +1,56 @@
+import chess
+
+from domain.opening_book import OpeningBook
+
+
+def get_opening(name, move_stack):
+    board = chess.Board()
+    for move in move_stack.split():
+        board.push_uci(move)
+    return {'eco_classification': 'C00', 'name': name, 'move_stack': move_stack, 'explorer_link': None,
+            'wiki_link': None, 'epd': board.epd()}
+
+
+OPENINGS = [get_opening("King's Pawn Game", 'e2e4'),
+            get_opening('French Defense', 'e2e4 e7e6'),
+            get_opening('Sicilian Defense', 'e2e4 c7c5'),
+            get_opening('French Defense: Normal Variation', 'e2e4 e7e6 d2d4 d7d5'),
+            get_opening("Queen's Pawn Game", 'd2d4'),
+            get_opening('Transposed French', 'd2d4 e7e6 e2e4')]
+
+
+def test_exact_move_stack_lookup():
+    book = OpeningBook(OPENINGS)
+    assert [opening['name'] for opening in book.query_opening_by_move_stack(['e2e4', 'e7e6'])] == ['French Defense']
+    assert book.query_opening_by_move_stack(['e2e4', 'e7e5']) == []
+    assert book.query_opening_by_move_stack(['h2h4']) == []
+
+
+def test_continuations_within_the_given_plies():
+    book = OpeningBook(OPENINGS)
+    one_ply = {opening['name'] for opening in book.query_opening_by_move_stack_subset('e2e4')}
+    three_plies = {opening['name'] for opening in book.query_opening_by_move_stack_subset('e2e4', plies=3)}
+
+    assert one_ply == {'French Defense', 'Sicilian Defense'}
+    assert three_plies == one_ply | {'French Defense: Normal Variation'}
+    assert book.query_opening_by_move_stack_subset('h2h4') == []
+
+
+def test_transpositions_are_found_by_epd():
+    book = OpeningBook(OPENINGS)
+    epd = OPENINGS[-1]['epd']
+    assert {opening['name'] for opening in book.query_opening_by_epd(epd)} == {'Transposed French'}
+    assert book.query_opening_by_epd(OPENINGS[1]['epd']) == [OPENINGS[1]]
+
+
+def test_book_loads_from_the_tsv_files():
+    book = OpeningBook.from_tsv()
+    names = {opening['name'] for opening in book.query_opening_by_move_stack(['e2e4', 'e7e5', 'g1f3', 'b8c6',
+                                                                              'f1b5'])}
+    assert 'Ruy Lopez' in names
+
+
+def test_lookups_return_copies():
+    book = OpeningBook(OPENINGS)
+    book.query_opening_by_move_stack(['e2e4']).clear()
+    assert len(book.query_opening_by_move_stack(['e2e4'])) == 1
@@ -0,0 +1,81 @@
+from collections import Counter
+
+import chess
+import chess.engine
+import pytest
+
+from data.evaluate_openings import get_positions
+from engine.evaluation_cache import get_epd
+from engine.opening_evaluations import OpeningEvaluations, write_entries
+from engine.stockfish import Engine
+from service.stockfish_service import StockfishService
+
+AFTER_E4 = 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1'
+ENTRIES = {get_epd(chess.STARTING_FEN): {'score': '35', 'depth': 20, 'pv': 'e2e4 e7e5', 'time_limit': None},
+           get_epd(AFTER_E4): {'score': '#-3', 'depth': 20, 'pv': 'c7c5', 'time_limit': None}}
+
+
+@pytest.fixture
+def opening_evaluations(tmp_path):
+    path = str(tmp_path / 'openings.tsv')
+    write_entries(path, ENTRIES)
+    return OpeningEvaluations.from_tsv(path)
+
+
+@pytest.fixture
+def engine_searches(monkeypatch):
+    searches = Counter()
+    for name in ('analyse', 'play_lines'):
+        method = getattr(Engine, name)
+
+        def counted(self, *args, method=method, name=name, **kwargs):
+            searches[name] += 1
+            return method(self, *args, **kwargs)
+
+        monkeypatch.setattr(Engine, name, counted)
+    return searches
+
+
+def test_table_is_read_back_as_analyses(opening_evaluations):
+    assert len(opening_evaluations) == 2
+    info = opening_evaluations.get(chess.STARTING_FEN.replace(' 0 1', ' 0 7'))
+    assert info['score'].white() == chess.engine.Cp(35)
+    assert info['depth'] == 20
+    assert opening_evaluations.get(AFTER_E4)['score'].relative == chess.engine.Mate(-3)
+    assert opening_evaluations.get('8/8/8/8/8/8/8/K6k w - - 0 1') is None
+
+    best_move = opening_evaluations.get_best_move(chess.STARTING_FEN)
+    assert (best_move.move, best_move.ponder) == (chess.Move.from_uci('e2e4'), chess.Move.from_uci('e7e5'))
+    assert opening_evaluations.get_best_move(AFTER_E4).ponder is None
+
+
+def test_missing_table_is_empty(tmp_path):
+    assert len(OpeningEvaluations.from_tsv(str(tmp_path / 'missing.tsv'))) == 0
+
+
+def test_only_full_strength_analyses_come_from_the_table(engine_pool, opening_evaluations, engine_searches):
+    stockfish_service = StockfishService(engine_pool, opening_evaluations=opening_evaluations)
+
+    assert stockfish_service.analyse(chess.STARTING_FEN, 0.05)['depth'] == 20
+    assert engine_searches['analyse'] == 0
+    stockfish_service.analyse(chess.STARTING_FEN, 0.05, options=stockfish_service.get_play_options(3))
+    assert engine_searches['analyse'] == 1
+
+
+def test_only_the_strongest_difficulty_plays_from_the_table(engine_pool, opening_evaluations, engine_searches):
+    stockfish_service = StockfishService(engine_pool, opening_evaluations=opening_evaluations)
+
+    assert stockfish_service.get_best_move(chess.STARTING_FEN, 9).move == chess.Move.from_uci('e2e4')
+    assert engine_searches['play_lines'] == 0
+    stockfish_service.get_best_move(chess.STARTING_FEN, 3, 0.05)
+    assert engine_searches['play_lines'] == 1
+
+
+def test_positions_cover_every_ply_of_the_lines(tmp_path):
+    (tmp_path / 'a.tsv').write_text('eco\tname\tpgn\tuci\tepd\n'
+                                    'C20\tKing\'s Pawn Game\t1. e4 e5\te2e4 e7e5\t-\n'
+                                    'C00\tFrench Defense\t1. e4 e6\te2e4 e7e6\t-\n')
+    positions = get_positions(str(tmp_path))
+
+    assert len(positions) == 4
+    assert positions[get_epd(AFTER_E4)] == AFTER_E4
@@ -0,0 +1,37 @@
+def test_batch_keeps_the_order_of_its_sentences(paraphrase_model):
+    assert paraphrase_model.generate_batch(['take the pawn', 'check', 'castle', 'take the rook']) == \
+        ['TAKE THE PAWN', 'CHECK', 'CASTLE', 'TAKE THE ROOK']
+
+
+def test_prompts_of_equal_length_share_a_sample_call(paraphrase_model):
+    paraphrase_model.generate_batch(['take the pawn', 'check', 'take the rook', 'check'])
+    assert sorted(size for size, _, _ in paraphrase_model.batches) == [2, 2]
+
+    paraphrase_model.batches.clear()
+    paraphrase_model.generate_paraphrases('check', 3)
+    assert [size for size, _, _ in paraphrase_model.batches] == [3]
+
+
+def test_budget_grows_with_the_sentence(paraphrase_model):
+    short = paraphrase_model.encoder.encode(paraphrase_model.INPUT.format('check'))
+    long = paraphrase_model.encoder.encode(paraphrase_model.INPUT.format('you bring the knight out ' * 10))
+    assert paraphrase_model.get_token_budget(short) < paraphrase_model.get_token_budget(long)
+    assert paraphrase_model.get_token_budget(long) > 2 * len('you bring the knight out ' * 10)
+
+
+def test_long_sentences_are_paraphrased_whole(paraphrase_model):
+    original = 'you bring the knight out to f3 and threaten the pawn on e5 ' * 3
+    assert paraphrase_model.generate_batch([original]) == [original.upper()]
+
+
+def test_max_new_tokens_caps_the_budget(paraphrase_model):
+    paraphrase_model.max_new_tokens = 16
+    assert paraphrase_model.get_token_budget(paraphrase_model.encoder.encode('you bring the knight out ' * 10)) == 16
+    assert paraphrase_model.get_token_budget([1]) == 1 * paraphrase_model.LENGTH_RATIO + \
+        paraphrase_model.LENGTH_MARGIN
+
+
+def test_budget_stays_within_the_context(paraphrase_model):
+    paraphrase_model.generate_batch(['x' * 900])
+    [(_, prompt_length, length)] = paraphrase_model.batches
+    assert prompt_length + length == paraphrase_model.MAX_CONTEXT
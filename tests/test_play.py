@@ -0,0 +1,45 @@
+import asyncio
+import time
+
+import chess
+
+from service.stockfish_service import StockfishService
+
+
+def get_play_request(wait=False, difficulty=5, fen=chess.STARTING_FEN):
+    return {'id': 'game', 'fen': fen, 'difficulty': difficulty, 'time_limit': 0.05, 'wait': wait}
+
+
+def test_wait_ranges_fall_back_to_the_shared_range(sqlite_config):
+    import chapi
+
+    (sqlite_config / 'config.ini').write_text('[PLAY]\nwait=0.5,1\nwait_9=2,3.5\n')
+    wait_ranges = chapi.read_wait_ranges()
+    assert wait_ranges[1] == (0.5, 1.0)
+    assert wait_ranges[9] == (2.0, 3.5)
+
+
+def test_wait_time_is_drawn_from_the_difficulty_range():
+    stockfish_service = StockfishService(wait_ranges={1: (0.2, 0.4)})
+    assert all(0.2 <= stockfish_service.get_wait_time(1) <= 0.4 for _ in range(100))
+    assert all(0 <= stockfish_service.get_wait_time(5) <= 1 for _ in range(100))
+    stockfish_service.engine_pool.close()
+
+
+def test_waiting_responses_do_not_block_each_other(run_chapi):
+    async def test(client):
+        start = time.monotonic()
+        response = await client.post('/play', json=get_play_request())
+        unwaited = time.monotonic() - start
+
+        start = time.monotonic()
+        responses = await asyncio.gather(*[client.post('/play', json=get_play_request(wait=True)) for _ in range(4)])
+        return response, unwaited, responses, time.monotonic() - start
+
+    response, unwaited, responses, waited = run_chapi(test, '[PLAY]\nwait=0.5,0.5\n')
+    assert response.status_code == 200
+    assert chess.Move.from_uci(response.json()['move']) in chess.Board().legal_moves
+    assert unwaited < 0.4
+    assert all(response.status_code == 200 for response in responses)
+    # four responses each held back for half a second, in about half a second altogether
+    assert 0.5 <= waited < 0.9
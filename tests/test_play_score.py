@@ -0,0 +1,74 @@
+import asyncio
+from collections import Counter
+
+import chess
+import chess.engine
+import pytest
+
+from domain.client_json import PlayRequest
+from engine.engine_pool import AsyncEnginePool
+from engine.stockfish import Engine, AsyncEngine
+from service.stockfish_service import StockfishService, get_line_result, get_search_score
+
+POSITIONS = [chess.STARTING_FEN,
+             'r1bqkbnr/pppp1ppp/2n5/1B2p3/4P3/5N2/PPPP1PPP/RNBQK2R b KQkq - 3 3',
+             'r1bqk2r/pppp1ppp/2n2n2/2b1p3/2B1P3/3P1N2/PPP2PPP/RNBQK2R w KQkq - 1 5',
+             '8/5pk1/6p1/8/3R4/6P1/5PK1/2r5 w - - 0 40']
+
+
+@pytest.fixture
+def engine_calls(monkeypatch):
+    """
+    Counts the searches of every engine by method name.
+    """
+
+    calls = Counter()
+    for engine_class in (Engine, AsyncEngine):
+        for name in ('play', 'analyse', 'play_lines'):
+            method = getattr(engine_class, name)
+
+            def counted(self, *args, method=method, name=name, **kwargs):
+                calls[name] += 1
+                return method(self, *args, **kwargs)
+
+            monkeypatch.setattr(engine_class, name, counted)
+    return calls
+
+
+def get_requests(difficulty):
+    return [PlayRequest(id=str(i), fen=fen, difficulty=difficulty, time_limit=0.05, wait=False)
+            for i, fen in enumerate(POSITIONS)]
+
+
+# a reduced skill level picks its move among the lines searched at some depth, so no second search is needed
+@pytest.mark.parametrize('difficulty', [1, 5, 9, 10])
+def test_play_scores_the_move_from_its_own_search(engine_pool, engine_calls, difficulty):
+    stockfish_service = StockfishService(engine_pool)
+    results = [stockfish_service.get_stockfish_play_result(request) for request in get_requests(difficulty)]
+
+    assert all(result.move is not None and result.score is not None for result in results)
+    assert engine_calls == {'play_lines': len(POSITIONS)}
+
+
+def test_async_play_scores_the_move_from_its_own_search(engine_calls):
+    async def run():
+        stockfish_service = StockfishService(async_engine_pool=await AsyncEnginePool.open(1))
+        try:
+            return [await stockfish_service.get_stockfish_play_result_async(request) for request in get_requests(1)]
+        finally:
+            await stockfish_service.async_engine_pool.close()
+            stockfish_service.engine_pool.close()
+
+    results = asyncio.run(run())
+    assert all(result.score is not None for result in results)
+    assert engine_calls == {'play_lines': len(POSITIONS)}
+
+
+def test_moves_outside_the_searched_lines_have_no_search_score():
+    e4, d4 = chess.Move.from_uci('e2e4'), chess.Move.from_uci('d2d4')
+    lines = {e4: {'pv': [e4], 'score': chess.engine.PovScore(chess.engine.Cp(30), chess.WHITE)}}
+
+    assert get_line_result(chess.engine.BestMove(e4, None), lines).info is lines[e4]
+    assert get_search_score(e4, get_line_result(chess.engine.BestMove(e4, None), lines).info) is not None
+    assert get_line_result(chess.engine.BestMove(d4, None), lines).info == {}
+    assert get_search_score(d4, {}) is None
@@ -0,0 +1,53 @@
+import time
+
+import chess
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+
+def get_play_request(time_limit):
+    return {'id': 'game', 'fen': chess.STARTING_FEN, 'difficulty': 9, 'time_limit': time_limit, 'wait': False}
+
+
+def receive_until_result(websocket) -> list:
+    messages = [websocket.receive_json()]
+    while 'move' not in messages[-1]:
+        messages.append(websocket.receive_json())
+    return messages
+
+
+def test_search_progress_is_streamed_before_the_result(chapi_client):
+    with chapi_client.websocket_connect('/play/stream') as websocket:
+        websocket.send_json(get_play_request(0.2))
+        messages = receive_until_result(websocket)
+
+    *progress, result = messages
+    assert progress
+    assert all(set(message) == {'depth', 'score', 'pv'} for message in progress)
+    assert result['id'] == 'game'
+    assert chess.Move.from_uci(result['move']) in chess.Board().legal_moves
+
+
+def test_any_message_stops_the_search_with_the_best_move_so_far(chapi_client):
+    with chapi_client.websocket_connect('/play/stream') as websocket:
+        websocket.send_json(get_play_request(30))
+        websocket.receive_json()
+        start = time.monotonic()
+        websocket.send_text('stop')
+        result = receive_until_result(websocket)[-1]
+        stopped = time.monotonic() - start
+
+    assert stopped < 5
+    assert chess.Move.from_uci(result['move']) in chess.Board().legal_moves
+
+
+@pytest.mark.parametrize('send, detail', [(lambda websocket: websocket.send_json({'id': 'game'}), list),
+                                          (lambda websocket: websocket.send_json(['game']), str),
+                                          (lambda websocket: websocket.send_text('not json'), str)])
+def test_invalid_play_requests_are_rejected(chapi_client, send, detail):
+    with chapi_client.websocket_connect('/play/stream') as websocket:
+        send(websocket)
+        assert isinstance(websocket.receive_json()['detail'], detail)
+        with pytest.raises(WebSocketDisconnect) as disconnect:
+            websocket.receive_json()
+    assert disconnect.value.code == 1008
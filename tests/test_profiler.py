@@ -0,0 +1,93 @@
+import asyncio
+import os
+import pstats
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from util import profiler
+
+
+def wait_on_engine():
+    with profiler.uci_wait():
+        time.sleep(0.01)
+    return 'moved'
+
+
+def get_client(directory, max_profiles=profiler.DEFAULT_MAX_PROFILES) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(profiler.ProfilerMiddleware, directory=str(directory), max_profiles=max_profiles)
+
+    @app.get('/play')
+    async def play():
+        return await profiler.run_in_threadpool(wait_on_engine)
+
+    @app.get('/think')
+    async def think():
+        await asyncio.sleep(0.05)
+        return await profiler.run_in_threadpool(wait_on_engine)
+
+    return TestClient(app)
+
+
+def get_files(directory, extension) -> list:
+    return sorted(entry for entry in os.listdir(directory) if entry.endswith(extension))
+
+
+def test_requested_profiles_are_written_with_the_uci_wait(tmp_path):
+    client = get_client(tmp_path)
+    assert client.get('/play').json() == 'moved'
+    assert os.listdir(tmp_path) == []
+
+    assert client.get('/play', headers={'X-Profile': '1'}).json() == 'moved'
+    [dump], [report] = get_files(tmp_path, '.prof'), get_files(tmp_path, '.txt')
+    assert dump.endswith('-GET-play.prof')
+
+    report = (tmp_path / report).read_text()
+    assert report.startswith('GET /play ')
+    assert 'over 1 engine calls' in report
+    assert 'shared with other requests' not in report
+    functions = {function for _, _, function in pstats.Stats(str(tmp_path / dump)).stats}
+    assert {'wait_on_engine', 'play'} <= functions
+
+
+def test_event_loop_is_only_profiled_for_requests_running_alone(tmp_path):
+    app = get_client(tmp_path).app
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://chapi') as client:
+            await asyncio.gather(client.get('/think', headers={'X-Profile': '1'}), client.get('/think'))
+
+    asyncio.run(run())
+    [dump], [report] = get_files(tmp_path, '.prof'), get_files(tmp_path, '.txt')
+    assert 'shared with other requests' in (tmp_path / report).read_text()
+    functions = {function for _, _, function in pstats.Stats(str(tmp_path / dump)).stats}
+    assert 'wait_on_engine' in functions and 'think' not in functions
+
+
+def test_only_the_latest_profiles_are_kept(tmp_path):
+    client = get_client(tmp_path, max_profiles=2)
+    for _ in range(3):
+        client.get('/play?profile=1')
+    assert len(get_files(tmp_path, '.prof')) == 2
+    assert len(get_files(tmp_path, '.txt')) == 2
+
+    # a restarted server counts the profiles already in the directory
+    get_client(tmp_path, max_profiles=2).get('/play?profile=1')
+    assert len(get_files(tmp_path, '.prof')) == 2
+
+
+@pytest.mark.parametrize('headers, query_string, requested', [([(b'x-profile', b'1')], b'', True),
+                                                              ([(b'x-profile', b'0')], b'', False),
+                                                              ([], b'profile=true', True),
+                                                              ([], b'profile=false', False),
+                                                              ([], b'other=1', False)])
+def test_profiling_is_requested_by_header_or_query(headers, query_string, requested):
+    assert profiler.is_requested({'headers': headers, 'query_string': query_string}) is requested
+
+
+def test_uci_wait_is_a_no_op_outside_profiled_requests():
+    assert wait_on_engine() == 'moved'
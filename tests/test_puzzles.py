@@ -0,0 +1,88 @@
+import time
+from array import array
+
+import chess
+import pytest
+import sqlalchemy as db
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+import chapi
+from domain.entities import Base, SingleMove, MateInN
+from service.puzzle_sampler import PuzzleSampler, PuzzleIndexError, sample_ids
+from service.puzzle_service import PuzzleService
+
+
+@pytest.fixture
+def puzzle_service(puzzle_database):
+    puzzle_service = PuzzleService()
+    yield puzzle_service
+    puzzle_service.stop()
+
+
+@pytest.fixture
+def client(puzzle_service, monkeypatch):
+    # the puzzle routes only need the puzzle service, so the engines started on startup are left out
+    monkeypatch.setattr(chapi, 'puzzle_service', puzzle_service)
+    return TestClient(chapi.app)
+
+
+def test_sample_ids_are_distinct_and_clamped():
+    index = {'fork': array('q', range(1000))}
+    assert len(set(sample_ids(index, 'fork', 10))) == 10
+    assert len(sample_ids(index, 'fork', 100000)) == PuzzleSampler.MAX_K
+    assert sample_ids(index, 'fork', -1) == []
+    assert sample_ids(index, 'pin', 10) == []
+    assert len(sample_ids({'fork': array('q', range(3))}, 'fork', 10)) == 3
+
+
+def test_sampler_indexes_puzzles_by_type_and_moves_to_mate(puzzle_service):
+    sampler = puzzle_service.sampler
+    assert len(sampler.single_move_ids['fork']) == 20
+    assert set(sampler.mate_in_n_ids) == {1, 2}
+
+    puzzles = sampler.get_single_move_puzzles('fork', 5)
+    assert len({puzzle['id'] for puzzle in puzzles}) == 5
+    assert {puzzle['type'] for puzzle in puzzles} == {'fork'}
+    assert {puzzle['moves_to_mate'] for puzzle in sampler.get_mate_in_n_puzzles(2, 50)} == {2}
+
+
+def test_puzzle_routes_return_k_distinct_puzzles(client):
+    puzzles = client.get('/single_move/pin/4').json()
+    assert len({puzzle['id'] for puzzle in puzzles}) == 4
+    assert client.get('/single_move/pin').json()['type'] == 'pin'
+    assert len(client.get('/mate_in/1/3').json()) == 3
+    assert client.get('/mate_in/1').json()['moves_to_mate'] == 1
+
+
+@pytest.mark.parametrize('path', ['/single_move/fork/-1', '/single_move/fork/0', '/single_move/fork/100000',
+                                  '/single_move/fork/many', '/mate_in/1/-1', '/mate_in/1/100000', '/mate_in/one',
+                                  '/mate_in/one/2'])
+def test_puzzle_routes_reject_invalid_counts(client, path):
+    assert client.get(path).status_code == 422
+
+
+def test_sampler_starts_without_the_tables_and_retries(sqlite_config, monkeypatch):
+    monkeypatch.setattr(PuzzleSampler, 'RETRY_INTERVAL', 0.05)
+    sampler = PuzzleSampler()
+    try:
+        assert not sampler.loaded
+        with pytest.raises(PuzzleIndexError):
+            sampler.get_single_move_puzzles('fork')
+
+        engine = db.create_engine('sqlite:///{}'.format(sqlite_config / 'chess.db'))
+        Base.metadata.create_all(engine, tables=[SingleMove.__table__, MateInN.__table__])
+        with Session(bind=engine) as session:
+            session.add(SingleMove(id=1, gain=0.5, starting_fen=chess.STARTING_FEN, ending_fen=chess.STARTING_FEN,
+                                   type='fork', move='e2e4', to_move='white'))
+            session.commit()
+        engine.dispose()
+
+        for _ in range(100):
+            if sampler.loaded:
+                break
+            time.sleep(0.05)
+        assert [puzzle['id'] for puzzle in sampler.get_single_move_puzzles('fork')] == [1]
+        assert sampler.get_mate_in_n_puzzles(1) == []
+    finally:
+        sampler.stop()
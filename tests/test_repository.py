@@ -0,0 +1,52 @@
+import configparser
+
+import sqlalchemy as db
+
+from domain import repository
+from domain.repository import Repository
+
+
+def get_config(text):
+    config = configparser.ConfigParser()
+    config.read_string(text)
+    return config
+
+
+MYSQL = """
+[DB_CREDENTIALS]
+user=chapi
+password=secret
+host=db
+"""
+
+
+def test_connection_string_is_filled_in_from_the_credentials():
+    assert repository.get_connection_string(get_config(MYSQL), Repository.connection_string) == \
+        'mysql://chapi:secret@db/chess_db'
+    config = get_config(MYSQL + 'url=sqlite:///chess.db\n')
+    assert repository.get_connection_string(config, Repository.connection_string) == 'sqlite:///chess.db'
+
+
+def test_pool_options_default_and_come_from_db_pool():
+    defaults = repository.get_pool_options(get_config(MYSQL))
+    assert defaults['pool_size'] == repository.DEFAULT_POOL_SIZE
+    assert defaults['pool_pre_ping']
+
+    options = repository.get_pool_options(get_config(MYSQL + '[DB_POOL]\npool_size=3\npool_recycle=60\n'))
+    assert options['pool_size'] == 3
+    assert options['pool_recycle'] == 60
+    assert options['max_overflow'] == repository.DEFAULT_MAX_OVERFLOW
+
+
+def test_sqlite_has_no_pool_options():
+    assert repository.get_engine_options(get_config(MYSQL), 'sqlite:///chess.db') == {}
+    assert repository.get_engine_options(get_config(MYSQL), 'mysql://chapi:secret@db/chess_db') != {}
+
+
+def test_repositories_share_one_engine_and_close_their_sessions(puzzle_database):
+    first, second = Repository(), Repository()
+    assert first.session_factory is second.session_factory
+
+    with first.session_scope() as session:
+        assert session.execute(db.text('select count(*) from single_move')).scalar() == 40
+    assert not session.in_transaction()
@@ -0,0 +1,117 @@
+import multiprocessing
+import time
+from array import array
+
+import pytest
+
+from domain.opening_book import OpeningBook
+from util import utils
+from util.shared_store import SharedStore, save_index, load_index
+
+
+def compute_slowly(log_path):
+    with open(log_path, 'a') as file:
+        file.write('computed\n')
+    time.sleep(0.2)
+    return {'rows': 3}
+
+
+def get_from_store(path, log_path, results):
+    results.put(SharedStore(path).get_or_compute('statistics', lambda: compute_slowly(log_path)))
+
+
+def test_workers_missing_together_compute_once(tmp_path):
+    path, log_path = str(tmp_path / 'shared.db'), str(tmp_path / 'computed.log')
+    SharedStore(path)
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    workers = [context.Process(target=get_from_store, args=(path, log_path, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    values = [results.get(timeout=30) for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    assert values == [{'rows': 3}] * 4
+    with open(log_path) as file:
+        assert file.read() == 'computed\n'
+
+
+def test_values_older_than_max_age_are_computed_again(tmp_path):
+    store = SharedStore(str(tmp_path / 'shared.db'))
+    store.put('statistics', 1)
+    assert store.get('statistics') == 1
+    assert store.get('statistics', max_age=60) == 1
+    assert store.get('statistics', max_age=0) is None
+    assert store.get_or_compute('statistics', lambda: 2, max_age=0) == 2
+    assert store.get('statistics') == 2
+
+
+def test_failed_computations_are_not_stored(tmp_path):
+    store = SharedStore(str(tmp_path / 'shared.db'))
+
+    def fail():
+        raise RuntimeError('database unreachable')
+
+    with pytest.raises(RuntimeError):
+        store.get_or_compute('statistics', fail)
+    assert store.get('statistics') is None
+    assert store.get_or_compute('statistics', lambda: 1) == 1
+
+
+def test_indexes_are_memory_mapped_back(tmp_path):
+    path = str(tmp_path / 'ids.bin')
+    save_index(path, {'fork': array('q', [3, 1, 2]), 'pin': array('q'), 2: array('q', [2 ** 40])})
+    index = load_index(path)
+    assert {key: list(ids) for key, ids in index.items()} == {'fork': [3, 1, 2], 'pin': [], 2: [2 ** 40]}
+
+
+class OpeningRepository:
+    def __init__(self, openings):
+        self.openings = openings
+        self.queries = 0
+
+    def query_openings(self):
+        self.queries += 1
+        return self.openings
+
+
+OPENING = {'eco_classification': 'C60', 'name': 'Ruy Lopez', 'move_stack': 'e2e4 e7e5 g1f3 b8c6 f1b5',
+           'explorer_link': None, 'wiki_link': 'https://en.wikipedia.org/wiki/Ruy_Lopez', 'epd': None}
+
+
+def test_openings_are_read_once_for_every_worker(tmp_path):
+    store = SharedStore(str(tmp_path / 'shared.db'))
+    repository = OpeningRepository([OPENING])
+    books = [OpeningBook.from_repository(repository, store) for _ in range(3)]
+    assert repository.queries == 1
+    assert all(book.query_opening_by_move_stack(OPENING['move_stack'].split()) == [OPENING] for book in books)
+
+
+def test_empty_opening_table_is_not_stored(tmp_path):
+    store = SharedStore(str(tmp_path / 'shared.db'))
+    book = OpeningBook.from_repository(OpeningRepository([]), store)
+    assert len(book.query_opening_by_move_stack_subset('')) > 0
+    assert store.get('openings') is None
+
+    repository = OpeningRepository([OPENING])
+    OpeningBook.from_repository(repository, store)
+    assert repository.queries == 1
+
+
+def test_stored_openings_expire(tmp_path, monkeypatch):
+    store = SharedStore(str(tmp_path / 'shared.db'))
+    repository = OpeningRepository([OPENING])
+    OpeningBook.from_repository(repository, store)
+    monkeypatch.setattr(OpeningBook, 'STORE_MAX_AGE', 0)
+    OpeningBook.from_repository(repository, store)
+    assert repository.queries == 2
+
+
+def test_environment_overrides_config(sqlite_config, monkeypatch):
+    (sqlite_config / 'config.ini').write_text('[SERVER]\nworkers=2\n')
+    assert utils.get_workers('SERVER') == 2
+    monkeypatch.setenv('CHAPI_SERVER_WORKERS', '3')
+    assert utils.get_workers('SERVER') == 3
+    assert utils.get_workers('AGGREGATION') == 1
+    assert utils.get_cpus_per_worker(10 ** 6) == 1
@@ -0,0 +1,104 @@
+import time
+
+import chess
+from fastapi.testclient import TestClient
+
+import chapi
+from service.puzzle_service import PuzzleService
+from service.statistics_snapshot import StatisticsSnapshot
+from util.shared_store import SharedStore
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_snapshot_is_served_until_it_is_invalidated():
+    counts = [1]
+    snapshot = StatisticsSnapshot(lambda: {'count': counts[0]}, ttl=60)
+    statistics, etag = snapshot.get()
+    assert statistics == {'count': 1}
+
+    counts[0] = 2
+    assert snapshot.get() == (statistics, etag)
+    snapshot.invalidate()
+    wait_for(lambda: snapshot.get()[0] == {'count': 2})
+    assert snapshot.get()[1] != etag
+
+
+def test_etag_only_depends_on_the_statistics():
+    first = StatisticsSnapshot(lambda: {'types': ['fork'], 'counts': [3]})
+    second = StatisticsSnapshot(lambda: {'counts': [3], 'types': ['fork']})
+    assert first.get()[1] == second.get()[1]
+
+
+def test_workers_sharing_a_store_compute_once(tmp_path):
+    store = SharedStore(str(tmp_path / 'shared.db'))
+    computed = []
+
+    def compute():
+        computed.append(1)
+        return {'count': len(computed)}
+
+    snapshots = [StatisticsSnapshot(compute, store=store) for _ in range(3)]
+    assert len(computed) == 1
+    assert len({snapshot.get()[1] for snapshot in snapshots}) == 1
+
+
+def test_statistics_route_answers_matching_etags_with_not_modified(puzzle_database, monkeypatch):
+    puzzle_service = PuzzleService()
+    monkeypatch.setattr(chapi, 'puzzle_service', puzzle_service)
+    client = TestClient(chapi.app)
+    try:
+        response = client.get('/statistics')
+        assert response.status_code == 200
+        assert response.json() == {'types': ['fork', 'pin'], 'counts': [20, 20]}
+        etag = response.headers['ETag']
+
+        not_modified = client.get('/statistics', headers={'If-None-Match': etag})
+        assert not_modified.status_code == 304
+        assert not_modified.headers['ETag'] == etag
+        assert client.get('/statistics', headers={'If-None-Match': '"stale"'}).status_code == 200
+    finally:
+        puzzle_service.stop()
+
+
+def test_failed_first_computation_is_retried_in_the_background(monkeypatch):
+    monkeypatch.setattr(StatisticsSnapshot, 'RETRY_INTERVAL', 0.01)
+    tables = []
+
+    def compute():
+        if not tables:
+            raise RuntimeError("no such table: single_move")
+        return {'count': 1}
+
+    snapshot = StatisticsSnapshot(compute)
+    assert snapshot.get() == (None, None)
+    tables.append('single_move')
+    wait_for(lambda: snapshot.get()[0] == {'count': 1})
+    snapshot.stop()
+
+
+def test_stopped_snapshot_is_no_longer_refreshed():
+    computed = []
+    snapshot = StatisticsSnapshot(lambda: computed.append(1) or {'count': len(computed)}, ttl=60)
+    snapshot.stop()
+    time.sleep(0.05)
+    snapshot.invalidate()
+    time.sleep(0.05)
+    assert computed == [1]
+
+
+def test_chapi_starts_without_the_puzzle_tables(run_chapi, caplog):
+    async def test(client):
+        return [await client.get(path) for path in ('/single_move/fork', '/mate_in/1/2', '/statistics')] + \
+            [await client.post('/play', json={'id': 'game', 'fen': chess.STARTING_FEN, 'difficulty': 5,
+                                              'time_limit': 0.05, 'wait': False})]
+
+    *puzzles, play = run_chapi(test)
+    assert [response.status_code for response in puzzles] == [503, 503, 503]
+    assert play.status_code == 200
+    assert "retrying in the background" in caplog.text
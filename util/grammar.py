@@ -0,0 +1,82 @@
+import itertools
+import random
+from functools import lru_cache
+
+from nltk import CFG, Nonterminal
+
+
+class Grammar:
+    """
+    A parsed CFG along with the number of derivations of each nonterminal, which lets a sentence be sampled
+    uniformly over every derivation by walking the productions once from the start symbol.
+    """
+
+    def __init__(self, grammar: CFG):
+        self.grammar = grammar
+        self.counts = {}
+
+    def count(self, symbol):
+        if not isinstance(symbol, Nonterminal):
+            return 1
+        if symbol not in self.counts:
+            self.counts[symbol] = sum(self.count_production(production)
+                                      for production in self.grammar.productions(lhs=symbol))
+        return self.counts[symbol]
+
+    def count_production(self, production):
+        count = 1
+        for symbol in production.rhs():
+            count *= self.count(symbol)
+        return count
+
+    def sample(self, symbol=None) -> list:
+        symbol = symbol if symbol is not None else self.grammar.start()
+        if not isinstance(symbol, Nonterminal):
+            return [symbol]
+
+        productions = self.grammar.productions(lhs=symbol)
+        weights = [self.count_production(production) for production in productions]
+        if sum(weights) == 0:
+            raise ValueError("No sentence can be derived from {}".format(symbol))
+        production = random.choices(productions, weights)[0]
+        return [word for child in production.rhs() for word in self.sample(child)]
+
+    def enumerate(self, symbol=None):
+        """
+        Yield every derivation of the symbol, the start symbol by default, as a list of words.
+        """
+        symbol = symbol if symbol is not None else self.grammar.start()
+        if not isinstance(symbol, Nonterminal):
+            yield [symbol]
+            return
+
+        for production in self.grammar.productions(lhs=symbol):
+            for parts in itertools.product(*[list(self.enumerate(child)) for child in production.rhs()]):
+                yield [word for part in parts for word in part]
+
+
+class GrammarTemplate:
+    """
+    A grammar skeleton, parsed once with its slots left in as "{slot}" terminals, and the values to fill them with
+    after a sentence has been sampled.
+    """
+
+    def __init__(self, grammar: Grammar, slots: dict):
+        self.grammar = grammar
+        self.slots = slots
+
+    def sample(self) -> str:
+        return ' '.join(self.grammar.sample()).format(**self.slots)
+
+    def enumerate(self):
+        for words in self.grammar.enumerate():
+            yield ' '.join(words).format(**self.slots)
+
+
+@lru_cache(maxsize=None)
+def compile_grammar(skeleton: str) -> Grammar:
+    return Grammar(CFG.fromstring(skeleton))
+
+
+def template(skeleton: str, **slots) -> GrammarTemplate:
+    return GrammarTemplate(compile_grammar(skeleton), slots)
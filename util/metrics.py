@@ -0,0 +1,237 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metric:
+    """
+    A named metric with one child per combination of label values, children hold the actual values.
+    """
+    TYPE = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.create_child())
+        return child
+
+    def create_child(self):
+        raise NotImplementedError
+
+    def set_function(self, function, *values):
+        """
+        Read the value from the function whenever it's collected rather than keeping it up to date.
+        """
+        self.labels(*values).function = function
+
+    def collect(self) -> list:
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.TYPE)]
+        for values, child in list(self.children.items()):
+            lines.extend(child.collect(self.name, dict(zip(self.label_names, values))))
+        return lines
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def create_child(self):
+        return Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def create_child(self):
+        return Value()
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def create_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class Value:
+    __slots__ = ['value', 'function', 'lock']
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def collect(self, name, labels: dict) -> list:
+        value = self.function() if self.function is not None else self.value
+        return ['{}{} {}'.format(name, format_labels(labels), float(value))]
+
+
+class HistogramValue:
+    __slots__ = ['buckets', 'counts', 'sum', 'lock']
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def collect(self, name, labels: dict) -> list:
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            bucket_labels = dict(labels, le='+Inf' if bound == float('inf') else repr(bound))
+            lines.append('{}_bucket{} {}'.format(name, format_labels(bucket_labels), cumulative))
+        lines.append('{}_sum{} {}'.format(name, format_labels(labels), total))
+        lines.append('{}_count{} {}'.format(name, format_labels(labels), cumulative))
+        return lines
+
+
+class Registry:
+    """
+    The process's metrics, rendered in the Prometheus text format on /metrics.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labels=()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in list(self.metrics.values()) for line in metric.collect()) + '\n'
+
+
+def format_labels(labels: dict) -> str:
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in labels.items()) + '}'
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram('chapi_stage_seconds', "Time spent in each stage of handling a request",
+                                   ['stage'])
+REQUEST_SECONDS = REGISTRY.histogram('chapi_request_seconds', "Time to respond to a request, by route and status",
+                                     ['method', 'route', 'status'])
+
+
+def register_cache(name: str, cache):
+    """
+    Expose the hits, misses, size and hit rate reported by a cache's statistics().
+    """
+    REGISTRY.counter(name + '_hits_total', "Lookups answered by the cache").set_function(
+        lambda: cache.statistics()['hits'])
+    REGISTRY.counter(name + '_misses_total', "Lookups the cache couldn't answer").set_function(
+        lambda: cache.statistics()['misses'])
+    REGISTRY.gauge(name + '_size', "Entries in the cache").set_function(lambda: cache.statistics()['size'])
+    REGISTRY.gauge(name + '_hit_ratio', "Share of lookups answered by the cache").set_function(
+        lambda: cache.statistics()['hit_rate'] or 0)
+
+
+def timed(stage: str):
+    """
+    Record the duration of every call of the decorated function or coroutine function as the stage.
+    """
+
+    def decorator(function):
+        histogram = STAGE_SECONDS.labels(stage)
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start)
+        return wrapper
+
+    return decorator
+
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware timing each HTTP request by its route template, so path parameters don't split a route
+    into one series per value.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get('route')
+            REQUEST_SECONDS.labels(scope['method'], route.path if route is not None else 'unmatched',
+                                   str(status[0])).observe(time.perf_counter() - start)
@@ -0,0 +1,187 @@
+import contextvars
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import parse_qs
+
+from starlette.concurrency import run_in_threadpool as starlette_run_in_threadpool
+
+HEADER = 'x-profile'
+QUERY_PARAMETER = 'profile'
+DEFAULT_MAX_PROFILES = 50
+REPORT_LINES = 40
+
+logger = logging.getLogger('chapi')
+
+current_profile = contextvars.ContextVar('current_profile', default=None)
+
+
+class RequestProfile:
+    """
+    The call trees recorded while serving one request: the event loop's share and each function the request ran on
+    the threadpool, along with the time spent waiting on Stockfish over UCI.
+    """
+
+    def __init__(self):
+        self.profiles = []
+        self.lock = threading.Lock()
+        self.uci_wait = 0.0
+        self.uci_calls = 0
+        # set when another request ran on the event loop meanwhile, whose work the loop's profile would include
+        self.loop_shared = False
+
+    def run(self, function, *args, **kwargs):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.disable()
+            with self.lock:
+                self.profiles.append(profile)
+
+    def add_uci_wait(self, seconds):
+        with self.lock:
+            self.uci_wait += seconds
+            self.uci_calls += 1
+
+    def get_stats(self) -> pstats.Stats:
+        stats = pstats.Stats()
+        for profile in self.profiles:
+            stats.add(profile)
+        return stats
+
+
+async def run_in_threadpool(function, *args, **kwargs):
+    """
+    starlette's run_in_threadpool, except that the function is profiled as part of the request when it's profiled.
+    """
+    profile = current_profile.get()
+    if profile is None:
+        return await starlette_run_in_threadpool(function, *args, **kwargs)
+    return await starlette_run_in_threadpool(profile.run, function, *args, **kwargs)
+
+
+@contextmanager
+def uci_wait():
+    """
+    Count the body of the with block as time spent waiting on the engine, when the request is being profiled.
+    """
+
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_uci_wait(time.perf_counter() - start)
+
+
+class ProfilerMiddleware:
+    """
+    Profile the requests which ask for it with an X-Profile header or a profile query parameter. Each profile is
+    written to the directory as a pstats dump and a text report, only the most recent max_profiles are kept and the
+    file names start with the request's duration so the slowest sort last.
+    cProfile records everything on the event loop thread, so the loop's share of a request is only kept when no other
+    request was in flight at any point while it ran, otherwise the report says it was left out and only covers the
+    request's threadpool work. Background tasks on the loop, such as the engine health check, can still show up.
+    """
+
+    def __init__(self, app, directory, max_profiles=DEFAULT_MAX_PROFILES):
+        self.app = app
+        self.directory = directory
+        self.max_profiles = max_profiles
+        os.makedirs(directory, exist_ok=True)
+        self.written = deque(sorted((entry for entry in os.listdir(directory) if entry.endswith('.prof')),
+                                    key=lambda entry: os.path.getmtime(os.path.join(directory, entry))))
+        self.written_lock = threading.Lock()
+        self.in_flight = 0
+        # the request whose event loop share is being profiled, cProfile can only follow one at a time
+        self.loop_profiled = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        self.in_flight += 1
+        if self.loop_profiled is not None:
+            self.loop_profiled.loop_shared = True
+        try:
+            if is_requested(scope):
+                await self.profile(scope, receive, send)
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    async def profile(self, scope, receive, send):
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        loop_profile = None
+        if self.in_flight == 1:
+            self.loop_profiled = profile
+            loop_profile = cProfile.Profile()
+            loop_profile.enable()
+        else:
+            profile.loop_shared = True
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            duration = time.perf_counter() - start
+            if loop_profile is not None:
+                loop_profile.disable()
+                self.loop_profiled = None
+                if not profile.loop_shared:
+                    profile.profiles.append(loop_profile)
+            current_profile.reset(token)
+        try:
+            # dumping and formatting the stats would hold up every other request on the loop
+            await starlette_run_in_threadpool(self.write, scope, profile, duration)
+        except Exception as e:
+            logger.warning("Couldn't write the request profile... " + str(e))
+
+    def write(self, scope, profile: RequestProfile, duration):
+        name = '{:08d}ms-{}-{}-{}'.format(int(duration * 1000), int(time.time() * 1000), scope['method'],
+                                          re.sub(r'[^A-Za-z0-9_.-]+', '_', scope['path']).strip('_'))
+        stats = profile.get_stats()
+        stats.dump_stats(os.path.join(self.directory, name + '.prof'))
+
+        report = io.StringIO()
+        report.write('{} {} {:.1f} ms, {:.1f} ms waiting on UCI over {} engine calls\n'.format(
+            scope['method'], scope['path'], duration * 1000, profile.uci_wait * 1000, profile.uci_calls))
+        if profile.loop_shared:
+            report.write('The event loop was shared with other requests, only the threadpool work is profiled\n')
+        report.write('\n')
+        stats.stream = report
+        stats.sort_stats('cumulative').print_stats(REPORT_LINES)
+        with open(os.path.join(self.directory, name + '.txt'), 'w') as file:
+            file.write(report.getvalue())
+
+        with self.written_lock:
+            self.written.append(name + '.prof')
+            removed = [self.written.popleft() for _ in range(len(self.written) - self.max_profiles)]
+        for oldest in removed:
+            for path in [oldest, oldest[:-len('.prof')] + '.txt']:
+                try:
+                    os.remove(os.path.join(self.directory, path))
+                except FileNotFoundError:
+                    pass
+
+
+def is_requested(scope) -> bool:
+    for name, value in scope['headers']:
+        if name == HEADER.encode() and value not in (b'', b'0', b'false'):
+            return True
+    values = parse_qs(scope.get('query_string', b'').decode()).get(QUERY_PARAMETER)
+    return values is not None and values[-1] not in ('', '0', 'false')
@@ -0,0 +1,107 @@
+import json
+import mmap
+import os
+import pickle
+import sqlite3
+import struct
+import time
+from contextlib import closing
+
+
+class SharedStore:
+    """
+    SQLite file shared by the worker processes of one server. Snapshots loaded from MySQL are computed by one worker
+    under the database's write lock and read by the others, instead of every worker running the same queries.
+    """
+    COMPUTE_TIMEOUT = 300
+    CREATE_TABLE = "create table if not exists snapshot (key text primary key, value blob, updated_at real)"
+    SELECT_SNAPSHOT = "select value, updated_at from snapshot where key = ?"
+    UPSERT_SNAPSHOT = "insert or replace into snapshot (key, value, updated_at) values (?, ?, ?)"
+
+    def __init__(self, path):
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        with closing(self.connect()) as connection:
+            connection.execute("pragma journal_mode=wal")
+            connection.execute(self.CREATE_TABLE)
+
+    def connect(self):
+        # a connection per call, sqlite connections can't be shared between threads and opening one is cheap
+        return sqlite3.connect(self.path, timeout=self.COMPUTE_TIMEOUT, isolation_level=None)
+
+    def get(self, key, max_age=None):
+        """
+        Return the value stored under the key, or None when there is none or it's older than max_age seconds.
+        """
+
+        with closing(self.connect()) as connection:
+            return get_fresh(connection.execute(self.SELECT_SNAPSHOT, (key,)).fetchone(), max_age)
+
+    def put(self, key, value):
+        with closing(self.connect()) as connection:
+            connection.execute(self.UPSERT_SNAPSHOT, (key, pickle.dumps(value), time.time()))
+
+    def get_or_compute(self, key, compute, max_age=None):
+        """
+        Return the stored value if it's fresh enough, otherwise compute and store it. Workers missing at the same
+        time queue on the write lock and find the value the first one stored rather than computing it again.
+        """
+
+        value = self.get(key, max_age)
+        if value is not None:
+            return value
+
+        with closing(self.connect()) as connection:
+            connection.execute("begin immediate")
+            try:
+                value = get_fresh(connection.execute(self.SELECT_SNAPSHOT, (key,)).fetchone(), max_age)
+                if value is None:
+                    value = compute()
+                    connection.execute(self.UPSERT_SNAPSHOT, (key, pickle.dumps(value), time.time()))
+                connection.execute("commit")
+            except BaseException:
+                connection.execute("rollback")
+                raise
+        return value
+
+    def get_path(self, name):
+        return os.path.join(self.directory, name)
+
+
+def get_fresh(row, max_age=None):
+    if row is None or (max_age is not None and time.time() - row[1] > max_age):
+        return None
+    return pickle.loads(row[0])
+
+
+def save_index(path, index: dict):
+    """
+    Write a dict of int64 id arrays to a file that load_index maps into memory. The file is replaced atomically,
+    workers still mapping the previous version keep reading it until they reload.
+    """
+
+    header = json.dumps([[key, len(ids)] for key, ids in index.items()]).encode()
+    header += b' ' * (-len(header) % 8)
+    with open(path + '.tmp', 'wb') as file:
+        file.write(struct.pack('<q', len(header)))
+        file.write(header)
+        for ids in index.values():
+            file.write(ids.tobytes())
+    os.replace(path + '.tmp', path)
+
+
+def load_index(path) -> dict:
+    """
+    Map a file written by save_index read only. The ids are memoryviews over the mapping, so every worker reading
+    the same file shares one copy in the page cache.
+    """
+
+    with open(path, 'rb') as file:
+        view = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+    header_length = struct.unpack_from('<q', view)[0]
+    offset = 8 + header_length
+    index = {}
+    for key, count in json.loads(bytes(view[8:offset])):
+        index[key] = view[offset:offset + count * 8].cast('q')
+        offset += count * 8
+    return index
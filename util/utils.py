@@ -1,13 +1,17 @@
+import configparser
 import logging
-import random
+import os
 
 import chess
-from fastapi import FastAPI
-from nltk.parse.generate import generate
+from fastapi import FastAPI, Response
 from starlette.middleware.cors import CORSMiddleware
 
+from util import metrics, profiler
+from util.grammar import GrammarTemplate
+
 BLACK = "black"
 WHITE = "white"
+CONFIG_FILE = 'config.ini'
 
 ORIGINS = [
     "http://localhost",
@@ -23,6 +27,41 @@ def configure_app(app: FastAPI):
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    app.add_middleware(metrics.MetricsMiddleware)
+    profile_directory = read_config('PROFILING', 'directory', fallback=None)
+    if profile_directory:
+        app.add_middleware(profiler.ProfilerMiddleware, directory=profile_directory,
+                           max_profiles=int(read_config('PROFILING', 'max_profiles',
+                                                        fallback=profiler.DEFAULT_MAX_PROFILES)))
+    app.add_api_route("/metrics", get_metrics, methods=["GET"], include_in_schema=False)
+
+
+async def get_metrics():
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def read_config(section: str, option: str, fallback=None):
+    """
+    Read an option from config.ini, a CHAPI_<SECTION>_<OPTION> environment variable takes precedence when it's set.
+    """
+
+    value = os.environ.get('CHAPI_{}_{}'.format(section, option).upper())
+    if value is not None:
+        return value
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE)
+    return config.get(section, option, fallback=fallback)
+
+
+def get_workers(section: str) -> int:
+    return max(1, int(read_config(section, 'workers', fallback=1)))
+
+
+def get_cpus_per_worker(workers: int) -> int:
+    """
+    The worker's share of the machine's cores, so the engines or threads of every worker together fit the CPU.
+    """
+    return max(1, (os.cpu_count() or 1) // workers)
 
 
 def get_piece_name(uci, fen):
@@ -61,12 +100,10 @@ def format_name(original_opening: list, opening: str):
     return opening
 
 
-def get_random_generation(grammar):
+@metrics.timed('grammar.sample')
+def get_random_generation(grammar: GrammarTemplate):
     try:
-        descriptions = []
-        for description in generate(grammar):
-            descriptions.append(' '.join(description))
-        return [random.choice(descriptions)]
+        return [grammar.sample()]
     except Exception as e:
         print(e)
         return []